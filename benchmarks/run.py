@@ -0,0 +1,96 @@
+"""
+Times the DataCollector end to end on synthetic data
+
+Usage (from the repository folder):
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --rows 200000 --chunksizes 4096,16384 --sources 1,29 --duplicates 0.5 --options '{"max_workers": 4}'
+
+The results are written as JSON: one entry per combination of chunk size, number of sources and duplicate ratio.
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import pandas as pd
+from integrator.collector import DataCollector
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income, IndexMultipleDeprivation, Crime, Census11
+from benchmarks import synthetic
+
+
+def build_sources(engine, n_sources):
+    """
+    Returns the first n_sources sources: Income, IndexMultipleDeprivation, the two crime tables and the census tables.
+    """
+    sources = [Income(engine), IndexMultipleDeprivation(engine)] + [i for i in Crime.get_tables(engine)] + [i for i in Census11.get_tables(engine)]
+    return sources[:n_sources]
+
+
+def run_case(engine, df, chunksize, n_sources, repeat, options):
+    """
+    Runs one benchmark case. Returns the best time, the output shape and the per-source summary of the best run.
+    """
+    best = None
+    for _ in range(repeat):
+        collector = DataCollector(df, sources=build_sources(engine, n_sources), reference_sources=[PostcodeMapping], reference_engines=[engine], verbose=False, chunksize=chunksize, **options)
+        start = time.perf_counter()
+        out = collector.collect_all()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, out.shape, collector.summary())
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the DataCollector on synthetic data.')
+    parser.add_argument('--output', default='bench_results.json', help='the JSON file with the results')
+    parser.add_argument('--database', default=None, help='the DuckDB file (a temporary file by default)')
+    parser.add_argument('--lads', type=int, default=10, help='number of local authority districts in the hierarchy')
+    parser.add_argument('--rows', type=int, default=50000, help='number of rows of the input')
+    parser.add_argument('--chunksizes', default='4096,16384', help='comma separated chunk sizes')
+    parser.add_argument('--sources', default='1,4,29', help='comma separated numbers of sources')
+    parser.add_argument('--duplicates', default='0,0.5,0.9', help='comma separated ratios of repeated postcodes in the input')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (the best is kept)')
+    parser.add_argument('--options', default='{}', help='JSON with extra DataCollector arguments')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    options = json.loads(args.options)
+    database = args.database
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'integrator_bench.duckdb')
+    start = time.perf_counter()
+    engine, lookup = synthetic.create_database(database, n_lad=args.lads, seed=args.seed)
+    print('- Synthetic database with {} postcodes created in {:.2f}s ({})'.format(len(lookup), time.perf_counter() - start, database))
+
+    results = list()
+    for duplicate_ratio in [float(i) for i in args.duplicates.split(',')]:
+        df = synthetic.cohort(lookup, args.rows, duplicate_ratio=duplicate_ratio, seed=args.seed)
+        for n_sources in [int(i) for i in args.sources.split(',')]:
+            for chunksize in [int(i) for i in args.chunksizes.split(',')]:
+                elapsed, shape, summary = run_case(engine, df, chunksize, n_sources, args.repeat, options)
+                print('|- duplicates {:.2f}, {} sources, chunksize {}: {:.3f}s ({:.0f} rows/s)'.format(duplicate_ratio, n_sources, chunksize, elapsed, args.rows / elapsed))
+                results.append({'duplicate_ratio': duplicate_ratio,
+                                'sources': n_sources,
+                                'chunksize': chunksize,
+                                'rows': args.rows,
+                                'seconds': elapsed,
+                                'rows_per_second': args.rows / elapsed,
+                                'output_shape': list(shape),
+                                'per_source': summary['sources']})
+
+    with open(args.output, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'pandas': pd.__version__,
+                   'postcodes': len(lookup),
+                   'options': options,
+                   'results': results}, f, indent=2)
+    print('- Results saved to "{}"'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
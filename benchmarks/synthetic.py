@@ -0,0 +1,142 @@
+"""
+Generator of a synthetic postcode hierarchy and of the tables used by the sources
+
+The hierarchy follows the nesting of the census areas (postcode -> oa -> lsoa -> msoa -> lad) with a skewed number of children per area. The data is loaded into an embedded DuckDB database (pip install duckdb duckdb-engine) with the same schemas as the PostgreSQL database.
+"""
+
+import numpy as np
+import pandas as pd
+from integrator.sources import Census11
+
+
+LETTERS = np.array(list('ABDEFGHJLNPQRSTUWXYZ'))
+
+
+def hierarchy(n_lad=10, seed=0):
+    """
+    Creates the postcode lookup table. Returns a data frame with the columns of public.postcode_lookup11: postcode, pc, oa, lsoa, msoa, lad.
+
+    @param n_lad (default 10): number of local authority districts
+    @param seed (default 0): the random seed
+    """
+    rng = np.random.default_rng(seed)
+    # areas per parent: msoa per lad is skewed (big cities), lsoa per msoa and oa per lsoa are close to the census targets
+    msoa_per_lad = np.maximum(5, rng.zipf(1.6, n_lad) * 10).clip(max=150)
+    lad = np.repeat(np.arange(n_lad), msoa_per_lad)
+    lsoa_per_msoa = rng.integers(4, 7, len(lad))
+    msoa = np.repeat(np.arange(len(lad)), lsoa_per_msoa)
+    oa_per_lsoa = rng.integers(4, 7, len(msoa))
+    lsoa = np.repeat(np.arange(len(msoa)), oa_per_lsoa)
+    # postcodes per oa are skewed as well
+    pc_per_oa = rng.geometric(0.12, len(lsoa)).clip(max=80)
+    oa = np.repeat(np.arange(len(lsoa)), pc_per_oa)
+    n = len(oa)
+    outward = pd.Series(LETTERS[rng.integers(0, len(LETTERS), n)]) + pd.Series((oa // 400 + 1).astype(str))
+    inward = pd.Series((np.arange(n) % 10).astype(str)) + pd.Series(LETTERS[(np.arange(n) // 10) % len(LETTERS)]) + pd.Series(LETTERS[(np.arange(n) // 200) % len(LETTERS)])
+    df = pd.DataFrame({'postcode': outward + ' ' + inward,
+                       'oa': ['E00{:06d}'.format(i) for i in oa],
+                       'lsoa': ['E01{:06d}'.format(i) for i in lsoa[oa]],
+                       'msoa': ['E02{:06d}'.format(i) for i in msoa[lsoa[oa]]],
+                       'lad': ['E08{:06d}'.format(i) for i in lad[msoa[lsoa[oa]]]]})
+    df['pc'] = df['postcode'].str.replace(' ', '', regex=False)
+    df = df.drop_duplicates(subset='pc')
+    return df[['postcode', 'pc', 'oa', 'lsoa', 'msoa', 'lad']].reset_index(drop=True)
+
+
+def source_tables(lookup, census_columns=20, seed=0):
+    """
+    Creates the tables used by the sources. Returns a dictionary "schema.table" -> data frame.
+
+    @param lookup: the postcode lookup table (from hierarchy)
+    @param census_columns (default 20): number of columns of each census table
+    @param seed (default 0): the random seed
+    """
+    rng = np.random.default_rng(seed)
+    oa = lookup['oa'].drop_duplicates().values
+    lsoa = lookup['lsoa'].drop_duplicates().values
+    msoa = lookup['msoa'].drop_duplicates().values
+    tables = dict()
+    income = {'msoa': msoa}
+    for name in ['net_annual_income', 'net_inc_aft_housing', 'net_inc_bef_housing', 'total_income']:
+        income[name] = rng.normal(30000, 6000, len(msoa)).round(-1)
+        income[name + '_upper_ci'] = income[name] + 2000
+        income[name + '_lower_ci'] = income[name] - 2000
+        income[name + '_ci'] = 4000
+    tables['compiled.income'] = pd.DataFrame(income)
+    score = rng.gamma(2, 10, len(lsoa))
+    rank = score.argsort().argsort() + 1
+    tables['public.indexmultipledeprivation'] = pd.DataFrame({'lsoa': lsoa, 'IOMDIS': score, 'IOMDIR': rank, 'IOMDID': (rank - 1) * 10 // len(lsoa) + 1,
+                                                              'IDS': rng.gamma(2, 5, len(lsoa)), 'EDS': rng.gamma(2, 5, len(lsoa)), 'HDDS': rng.normal(0, 1, len(lsoa))})
+    for table, prefix in [('compiled.crimes_outcomes_yearly', 'Outcome'), ('compiled.crimes_street_type_yearly', 'Crime')]:
+        crimes = {'lsoa': lsoa}
+        for year in range(2015, 2019):
+            for kind in range(8):
+                crimes['{}{}-{}'.format(prefix, kind, year)] = rng.poisson(3, len(lsoa)).astype(float)
+        tables[table] = pd.DataFrame(crimes)
+    for t in Census11.options:
+        census = {'oa': oa}
+        for i in range(census_columns):
+            census['{}{}'.format(''.join([j[0] for j in t.split('_')]).upper(), i)] = rng.poisson(40, len(oa))
+        tables['census2011.' + t] = pd.DataFrame(census)
+    return tables
+
+
+def cohort(lookup, n_rows, duplicate_ratio=0.5, seed=0):
+    """
+    Creates an input dataset with postcodes. Returns a data frame with the columns "id" and "pc".
+
+    @param lookup: the postcode lookup table (from hierarchy)
+    @param n_rows: the number of rows
+    @param duplicate_ratio (default 0.5): fraction of the rows that repeat a postcode already used
+    @param seed (default 0): the random seed
+    """
+    rng = np.random.default_rng(seed)
+    n_distinct = max(1, min(len(lookup), int(round(n_rows * (1 - duplicate_ratio)))))
+    distinct = lookup['pc'].values[rng.choice(len(lookup), n_distinct, replace=False)]
+    # the repeated postcodes follow a skewed distribution
+    weights = 1 / np.arange(1, n_distinct + 1)
+    repeated = distinct[rng.choice(n_distinct, n_rows - n_distinct, p=weights / weights.sum())]
+    pc = np.concatenate([distinct, repeated])
+    rng.shuffle(pc)
+    return pd.DataFrame({'id': np.arange(n_rows), 'pc': pc})
+
+
+def load(engine, lookup, tables):
+    """
+    Loads the lookup and the source tables into a database. DuckDB databases are loaded directly from the data frames, other databases use pandas.to_sql.
+
+    @param engine: an sqlalchemy engine
+    @param lookup: the postcode lookup table (from hierarchy)
+    @param tables: the source tables (from source_tables)
+    """
+    tables = dict(tables)
+    tables['public.postcode_lookup11'] = lookup
+    with engine.begin() as conn:
+        for schema in ['public', 'compiled', 'census2011']:
+            conn.exec_driver_sql('CREATE SCHEMA IF NOT EXISTS {}'.format(schema))
+        if engine.dialect.name == 'duckdb':
+            raw = conn.connection.driver_connection
+            for name, df in tables.items():
+                raw.register('_synthetic', df)
+                raw.execute('CREATE OR REPLACE TABLE {} AS SELECT * FROM _synthetic'.format(name))
+                raw.unregister('_synthetic')
+            return
+    for name, df in tables.items():
+        schema, table = name.split('.')
+        df.to_sql(table, con=engine, schema=schema, index=False, if_exists='replace', chunksize=2**16)
+
+
+def create_database(path, n_lad=10, census_columns=20, seed=0):
+    """
+    Creates an embedded DuckDB database with the synthetic data. Returns the engine and the lookup table.
+
+    @param path: the database file
+    @param n_lad (default 10): number of local authority districts
+    @param census_columns (default 20): number of columns of each census table
+    @param seed (default 0): the random seed
+    """
+    from sqlalchemy import create_engine
+    engine = create_engine('duckdb:///' + path)
+    lookup = hierarchy(n_lad=n_lad, seed=seed)
+    load(engine, lookup, source_tables(lookup, census_columns=census_columns, seed=seed))
+    return engine, lookup
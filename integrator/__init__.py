@@ -5,5 +5,5 @@ Integrator module for database extraction
 
 name = "integrator"
 
-__all__ = ['util', 'collector', 'tables', 'mapping', 'postcode_mapping', 'sources']
+__all__ = ['util', 'collector', 'tables', 'mapping', 'postcode_mapping', 'sources', 'cache', 'writers', 'metrics', 'chunking', 'planner', 'filters', 'dtypes', 'temporal', 'sidecar', 'normalization']
 
@@ -0,0 +1,466 @@
+"""
+Caches for the data obtained from the sources
+"""
+
+import collections
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+from integrator.util import ObtainDataError
+
+
+def reference_keys(values, reference):
+    """
+    Returns the distinct keys of the values searched: the values for a single reference or tuples for multiple references.
+
+    @param values: the values searched (pandas Series or DataFrame)
+    @param reference: the reference variable(s) of the source
+    """
+    if type(reference) is list:
+        return list(values[reference].drop_duplicates().itertuples(index=False, name=None))
+    return list(pd.unique(values))
+
+
+def select_keys(values, reference, keys):
+    """
+    Returns the values searched restricted to some keys.
+
+    @param values: the values searched (pandas Series or DataFrame)
+    @param reference: the reference variable(s) of the source
+    @param keys: the keys to keep (as returned by reference_keys)
+    """
+    if type(reference) is list:
+        return values.loc[pd.MultiIndex.from_frame(values[reference]).isin(keys)]
+    return values.loc[values.isin(keys)]
+
+
+class KeyCache:
+    """
+    Bounded in-memory cache of the rows returned by a source, keyed on the reference values. The least recently used keys are evicted first.
+
+    Keys without data in the source are cached as well, so they are not searched again.
+
+    @param reference: the reference variable(s) of the source
+    @param max_entries (default None): maximum number of keys kept
+    @param max_bytes (default None): approximate maximum size of the rows kept
+    """
+    def __init__(self, reference, max_entries=None, max_bytes=None):
+        self.reference = reference
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.columns = None
+        self.hits = 0
+        self.misses = 0
+        self._rows = collections.OrderedDict() # key -> (row or None, size)
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, keys):
+        """
+        Looks for keys in the cache. Returns the rows found (keys without data are not included) and the keys missing.
+
+        @param keys: the keys searched (as returned by reference_keys)
+        """
+        rows = list()
+        missing = list()
+        for k in keys:
+            if k in self._rows:
+                self._rows.move_to_end(k)
+                row = self._rows[k][0]
+                if row is not None:
+                    rows.append(row)
+            else:
+                missing.append(k)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return rows, missing
+
+    def put(self, keys, df):
+        """
+        Stores the data returned by the source for the keys searched.
+
+        @param keys: the keys searched
+        @param df: the data returned by the source, without duplicate references
+        """
+        self.columns = list(df.columns.values)
+        size = int(df.memory_usage(deep=True).sum() / len(df)) if len(df) > 0 else 0
+        if type(self.reference) is list:
+            found = zip(df[self.reference].itertuples(index=False, name=None), df.itertuples(index=False, name=None))
+        else:
+            found = zip(df[self.reference], df.itertuples(index=False, name=None))
+        for k, row in found:
+            self._add(k, row, size)
+        for k in keys:
+            if k not in self._rows:
+                self._add(k, None, 0)
+        self._evict()
+
+    def frame(self, rows):
+        """
+        Creates a data frame with rows from the cache.
+
+        @param rows: the rows (as returned by get)
+        """
+        return pd.DataFrame.from_records(rows, columns=self.columns)
+
+    def _add(self, key, row, size):
+        if key in self._rows:
+            self._bytes -= self._rows[key][1]
+        self._rows[key] = (row, size)
+        self._rows.move_to_end(key)
+        self._bytes += size
+
+    def _evict(self):
+        while len(self._rows) > 0 and ((self.max_entries is not None and len(self._rows) > self.max_entries) or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            _, (row, size) = self._rows.popitem(last=False)
+            self._bytes -= size
+
+
+class FileStore:
+    """
+    Shared in-memory store of the files loaded by the sources (see tables.CSVTable), bounded by a memory budget.
+
+    A frame holding all the columns requested is reused; otherwise the frame with most of them is extended with the columns missing (loaded alone and joined on), so each column of a file is read once. The least recently used frames are evicted first when the budget is exceeded.
+
+    The lookup indexes of the columns (see index) are kept while a frame of the file is kept.
+
+    @param max_bytes (default None): approximate maximum size of the frames kept (None for no limit)
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._frames = collections.OrderedDict() # (file key, frozenset of columns) -> (frame, size)
+        self._indexes = dict() # (file key, column) -> ((index, positions), size)
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def size(self):
+        """
+        The size (in bytes) of the frames kept.
+        """
+        return self._bytes
+
+    def _find(self, key, columns):
+        """
+        Returns the entry of the file holding all the columns or, if there is none, the entry holding most of them (None if no entry holds any). Returns the entry key and if it holds all the columns.
+        """
+        best, overlap = None, 0
+        for k in self._frames:
+            if k[0] != key:
+                continue
+            found = len(k[1].intersection(columns))
+            if found == len(columns):
+                return k, True
+            if found > overlap:
+                best, overlap = k, found
+        return best, False
+
+    def is_loaded(self, key, columns):
+        """
+        Checks if a frame of the file holds all the columns.
+
+        @param key: the file key
+        @param columns: list of columns
+        """
+        with self._lock:
+            return self._find(key, set(columns))[1]
+
+    def get(self, key, columns, load):
+        """
+        Returns a frame with the columns of a file, loading the columns not kept.
+
+        @param key: the file key (for example the path and the reading options)
+        @param columns: list of columns
+        @param load: function loading some columns of the file into a data frame (in the order of the file rows)
+        """
+        columns = list(dict.fromkeys(columns))
+        with self._lock:
+            k, complete = self._find(key, set(columns))
+            if complete:
+                self._frames.move_to_end(k)
+                self.hits += 1
+                return self._frames[k][0][columns]
+            self.misses += 1
+            if k is None:
+                df = load(columns)
+            else:
+                frame, size = self._frames.pop(k)
+                self._bytes -= size
+                new = load([i for i in columns if i not in k[1]])
+                if len(new) != len(frame):
+                    raise ObtainDataError('The file "{}" changed while loading its columns ({} rows, {} before).'.format(key[0] if isinstance(key, tuple) else key, len(new), len(frame)))
+                new.index = frame.index
+                df = pd.concat([frame, new], axis=1)
+            size = int(df.memory_usage(index=True, deep=True).sum())
+            self._frames[(key, frozenset(df.columns.values))] = (df, size)
+            self._bytes += size
+            self._evict()
+            return df[columns]
+
+    def index(self, key, column, frame=None):
+        """
+        Returns the lookup index of a column of a file, built once from a frame holding it: the values (a pandas.Index without the missing values) and the position of the row of each value. The positions of the values searched are index.get_indexer(values).
+
+        @param key: the file key
+        @param column: the column (with unique values)
+        @param frame (default None): a frame of the file with the column, used if the store does not keep one
+        """
+        with self._lock:
+            if (key, column) in self._indexes:
+                return self._indexes[(key, column)][0]
+            k, complete = self._find(key, {column})
+            if complete:
+                values = self._frames[k][0][column]
+            elif frame is not None:
+                values = frame[column]
+            else:
+                raise ObtainDataError('The column "{}" is not loaded.'.format(column))
+            valid = values.notna().values
+            index = pd.Index(values.values[valid])
+            if not index.is_unique:
+                duplicated = index[index.duplicated()].unique()
+                raise ObtainDataError('The reference "{}" has {} duplicate values in "{}" (for example "{}").'.format(column, len(duplicated), key[0] if isinstance(key, tuple) else key, '", "'.join([str(i) for i in duplicated[:5]])))
+            positions = np.flatnonzero(valid)
+            size = int(index.memory_usage(deep=True)) + positions.nbytes
+            self._indexes[(key, column)] = ((index, positions), size)
+            self._bytes += size
+            return index, positions
+
+    def resize(self, max_bytes):
+        """
+        Sets the memory budget, evicting the frames exceeding it.
+
+        @param max_bytes: approximate maximum size of the frames kept (None for no limit)
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict(keep=0)
+
+    def clear(self):
+        """
+        Removes all the frames.
+        """
+        with self._lock:
+            self._frames.clear()
+            self._indexes.clear()
+            self._bytes = 0
+
+    def _evict(self, keep=1):
+        """
+        Evicts the least recently used frames while the budget is exceeded, keeping the last ones used.
+        """
+        while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._frames) > keep:
+            (key, _), (frame, size) = self._frames.popitem(last=False)
+            self._bytes -= size
+            if not any([k[0] == key for k in self._frames]):
+                for i in [i for i in self._indexes if i[0] == key]:
+                    self._bytes -= self._indexes.pop(i)[1]
+
+
+class PersistentCache:
+    """
+    On-disk cache (an SQLite file) of the rows returned by DBTable sources, kept between runs. The rows are keyed by the source name, a hash of the query (see DBTable.cache_signature) and the reference values. Keys without data in the source are cached as well.
+
+    The least recently used keys are evicted when the rows stored are above max_bytes. All the rows are dropped when the cache is opened with a different version (for example the version of the snapshot of the database).
+
+    @param path: the cache file
+    @param max_bytes (default None): approximate maximum size of the rows stored
+    @param version (default None): the version of the data cached
+    """
+    BATCH = 500 # keys per statement
+
+    def __init__(self, path, max_bytes=None, version=None):
+        if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+            raise ObtainDataError('Cache folder does not exists: "{}".'.format(os.path.dirname(os.path.abspath(path))))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = None if version is None else str(version)
+        self.hits = 0
+        self.misses = 0
+        self._con = None
+        self._lock = threading.RLock()
+        self._connect()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_con'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        """
+        Opens the file (creating the tables) and drops the rows of other versions.
+        """
+        if self._con is not None:
+            return self._con
+        self._con = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._con.execute('pragma journal_mode=wal')
+        self._con.execute('create table if not exists meta (name text primary key, value text)')
+        self._con.execute('create table if not exists queries (source text, query text, columns text, primary key (source, query))')
+        self._con.execute('create table if not exists entries (source text, query text, key text, row blob, size integer, used integer, primary key (source, query, key))')
+        self._con.execute('create index if not exists entries_used on entries (used)')
+        if self.version is not None:
+            stored = self._con.execute("select value from meta where name = 'version'").fetchone()
+            if stored is None or stored[0] != self.version:
+                self.invalidate()
+                self._con.execute("insert or replace into meta values ('version', ?)", (self.version,))
+        self._evict(self._con)
+        return self._con
+
+    def invalidate(self, source=None):
+        """
+        Drops the rows cached, of all the sources or only of one (by name).
+        """
+        with self._lock:
+            con = self._connect() if self._con is None else self._con
+            if source is None:
+                con.execute('delete from entries')
+                con.execute('delete from queries')
+            else:
+                con.execute('delete from entries where source = ?', (source,))
+                con.execute('delete from queries where source = ?', (source,))
+
+    def size(self):
+        """
+        Returns the number of keys and the size of the rows stored.
+        """
+        with self._lock:
+            n, size = self._connect().execute('select count(*), coalesce(sum(size), 0) from entries').fetchone()
+        return n, size
+
+    def _query_key(self, d):
+        return hashlib.sha1(d.cache_signature().encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _native(value):
+        """
+        The value as a python scalar, so the keys searched (numpy scalars) and the keys returned (python scalars) are encoded the same way.
+        """
+        if isinstance(value, np.datetime64):
+            return pd.Timestamp(value)
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    @classmethod
+    def _encode(cls, key):
+        if type(key) is tuple:
+            key = tuple([cls._native(i) for i in key])
+        else:
+            key = cls._native(key)
+        return json.dumps(key, default=str)
+
+    def get(self, d, keys):
+        """
+        Looks for keys of a source. Returns the columns stored (None if the query was never cached), the rows found (keys without data are not included) and the keys missing.
+
+        @param d: the DBTable source
+        @param keys: the keys searched (as returned by reference_keys)
+        """
+        query = self._query_key(d)
+        encoded = {self._encode(k): k for k in keys}
+        found = dict()
+        with self._lock:
+            con = self._connect()
+            columns = con.execute('select columns from queries where source = ? and query = ?', (d.name, query)).fetchone()
+            if columns is None:
+                self.misses += len(keys)
+                return None, list(), list(keys)
+            encoded_keys = list(encoded.keys())
+            now = time.time_ns()
+            for i in range(0, len(encoded_keys), self.BATCH):
+                batch = encoded_keys[i:i + self.BATCH]
+                marks = ', '.join(['?'] * len(batch))
+                for key, row in con.execute('select key, row from entries where source = ? and query = ? and key in ({})'.format(marks), [d.name, query] + batch):
+                    found[key] = row
+                con.execute('update entries set used = ? where source = ? and query = ? and key in ({})'.format(marks), [now, d.name, query] + batch)
+        rows = [pickle.loads(row) for row in found.values() if row is not None]
+        missing = [k for e, k in encoded.items() if e not in found]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return json.loads(columns[0]), rows, missing
+
+    def put(self, d, keys, df):
+        """
+        Stores the data returned by a source for the keys searched.
+
+        @param d: the DBTable source
+        @param keys: the keys searched
+        @param df: the data returned by the source, without duplicate references
+        """
+        query = self._query_key(d)
+        size = int(df.memory_usage(deep=True).sum() / len(df)) if len(df) > 0 else 0
+        if type(d.reference) is list:
+            found = zip(df[d.reference].itertuples(index=False, name=None), df.itertuples(index=False, name=None))
+        else:
+            found = zip(df[d.reference], df.itertuples(index=False, name=None))
+        now = time.time_ns()
+        entries = dict()
+        for k, row in found:
+            entries[self._encode(k)] = (pickle.dumps(row, protocol=pickle.HIGHEST_PROTOCOL), size)
+        for k in keys:
+            entries.setdefault(self._encode(k), (None, 0))
+        with self._lock:
+            con = self._connect()
+            con.execute('begin')
+            try:
+                con.execute('insert or replace into queries values (?, ?, ?)', (d.name, query, json.dumps([str(i) for i in df.columns.values])))
+                con.executemany('insert or replace into entries values (?, ?, ?, ?, ?, ?)', [(d.name, query, k, row, s, now) for k, (row, s) in entries.items()])
+                con.execute('commit')
+            except BaseException:
+                con.execute('rollback')
+                raise
+            self._evict(con)
+
+    def _evict(self, con):
+        """
+        Removes the least recently used keys while the rows stored are above max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        total = con.execute('select coalesce(sum(size), 0) from entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        remove = list()
+        for rowid, size in con.execute('select rowid, size from entries order by used'):
+            remove.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        con.executemany('delete from entries where rowid = ?', remove)
+
+    def obtain_data(self, d, mapping, obtain):
+        """
+        Obtains the data of a source for the values searched, only the keys not cached are obtained (and then cached).
+
+        @param d: the DBTable source
+        @param mapping: the values searched
+        @param obtain: function obtaining the data of the source for some values
+        """
+        keys = reference_keys(mapping, d.reference)
+        columns, rows, missing = self.get(d, keys)
+        if len(missing) == 0:
+            return pd.DataFrame.from_records(rows, columns=columns)
+        ndf = obtain(select_keys(mapping, d.reference, missing))
+        if not ndf.duplicated(subset=d.reference).any(): # the duplicates are reported by the collector
+            self.put(d, missing, ndf)
+        if len(rows) == 0:
+            return ndf
+        return pd.concat([pd.DataFrame.from_records(rows, columns=columns), ndf], ignore_index=True, sort=False)
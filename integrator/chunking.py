@@ -0,0 +1,49 @@
+"""
+Adaptive sizing of the input chunks
+"""
+
+from integrator.util import ObtainDataError
+
+
+class AdaptiveChunkSize:
+    """
+    Chooses the size of the next chunk from the measurements of the chunks already collected: the time per row (queries and merges) and the memory per row of the collected chunk.
+
+    The size grows at most by max_growth between chunks and shrinks straight away if the limits are exceeded.
+
+    @param seed_size: the size of the first chunk
+    @param memory_limit_mb (default None): the maximum memory of a collected chunk
+    @param target_seconds (default None): the target time to collect a chunk
+    @param min_size (default 256): the minimum chunk size
+    @param max_size (default 2**20): the maximum chunk size
+    @param max_growth (default 2.0): the maximum growth factor between chunks
+    """
+    def __init__(self, seed_size, memory_limit_mb=None, target_seconds=None, min_size=256, max_size=2**20, max_growth=2.0):
+        if memory_limit_mb is None and target_seconds is None:
+            raise ObtainDataError('The adaptive chunk size requires a memory limit and/or a target time per chunk.')
+        self.memory_limit = memory_limit_mb * 2**20 if memory_limit_mb is not None else None
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_growth = max_growth
+        self.size = int(min(max(seed_size, min_size), max_size))
+        self.sizes = list() # the sizes used
+
+    def update(self, rows, seconds, chunk_bytes):
+        """
+        Updates the size of the next chunk with the measurements of a collected chunk. Returns the new size.
+
+        @param rows: the number of rows of the chunk
+        @param seconds: the time taken to collect the chunk
+        @param chunk_bytes: the memory used by the collected chunk
+        """
+        self.sizes.append(rows)
+        if rows == 0:
+            return self.size
+        size = self.size * self.max_growth
+        if self.memory_limit is not None and chunk_bytes > 0:
+            size = min(size, 0.8 * self.memory_limit / (chunk_bytes / rows)) # keep some slack for the merge copies
+        if self.target_seconds is not None and seconds > 0:
+            size = min(size, self.target_seconds / (seconds / rows))
+        self.size = int(min(max(size, self.min_size), self.max_size))
+        return self.size
@@ -3,12 +3,80 @@
 Class definition for the handling of the main data collector
 """
 
-import time
 import pandas as pd
 import numpy as np
 import os.path
 import copy
+import json
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from integrator.util import ObtainDataError
+from integrator.tables import DBCategory, DBTable, DBTableTimed, CSVTable
+from integrator.mapping import DBMapping
+from integrator.cache import KeyCache, reference_keys, select_keys
+from integrator.writers import ColumnarWriter
+from integrator.metrics import Recorder, VerboseRecorder
+from integrator.chunking import AdaptiveChunkSize
+from integrator.planner import QueryPlanner, FusedSource
+from integrator.filters import RowFilter
+
+
+class WorkerSpec:
+    """
+    Picklable description of the sources used by the worker processes of a DataCollector. Each worker creates its own engine and sources from it.
+
+    @param engine_url: the sqlalchemy url for the engine of each worker
+    @param sources: list of source classes (DBTable derived or DBCategory) or tuples (class, dict of keyword arguments), they are created with the worker engine
+    @param reference_sources (list of DBMapping classes): the mapping classes, they use the worker engine
+    @param engine_kwargs (default None): extra arguments for sqlalchemy.create_engine
+    """
+    def __init__(self, engine_url, sources, reference_sources=None, engine_kwargs=None):
+        self.engine_url = engine_url
+        self.sources = sources if type(sources) is list else [sources]
+        self.reference_sources = reference_sources
+        self.engine_kwargs = engine_kwargs if engine_kwargs else dict()
+
+    def __call__(self):
+        """
+        Creates the engine and the sources. Returns the sources, reference sources and reference engines for a DataCollector.
+        """
+        from sqlalchemy import create_engine
+        engine = create_engine(self.engine_url, **self.engine_kwargs)
+        sources = list()
+        for i in self.sources:
+            cls, kwargs = i if type(i) is tuple else (i, dict())
+            if issubclass(cls, DBCategory):
+                sources += [j for j in cls.get_tables(engine, **kwargs)]
+            else:
+                sources.append(cls(engine=engine, **kwargs))
+        reference_engines = [engine for i in self.reference_sources] if self.reference_sources else None
+        return sources, self.reference_sources, reference_engines
+
+
+_worker_collector = None # the DataCollector of a worker process
+
+
+def _worker_init(worker_spec, skip_missing, cache_entries, cache_bytes, fuse_queries, filters, key_shipping, persistent_cache, stream_batch_size, dtype_policy):
+    """
+    Creates the DataCollector used by a worker process.
+    """
+    global _worker_collector
+    sources, reference_sources, reference_engines = worker_spec()
+    _worker_collector = DataCollector(None, sources=sources, reference_sources=reference_sources, reference_engines=reference_engines, verbose=False, skip_missing=skip_missing, cache_entries=cache_entries, cache_bytes=cache_bytes, fuse_queries=fuse_queries, filters=filters, key_shipping=key_shipping, persistent_cache=persistent_cache, stream_batch_size=stream_batch_size, dtype_policy=dtype_policy)
+
+
+def _worker_collect(chunk, chunk_id):
+    """
+    Collects a chunk in a worker process. Returns the chunk, the spans recorded and the statistics of the worker since the previous chunk (see DataCollector._drain_stats).
+
+    @param chunk: the chunk of input data
+    @param chunk_id: the number of the chunk in the parent process (used by the spans)
+    """
+    _worker_collector._chunk_id = chunk_id - 1 # incremented by _query_chunk
+    chunk = _worker_collector._merge_chunk(*_worker_collector._query_chunk(chunk, None))
+    return chunk, _worker_collector.recorder.drain(), _worker_collector._drain_stats()
 
 
 class DataCollector:
@@ -23,19 +91,58 @@ class DataCollector:
     @param chunksize (default 4*4096): the size of the chunk if the input database is a file or a dataframe
     @param stop_after_chunk (default None): if it should stop collecting after a chunk
     @param skip_missing: if the references are incomplete the row is going to be skipped: THIS MIGHT LEAD TO ADVERSE BEHAVIOURS: SUCH AS EMPTY QUERY/RETURN
+    @param max_workers (default None): if set, the sources that only depend on columns already available are queried at the same time using a thread pool with this number of workers
+    @param pipeline_depth (default None): if set, reading the input, querying the sources and merging/yielding run as a pipeline with at most this number of chunks waiting between stages
+    @param processes (default None): if set, the chunks are collected by this number of worker processes, each one with the sources built from worker_spec
+    @param worker_spec (default None): a picklable callable returning the sources, reference sources and reference engines for each worker process (see WorkerSpec)
+    @param ordered (default True): if the chunks collected by the worker processes are returned in the input order, otherwise they are returned as soon as they are ready
+    @param cache_entries (default None): if set, the rows returned by each source are cached between chunks, keeping at most this number of reference values per source
+    @param cache_bytes (default None): if set, the rows returned by each source are cached between chunks, using approximately at most this number of bytes per source
+    @param recorder (default None): the metrics.Recorder receiving the timing spans of the collection; by default a VerboseRecorder (printing them) if verbose, otherwise a Recorder
+    @param memory_limit_mb (default None): if set (file or dataframe input), the chunk size adapts between chunks, starting from chunksize, so a collected chunk uses at most this memory
+    @param target_chunk_seconds (default None): if set (file or dataframe input), the chunk size adapts between chunks, starting from chunksize, to take about this time per chunk
+    @param fuse_queries (default False): if set, the sources needing dependency mappings in the same database run a single query joining the mappings and the source on the server (see planner.QueryPlanner)
+    @param key_shipping (default None): if set, how all the DBTable sources (and the dependency mappings) send the values searched to the database: 'values' or 'temp_table' (see tables.DBTable)
+    @param persistent_cache (default None): if set, a cache.PersistentCache used by all the DBTable sources (and the dependency mappings) to keep the data obtained between runs
+    @param stream_batch_size (default None): if set, all the DBTable sources (and the dependency mappings) read their results with a server-side cursor in batches of this number of rows
+    @param dtype_policy (default None): a dtypes.DtypePolicy converting the collected chunks (after all the merges) to compact types; the sources can have their own policies
+    @param filters (default None): list of filters.Predicate on the output columns; the rows failing them are removed as soon as the columns are available (before querying the following sources) and the conditions on the columns of DBTable sources are added to their queries
+    @param normalize (default None): a normalization.PostcodeNormalizer (or a list of them) converting the input columns of each chunk (for example the postcodes to the canonical key of the postcode lookup) before the dependencies are resolved and the sources queried
+    @param prefetch_chunks (default None): if set, the input is read ahead this number of chunks at a time and the streaming CSVTable sources searching input columns scan their files once for the values of all of them (see tables.CSVTable.prefetch); not available with worker processes
     """
-    def __init__(self, database_handler, sources=None, reference_sources=None, reference_engines=None, verbose=True, chunksize=4*4096, stop_after_chunk=None, skip_missing=False):
+    def __init__(self, database_handler, sources=None, reference_sources=None, reference_engines=None, verbose=True, chunksize=4*4096, stop_after_chunk=None, skip_missing=False, max_workers=None, pipeline_depth=None, processes=None, worker_spec=None, ordered=True, cache_entries=None, cache_bytes=None, recorder=None, memory_limit_mb=None, target_chunk_seconds=None, fuse_queries=False, filters=None, key_shipping=None, persistent_cache=None, stream_batch_size=None, dtype_policy=None, normalize=None, prefetch_chunks=None):
+        if memory_limit_mb is not None or target_chunk_seconds is not None:
+            if type(database_handler) is not str and not isinstance(database_handler, pd.DataFrame):
+                raise ObtainDataError('The adaptive chunk size requires a file or a dataframe as input.')
+            self.chunk_sizer = AdaptiveChunkSize(chunksize, memory_limit_mb=memory_limit_mb, target_seconds=target_chunk_seconds)
+        else:
+            self.chunk_sizer = None
         if type(database_handler) is str: # str input 
             if not os.path.isfile(database_handler):
                 raise ObtainDataError("Input file does not exist: '{}'! Or we don't have permission to read.".format(database_handler))
             def _db_get():
-                for chunk in pd.read_csv(database_handler, chunksize=chunksize):
-                    yield chunk
+                if self.chunk_sizer is None:
+                    for chunk in pd.read_csv(database_handler, chunksize=chunksize):
+                        yield chunk
+                    return
+                with pd.read_csv(database_handler, iterator=True) as reader:
+                    while True:
+                        try:
+                            yield reader.get_chunk(self.chunk_sizer.size)
+                        except StopIteration:
+                            return
             database_file_handler = _db_get
         elif isinstance(database_handler, pd.DataFrame): # pandas.DataFrame input
             def _db_get():
-                for i, j in database_handler.groupby(np.arange(len(database_handler))//chunksize):
-                    yield j
+                if self.chunk_sizer is None:
+                    for i, j in database_handler.groupby(np.arange(len(database_handler))//chunksize):
+                        yield j
+                    return
+                start = 0
+                while start < len(database_handler):
+                    end = start + self.chunk_sizer.size
+                    yield database_handler.iloc[start:end]
+                    start = end
             database_file_handler = _db_get
         else: # function that yields chunks
             database_file_handler = database_handler
@@ -54,6 +161,37 @@ class DataCollector:
         self._build_reference_graph(reference_sources)
         self.stop_after_chunk = stop_after_chunk
         self.skip_missing = skip_missing
+        if max_workers is not None and max_workers < 1:
+            raise ObtainDataError('The number of workers must be at least 1, got {}.'.format(max_workers))
+        self.max_workers = max_workers
+        if pipeline_depth is not None and pipeline_depth < 1:
+            raise ObtainDataError('The pipeline depth must be at least 1, got {}.'.format(pipeline_depth))
+        self.pipeline_depth = pipeline_depth
+        if processes is not None and worker_spec is None:
+            raise ObtainDataError('A worker_spec is required to collect with worker processes.')
+        self.processes = processes
+        if prefetch_chunks is not None and (prefetch_chunks < 1 or processes):
+            raise ObtainDataError('The prefetch must be at least 1 chunk, without worker processes, got {}.'.format(prefetch_chunks))
+        self.prefetch_chunks = prefetch_chunks
+        self.normalizers = (normalize if type(normalize) is list else [normalize]) if normalize is not None else list()
+        self.worker_spec = worker_spec
+        self.ordered = ordered
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+        self._caches = dict()
+        if recorder is None:
+            recorder = VerboseRecorder() if verbose else Recorder()
+        self.recorder = recorder
+        self.fuse_queries = fuse_queries
+        self.row_filter = RowFilter(filters) if filters else None
+        self.key_shipping = key_shipping
+        self.persistent_cache = persistent_cache
+        self.stream_batch_size = stream_batch_size
+        self.dtype_policy = dtype_policy
+        self._source_columns = dict() # columns returned by each source (for the chunks without values to search)
+        self._chunk_id = 0
+        self._skip_rows = 0 # input rows skipped when resuming
+        self._yielded_input_rows = 0 # input rows of the last chunk collected
 
     def _build_reference_graph(self, reference_sources):
         """
@@ -163,6 +301,12 @@ class DataCollector:
         missing_references = list(set(_flatten([i.reference for i in self.sources])) - set(columns))
         if len(missing_references) > 0: #if there are some reference columns which we dont have
             compiled_targets = self._minimum_mapping(columns, missing_references)
+            if self.fuse_queries:
+                self.sources, compiled_targets = QueryPlanner(self._reference_engines).plan(self.sources, compiled_targets, columns)
+                if self.verbose:
+                    for d in self.sources:
+                        if isinstance(d, FusedSource):
+                            print("|- Fused: '{}'".format(d))
             index_ref = 0
             for source, target_cols in compiled_targets:
                 source_cols, source_method = source
@@ -179,15 +323,31 @@ class DataCollector:
         1. add new columns from the dependency checks
         2. add new columns requested
         """
-        start = time.time()
+        yield from self._collect_reported(dtype_report=True)
+
+    def _collect_reported(self, dtype_report):
+        """
+        Collects the data each by chunk (see collect), reporting the caches and the normalization at the end.
+
+        @param dtype_report: if the memory saved by the dtype policy is reported (otherwise it is reported on the concatenated data, see _concat)
+        """
+        span = self.recorder.start('collection', 'collection')
         chunk_id = 0
         for i in self._collect():
             yield i
             chunk_id += 1
             if self.stop_after_chunk is not None and chunk_id >= self.stop_after_chunk:
-                return
+                break
+        self.recorder.finish(span, chunks=chunk_id)
         if self.verbose:
-            print('- Extraction took {:.2f}s'.format(time.time() - start))
+            for source, stats in self.cache_stats().items():
+                print("|- Cache '{}': {} hits, {} misses, {} entries".format(source, stats['hits'], stats['misses'], stats['entries']))
+            if dtype_report and self.dtype_policy is not None and self.dtype_policy.bytes_before > 0:
+                print('|- ' + self.dtype_policy.report())
+            for normalizer in self.normalizers:
+                print('|- ' + normalizer.report())
+            if self.persistent_cache is not None:
+                print("|- Persistent cache '{}': {} hits, {} misses".format(self.persistent_cache.path, self.persistent_cache.hits, self.persistent_cache.misses))
 
     def collect_all(self, filtering_function=None):
         """
@@ -196,13 +356,26 @@ class DataCollector:
         @param filtering_function (default None): function that will be called with the dataframe (it must return the dataframe)
         """
         all_df = list()
-        for i in self.collect():
+        for i in self._collect_reported(dtype_report=self.dtype_policy is None):
             if filtering_function:
                 i = filtering_function(i)
             all_df.append(i)
-        return pd.concat(all_df, sort=False)
+        return self._concat(all_df)
+
+    def _concat(self, all_df):
+        """
+        Concatenates the collected chunks. With a dtype policy the categoricals are kept (see dtypes.DtypePolicy.concat) and the memory saved is reported on the concatenated data.
+
+        @param all_df: list of collected chunks
+        """
+        if self.dtype_policy is None:
+            return pd.concat(all_df, sort=False)
+        all_df = self.dtype_policy.concat(all_df)
+        if self.verbose and self.dtype_policy.bytes_before > 0:
+            print('|- ' + self.dtype_policy.report())
+        return all_df
 
-    def collect_to_file(self, output_file, filtering_function=None, ignore_file_exists=False, sep=',', index=False, return_dataset=True):
+    def collect_to_file(self, output_file, filtering_function=None, ignore_file_exists=False, sep=',', index=False, return_dataset=True, output_format='csv', checkpoint=False, resume=False):
         """
         Collects all the data, does the filtering function on the data and saves it to file. After saving the dataframe may be returned with parameter 'return_dataset'.
 
@@ -210,92 +383,627 @@ class DataCollector:
         @param filtering_function (default None): function that will be called with the dataframe (it must return the dataframe)
         @param sep: separator for the output file
         @param return_dataset (default True): if the dataset is going to be returned after this function
+        @param output_format (default 'csv'): 'csv'; or 'parquet'/'arrow' to write each chunk as a row group/record batch as it is collected (requires pyarrow)
+        @param checkpoint (default False): record each chunk written in the manifest "<output_file>.checkpoint" so the collection can be resumed (csv output with return_dataset=False only)
+        @param resume (default False): resume the collection from the checkpoint manifest, the chunks already written are skipped without being queried (implies checkpoint)
         """
         if not os.path.exists(os.path.dirname(os.path.abspath(output_file))):
             raise ObtainDataError('Output file folder does not exists: "{}".'.format(os.path.dirname(os.path.abspath(output_file))))
-        if os.path.isfile(output_file) and not ignore_file_exists:
+        if checkpoint or resume:
+            if output_format != 'csv' or return_dataset:
+                raise ObtainDataError('Checkpoints are only possible for csv output with return_dataset=False.')
+            if self.processes and not self.ordered:
+                raise ObtainDataError('Checkpoints require the chunks in order (ordered=True).')
+        manifest_file = output_file + '.checkpoint'
+        if os.path.isfile(output_file) and not ignore_file_exists and not (resume and os.path.isfile(manifest_file)):
             raise ObtainDataError('Output file already exists: "{}".'.format(output_file))
-        start = time.time()
-        if return_dataset:
+        span = self.recorder.start('write', output_file, output_format=output_format)
+        if checkpoint or resume:
+            self._collect_to_file_checkpointed(output_file, manifest_file, filtering_function, sep, index, resume)
+        elif output_format != 'csv':
+            all_df = list()
+            with ColumnarWriter(output_file, output_format) as writer:
+                for i in self._collect_reported(dtype_report=self.dtype_policy is None or not return_dataset):
+                    if filtering_function:
+                        i = filtering_function(i)
+                    writer.write(i.reset_index() if index else i)
+                    if return_dataset:
+                        all_df.append(i)
+            if return_dataset:
+                all_df = self._concat(all_df)
+        elif return_dataset:
             all_df = self.collect_all(filtering_function)
-            if self.verbose:
-                print('|- Saving file...', end='')
             all_df.to_csv(output_file, sep=sep, index=index)
         else:
             first_save = True
+            empty = None
             for i in self.collect():
                 if filtering_function:
                     i = filtering_function(i)
-                if first_save:
+                if first_save and len(i) == 0: # the header is taken from the first chunk with rows (an empty chunk might miss columns)
+                    empty = i
+                elif first_save:
                     i.to_csv(output_file, sep=sep, index=index)
                     first_save = False
                 else:
                     i.to_csv(output_file, sep=sep, index=index, mode='a', header=False)
-            print('Dataset', end='')
-        if self.verbose:
-            print(' saved! Dataframe processing took {:.2f}s'.format(time.time() - start))
+            if first_save and empty is not None:
+                empty.to_csv(output_file, sep=sep, index=index)
+        self.recorder.finish(span)
         if return_dataset:
             return all_df
 
+    def _source_levels(self):
+        """
+        Groups the sources in levels. The sources in one level only depend on the columns of the input or of the previous levels, so they can be queried at the same time.
+
+        The columns produced by the dependency mappings (inserted by reference_check) are the only ones other sources can depend on.
+        """
+        produced_by = dict() # column -> level of the first source producing it
+        levels = list()
+        for d in self.sources:
+            refs = d.reference if type(d.reference) is list else [d.reference]
+            level = max([produced_by[r] + 1 for r in refs if r in produced_by], default=0)
+            if level == len(levels):
+                levels.append(list())
+            levels[level].append(d)
+            for t in getattr(d, 'to_variables', []):
+                if t not in produced_by:
+                    produced_by[t] = level
+        return levels
+
+    def _search_data(self, d, chunk):
+        """
+        Checks for missing reference values and returns the values to be searched for a source.
+
+        @param d: the data source
+        @param chunk: the current chunk
+        """
+        refs = d.reference
+        if type(refs) is not list:
+            refs = [refs]
+        reference_missing = {}
+        for rc in refs:
+            _n = np.sum(chunk[rc].isna().values)
+            if _n > 0:
+                reference_missing[rc] = _n
+        if len(reference_missing) > 0:
+            err = 'Missing reference values for: {}'.format(';'.join(['"{}" ({})'.format(i,j) for i, j in reference_missing.items()])) + '.'
+            if self.skip_missing and self.verbose:
+                print('|* ' + err, end='\n\n')
+            elif self.skip_missing is False:
+                raise ObtainDataError(err + ' Please remove missing values.')
+        # if we should skip the missing:
+        chunk_search_data = chunk[d.reference]
+        if self.skip_missing:
+            chunk_search_data = chunk_search_data.dropna()
+        return chunk_search_data
+
+    def _fetch(self, d, chunk_search_data):
+        """
+        Obtains the data of a source for the values searched. Returns the data and the span recorded.
+
+        @param d: the data source
+        @param chunk_search_data: the values to be searched (from _search_data)
+        """
+        span = self.recorder.start('source', str(d), chunk=self._chunk_id, rows_in=len(chunk_search_data))
+        if self.verbose:
+            print("|- Collecting '{}'".format(d), end='\r')
+        if len(chunk_search_data) == 0:
+            if self.verbose:
+                print('|- Chunk with no data! Skipping!')
+            refs = d.reference if type(d.reference) is list else [d.reference]
+            ndf = pd.DataFrame(columns=self._source_columns.get(id(d), refs + getattr(d, 'to_variables', []) + getattr(d, 'mapped_columns', [])))
+        elif id(d) in self._caches:
+            cache = self._caches[id(d)]
+            hits, misses = cache.hits, cache.misses
+            ndf = self._fetch_cached(d, chunk_search_data, cache)
+            span.attributes.update(cache_hits=cache.hits - hits, cache_misses=cache.misses - misses)
+            if cache.misses > misses:
+                span.attributes.update(getattr(d, 'last_timings', dict()))
+        else:
+            ndf = d.obtain_data(chunk_search_data)
+            span.attributes.update(getattr(d, 'last_timings', dict()))
+        if len(chunk_search_data) > 0:
+            self._source_columns[id(d)] = list(ndf.columns.values)
+        return ndf, self.recorder.finish(span, rows_out=len(ndf), result_bytes=int(ndf.memory_usage(index=False).sum()))
+
+    def _fetch_cached(self, d, chunk_search_data, cache):
+        """
+        Obtains the data of a source using the cache, only the values not in the cache are searched.
+
+        @param d: the data source
+        @param chunk_search_data: the values to be searched (from _search_data)
+        @param cache: the KeyCache of the source
+        """
+        rows, missing = cache.get(reference_keys(chunk_search_data, d.reference))
+        if len(missing) == 0:
+            return cache.frame(rows)
+        ndf = d.obtain_data(select_keys(chunk_search_data, d.reference, missing))
+        if ndf.duplicated(subset=d.reference).any():
+            raise self._duplicate_error(d, ndf) from pd.errors.MergeError()
+        cache.put(missing, ndf)
+        if len(rows) == 0:
+            return ndf
+        return pd.concat([cache.frame(rows), ndf], ignore_index=True, sort=False)
+
+    def _collect_to_file_checkpointed(self, output_file, manifest_file, filtering_function, sep, index, resume):
+        """
+        Collects the data to a csv file recording each chunk written in a manifest. When resuming, the output is truncated to the last chunk recorded and the input rows already collected are skipped.
+
+        @param output_file: output file
+        @param manifest_file: the checkpoint manifest
+        @param filtering_function: function that will be called with the dataframe (it must return the dataframe)
+        @param sep: separator for the output file
+        @param index: if the index is saved
+        @param resume: if the collection is resumed from the manifest
+        """
+        manifest = {'input_rows': 0, 'output_position': 0, 'header': False, 'complete': False, 'chunks': list()}
+        if resume and os.path.isfile(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+            if self.verbose:
+                print("|- Resuming '{}' after {} chunks ({} input rows)".format(output_file, len(manifest['chunks']), manifest['input_rows']))
+        self._skip_rows = manifest['input_rows']
+        def _save_manifest():
+            with open(manifest_file + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_file + '.tmp', manifest_file)
+        try:
+            with open(output_file, 'a' if manifest['output_position'] > 0 else 'w', newline='') as out:
+                out.truncate(manifest['output_position']) # the partial tail of an interrupted run
+                out.seek(manifest['output_position'])
+                for i in self.collect():
+                    input_rows = self._yielded_input_rows
+                    if filtering_function:
+                        i = filtering_function(i)
+                    if len(i) > 0 or manifest['header']: # the header is taken from the first chunk with rows
+                        i.to_csv(out, sep=sep, index=index, header=not manifest['header'])
+                        out.flush()
+                        os.fsync(out.fileno())
+                        manifest['header'] = True
+                    manifest['chunks'].append({'chunk': len(manifest['chunks']), 'input_offset': manifest['input_rows'], 'input_rows': input_rows, 'output_position': out.tell()})
+                    manifest['input_rows'] += input_rows
+                    manifest['output_position'] = out.tell()
+                    _save_manifest()
+        finally:
+            self._skip_rows = 0
+        manifest['complete'] = self.stop_after_chunk is None
+        _save_manifest()
+
+    def summary(self):
+        """
+        Returns the summary of the timings recorded (see metrics.Recorder.summary).
+        """
+        return self.recorder.summary()
+
+    def cache_stats(self):
+        """
+        Returns the hits, misses and number of entries of the cache of each source.
+        """
+        return {str(d): {'hits': self._caches[id(d)].hits, 'misses': self._caches[id(d)].misses, 'entries': len(self._caches[id(d)])} for d in self.sources if id(d) in self._caches}
+
+    def _duplicate_error(self, d, ndf):
+        """
+        Returns the error for a source that returned duplicate elements for the references.
+
+        @param d: the data source
+        @param ndf: the data obtained from the source
+        """
+        if isinstance(ndf[d.reference], pd.Series):
+            return ObtainDataError("Data extractor '{}' failed. There are duplicate elements. Please disable it. Duplicated elements are '{}'.".format(d, "', '".join([str(i) for i in ndf[d.reference][ndf[d.reference].duplicated(keep=False)].drop_duplicates(keep='first')])))
+        else: # isinstance(ndf[d.reference], pd.DataFrame)
+            return ObtainDataError("Data extractor '{}' failed. There are duplicate elements. Please disable it. Duplicated elements are '{}'.".format(d, "', '".join(['<' + ', '.join([str(j) for j in i[1]]) + '>' for i in ndf[d.reference][ndf[d.reference].duplicated(keep=False)].drop_duplicates(keep='first').iterrows()])))
+
+    def _merge(self, chunk, d, ndf):
+        """
+        Merges the data obtained from a source into the chunk.
+
+        @param chunk: the current chunk
+        @param d: the data source
+        @param ndf: the data obtained from the source
+        """
+        try:
+            return chunk.merge(ndf, on=d.reference, how='left', validate='many_to_one') #merge the data using the reference variables
+        except pd.errors.MergeError as e:
+            raise self._duplicate_error(d, ndf) from pd.errors.MergeError()
+
+    def _align(self, chunk, d, ndf):
+        """
+        Aligns the data obtained from a source to the rows of the chunk using the reference variables. Returns the new columns with the index of the chunk.
+
+        @param chunk: the current chunk
+        @param d: the data source
+        @param ndf: the data obtained from the source
+        """
+        refs = d.reference if type(d.reference) is list else [d.reference]
+        if ndf.duplicated(subset=refs).any():
+            raise self._duplicate_error(d, ndf) from pd.errors.MergeError()
+        if any([chunk[r].dtype != ndf[r].dtype for r in refs]):
+            # the reindex would not match keys of incompatible types, the merge of the empty keys raises the same error as merging the data
+            chunk[refs].iloc[:0].merge(ndf[refs].iloc[:0], on=refs, how='left')
+        if len(refs) == 1:
+            keys = pd.Index(chunk[refs[0]])
+        else:
+            keys = pd.MultiIndex.from_frame(chunk[refs])
+        aligned = ndf.set_index(refs).reindex(keys)
+        aligned.index = chunk.index
+        return aligned
+
+    def _join(self, chunk, results):
+        """
+        Adds the data of multiple sources to the chunk in a single step. Each result is aligned to the chunk rows and all of them are concatenated along the columns. The index is reset, as pandas.merge does.
+
+        If some source returns a column already present the sources are merged one by one instead.
+
+        @param chunk: the current chunk
+        @param results: list of (source, data obtained) pairs
+        """
+        aligned = list()
+        deduplicated = list()
+        present = set(chunk.columns.values)
+        for d, ndf in results:
+            # the mapped variables of a fused source can be already in the chunk or come from another fused source
+            repeated = [i for i in getattr(d, 'mapped_columns', []) if i in present and i in ndf.columns]
+            if len(repeated) > 0:
+                ndf = ndf.drop(columns=repeated)
+            deduplicated.append((d, ndf))
+            aligned.append(self._align(chunk, d, ndf))
+            present.update(aligned[-1].columns.values)
+        columns = [c for i in [chunk] + aligned for c in i.columns.values]
+        if len(columns) != len(set(columns)):
+            for d, ndf in deduplicated:
+                chunk = self._merge(chunk, d, ndf)
+            return chunk
+        return pd.concat([chunk] + aligned, axis=1).reset_index(drop=True) # as the merge
+
     def _collect(self):
         """
         Internal handling of the chunk collection.
         """
+        if self.processes:
+            yield from self._collect_processes()
+        elif self.max_workers:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                yield from self._collect_chunks(executor)
+        else:
+            yield from self._collect_chunks(None)
+
+    def _collect_chunks(self, executor):
+        """
+        Collects each chunk, either one after the other or as a pipeline.
+
+        @param executor: a concurrent.futures executor for querying the sources of the same level concurrently or None for the sequential querying
+        """
+        if self.pipeline_depth:
+            yield from self._collect_pipelined(executor)
+            return
+        for chunk in self._input_chunks():
+            yield self._merge_chunk(*self._query_chunk(chunk, executor))
+
+    def _input_chunks(self):
+        """
+        Yields the input chunks, skipping the first input rows when resuming a collection.
+        """
+        skip = self._skip_rows
+        batch = list()
         for chunk in self.database_file_handler():
-            start_chunk = time.time()
-            # if it is a first run we need a column dependency check
-            if not self.checked:
-                dependency_check = time.time()
-                self.reference_check(chunk.columns.values)
-                self.checked = True
-                if self.verbose:
-                    print('|- Dependency resolution in {:.2f}s'.format(time.time() - dependency_check))
-            # for each source of data (this will include dependencies)
-            for d in self.sources:
-                start_time = time.time()
+            if skip > 0:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk.iloc[skip:]
+                skip = 0
+            for normalizer in self.normalizers:
+                chunk = normalizer.apply(chunk)
+            if not self.prefetch_chunks:
+                yield chunk
+                continue
+            batch.append(chunk)
+            if len(batch) >= self.prefetch_chunks:
+                self._prefetch(batch)
+                yield from batch
+                batch = list()
+        if len(batch) > 0:
+            self._prefetch(batch)
+            yield from batch
+
+    def _prefetch(self, chunks):
+        """
+        Searches the values of some input chunks in the streaming CSVTable sources with a single scan of their files.
+
+        @param chunks: list of input chunks
+        """
+        for d in self.sources:
+            if isinstance(d, CSVTable) and d.streaming and all([d.reference in c.columns for c in chunks]):
                 if self.verbose:
-                    print("|- Collecting '{}'".format(d), end='\r')
-                # check for missing reference values
-                # # reference list
-                refs = d.reference
-                if type(refs) is not list:
-                    refs = [refs]
-                reference_missing = {}
-                for rc in refs:
-                    _n = np.sum(chunk[rc].isna().values)
-                    if _n > 0:
-                        reference_missing[rc] = _n
-                if len(reference_missing) > 0:
-                    err = 'Missing reference values for: {}'.format(';'.join(['"{}" ({})'.format(i,j) for i, j in reference_missing.items()])) + '.'
-                    if self.skip_missing and self.verbose:
-                        print('|* ' + err, end='\n\n')
-                    elif self.skip_missing is False:
-                        raise ObtainDataError(err + ' Please remove missing values.')
-                # if we should skip the missing:
-                chunk_search_data = chunk[d.reference]
-                if self.skip_missing:
-                    chunk_search_data = chunk_search_data.dropna()
-                # obtain the data
-                if len(chunk_search_data) == 0:
-                    print('|- Chunk with no data! Skipping!')
-                    ndf = pd.DataFrame(columns=d.reference)
-                else:
-                    ndf = d.obtain_data(chunk_search_data)
-                internal_time = time.time()
-                # print(chunk.columns.values)
-                # print(chunk.head())
-                # print(ndf.columns.values)
-                # print(ndf.head())
+                    print("|- Prefetching '{}' for {} chunks".format(d, len(chunks)))
+                d.prefetch(pd.concat([c[d.reference] for c in chunks]))
+
+    def _collect_processes(self):
+        """
+        Collects the chunks using a pool of worker processes. At most twice the number of processes chunks are being collected at any time.
+        """
+        executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_worker_init, initargs=(self.worker_spec, self.skip_missing, self.cache_entries, self.cache_bytes, self.fuse_queries, self.row_filter.predicates if self.row_filter else None, self.key_shipping, self.persistent_cache, self.stream_batch_size, self.dtype_policy))
+        limit = 2 * self.processes
+        in_flight = collections.deque()
+
+        def _next_ready():
+            if self.ordered:
+                return [in_flight.popleft()]
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            ready = [i for i in in_flight if i in done] # in input order
+            for f in ready:
+                in_flight.remove(f)
+            return ready
+
+        try:
+            chunk_id = 0
+            for chunk in self._input_chunks():
+                chunk_id += 1
+                in_flight.append(executor.submit(_worker_collect, chunk, chunk_id))
+                if len(in_flight) >= limit:
+                    for f in _next_ready():
+                        yield self._worker_result(f)
+            while len(in_flight) > 0:
+                for f in _next_ready():
+                    yield self._worker_result(f)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _worker_result(self, future):
+        """
+        Returns the chunk collected by a worker process and records its spans and statistics.
+        """
+        chunk, spans, stats = future.result()
+        self._add_stats(stats)
+        for span in spans:
+            self.recorder.record(span)
+            if span.kind == 'chunk':
+                self._chunk_collected(span, chunk)
+        return chunk
+
+    def _drain_stats(self):
+        """
+        Returns the statistics counted since the previous call (in a worker process) and resets them: the hits and misses of the persistent cache and the memory measured by the dtype policy.
+        """
+        stats = dict()
+        if self.dtype_policy is not None:
+            with self.dtype_policy._lock:
+                stats['dtype_policy'] = (self.dtype_policy.bytes_before, self.dtype_policy.bytes_after)
+                self.dtype_policy.bytes_before, self.dtype_policy.bytes_after = 0, 0
+        if self.persistent_cache is not None:
+            stats['persistent_cache'] = (self.persistent_cache.hits, self.persistent_cache.misses)
+            self.persistent_cache.hits, self.persistent_cache.misses = 0, 0
+        return stats
+
+    def _add_stats(self, stats):
+        """
+        Adds the statistics of a worker process (see _drain_stats) to the ones of this collector.
+        """
+        if 'persistent_cache' in stats:
+            hits, misses = stats['persistent_cache']
+            self.persistent_cache.hits += hits
+            self.persistent_cache.misses += misses
+        if 'dtype_policy' in stats:
+            before, after = stats['dtype_policy']
+            with self.dtype_policy._lock:
+                self.dtype_policy.bytes_before += before
+                self.dtype_policy.bytes_after += after
+
+    def _collect_pipelined(self, executor):
+        """
+        Collects the chunks using a thread for reading the input and another for querying the sources, the merge happens as the chunks are yielded.
+
+        The queues between the stages hold at most pipeline_depth chunks. Errors in the stages are raised when their chunk would be yielded.
+
+        @param executor: a concurrent.futures executor or None
+        """
+        done = object() # marks the end of the input
+        read_queue = queue.Queue(maxsize=self.pipeline_depth)
+        query_queue = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+
+        def _put(q, item):
+            while not stop.is_set():
                 try:
-                    chunk = chunk.merge(ndf, on=d.reference, how='left', copy=False, validate='many_to_one') #merge the data using the reference variables
-                except pd.errors.MergeError as e:
-                    if isinstance(ndf[d.reference], pd.Series):
-                        raise ObtainDataError("Data extractor '{}' failed. There are duplicate elements. Please disable it. Duplicated elements are '{}'.".format(d, "', '".join([str(i) for i in ndf[d.reference][ndf[d.reference].duplicated(keep=False)].drop_duplicates(keep='first')]))) from pd.errors.MergeError()
-                    else: # isinstance(ndf[d.reference], pd.DataFrame)
-                        raise ObtainDataError("Data extractor '{}' failed. There are duplicate elements. Please disable it. Duplicated elements are '{}'.".format(d, "', '".join(['<' + ', '.join([str(j) for j in i[1]]) + '>' for i in ndf[d.reference][ndf[d.reference].duplicated(keep=False)].drop_duplicates(keep='first').iterrows()]))) from pd.errors.MergeError()
-                if self.verbose:
-                    print("|- Source '{}' took {:.2f}s (internal processing {:.2f}s)".format(d, time.time() - start_time, time.time() - internal_time))
-            if self.verbose:
-                print("- Chunk took {:.2f}s".format(time.time() - start_chunk))
-            yield chunk
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return done, None
+
+        def _read():
+            try:
+                for chunk in self._input_chunks():
+                    if not _put(read_queue, (chunk, None)):
+                        return
+            except Exception as e:
+                _put(read_queue, (None, e))
+                return
+            _put(read_queue, (done, None))
+
+        def _query():
+            while True:
+                chunk, error = _get(read_queue)
+                if chunk is done or error is not None:
+                    _put(query_queue, (chunk, error))
+                    return
+                try:
+                    queried = self._query_chunk(chunk, executor)
+                except Exception as e:
+                    _put(query_queue, (None, e))
+                    return
+                if not _put(query_queue, (queried, None)):
+                    return
+
+        stages = [threading.Thread(target=_read, daemon=True), threading.Thread(target=_query, daemon=True)]
+        for t in stages:
+            t.start()
+        try:
+            while True:
+                queried, error = _get(query_queue)
+                if error is not None:
+                    raise error
+                if queried is done:
+                    return
+                yield self._merge_chunk(*queried)
+        finally:
+            stop.set()
+            for t in stages:
+                t.join()
+
+    def _prepare(self, columns):
+        """
+        Resolves the dependencies of the sources for the input columns (only once) and sets up the levels and the caches.
+
+        @param columns: the input columns
+        """
+        dependency_check = self.recorder.start('dependency', 'dependency')
+        self.reference_check(columns)
+        self.checked = True
+        self._levels = self._source_levels()
+        # the sources used by the filters are queried first (after the dependency mappings) so the rows filtered out are not searched in the others
+        filtered = set([c.split('.')[0] for c in self.row_filter.columns()]) if self.row_filter else set()
+        self._query_order = sorted(self.sources, key=lambda d: 0 if len(getattr(d, 'to_variables', [])) > 0 else 1 if getattr(d, 'name', None) in filtered else 2)
+        if self.cache_entries is not None or self.cache_bytes is not None:
+            self._caches = {id(d): KeyCache(d.reference, max_entries=self.cache_entries, max_bytes=self.cache_bytes) for d in self.sources}
+        for d in self.sources:
+            if self.key_shipping is not None and isinstance(d, DBTable):
+                d.set_key_shipping(self.key_shipping)
+            if self.stream_batch_size is not None and isinstance(d, DBTable):
+                d.batch_size = self.stream_batch_size
+            if self.persistent_cache is not None and isinstance(d, DBTable) and not isinstance(d, FusedSource):
+                d.cache = self.persistent_cache
+            # the conditions are only added to plain queries (the fused and the timed queries are already nested)
+            if isinstance(d, DBTable) and not isinstance(d, (DBTableTimed, DBMapping, FusedSource)):
+                d.row_conditions = self.row_filter.sql_conditions(d) if self.row_filter else list()
+                if self.verbose and len(d.row_conditions) > 0:
+                    print("|- Filter in '{}': {}".format(d, ' and '.join(d.row_conditions)))
+        self.recorder.finish(dependency_check)
+
+    def explain(self, columns):
+        """
+        Returns the plan of the collection for the input columns: one line for each source, with the fused query for the sources fused with their dependency mappings.
+
+        @param columns: the input columns
+        """
+        if not self.checked:
+            self._prepare(columns)
+        lines = list()
+        for d in self.sources:
+            if isinstance(d, FusedSource):
+                lines.append('{}: fused query\n{}'.format(d, d.explain()))
+            else:
+                lines.append('{}: separate query'.format(d))
+        return '\n'.join(lines)
+
+    def _query_chunk(self, chunk, executor):
+        """
+        Queries all the sources for a chunk. The dependency mappings are merged straight away as the following sources need their columns, the other results are merged by _merge_chunk.
 
+        Returns the chunk with the dependency columns, the results pending to be merged, the new columns added by each source and the chunk span.
+
+        @param chunk: the chunk of input data
+        @param executor: a concurrent.futures executor or None
+        """
+        self._chunk_id += 1
+        span = self.recorder.start('chunk', 'chunk', chunk=self._chunk_id, rows_in=len(chunk))
+        # if it is a first run we need a column dependency check
+        if not self.checked:
+            self._prepare(chunk.columns.values)
+        new_columns = {'': list(chunk.columns.values)}
+        pending = list()
+        applied = set() # the filters applied to the chunk
+        if self.row_filter:
+            chunk = self.row_filter.apply(chunk, applied)
+        filter_columns = self.row_filter.columns() if self.row_filter else set()
+        def _handle(d, ndf, source_span):
+            nonlocal chunk
+            # the sources with columns used by the filters are merged straight away so the rows filtered out are not searched in the following sources
+            if len(getattr(d, 'to_variables', [])) > 0 or len(filter_columns.intersection(ndf.columns.values).difference(chunk.columns.values)) > 0:
+                chunk = self._merge_source(chunk, d, ndf, new_columns)
+                if self.row_filter:
+                    chunk = self.row_filter.apply(chunk, applied)
+            else:
+                pending.append((d, ndf))
+        if executor is None:
+            # for each source of data (this will include dependencies)
+            for d in self._query_order:
+                _handle(d, *self._fetch(d, self._search_data(d, chunk)))
+        else:
+            for level in self._levels:
+                futures = [executor.submit(self._fetch, d, self._search_data(d, chunk)) for d in level]
+                # the results are handled in the order of the sources so the output is deterministic
+                for d, f in zip(level, futures):
+                    _handle(d, *f.result())
+        return chunk, pending, new_columns, span
+
+    def _merge_chunk(self, chunk, pending, new_columns, span):
+        """
+        Merges the pending results of the sources into the chunk (the values returned by _query_chunk).
+        """
+        if len(pending) > 0:
+            merge_span = self.recorder.start('merge', 'join of {} sources'.format(len(pending)), chunk=span.attributes['chunk'], sources=[str(d) for d, ndf in pending])
+            chunk = self._join(chunk, pending)
+            for d, ndf in pending:
+                new_columns[id(d)] = self._returned_columns(chunk, d, ndf)
+            self.recorder.finish(merge_span, rows_out=len(chunk))
+        if self.row_filter:
+            chunk = self.row_filter.apply(chunk, set())
+        # the columns are in the same order as if each source was merged in turn (whichever source was merged first)
+        columns = list(dict.fromkeys(new_columns[''] + [c for d in self.sources for c in new_columns.get(id(d), [])]))
+        columns += [c for c in chunk.columns.values if c not in set(columns)]
+        if columns != list(chunk.columns.values):
+            chunk = chunk[columns]
+        if self.dtype_policy is not None:
+            chunk = self.dtype_policy.apply(chunk)
+        self.recorder.finish(span, rows_out=len(chunk))
+        self._chunk_collected(span, chunk)
+        return chunk
+
+    def _chunk_collected(self, span, chunk):
+        """
+        Records the input rows of a collected chunk and updates the adaptive chunk size (if used).
+
+        @param span: the span of the chunk
+        @param chunk: the collected chunk
+        """
+        self._yielded_input_rows = span.attributes['rows_in']
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.update(span.attributes['rows_in'], span.duration, int(chunk.memory_usage(deep=True).sum()))
+
+    def _merge_source(self, chunk, d, ndf, new_columns):
+        """
+        Merges the results of one source and records the columns it added.
+
+        @param chunk: the current chunk
+        @param d: the data source
+        @param ndf: the data obtained from the source
+        @param new_columns: dictionary of the columns added by each source
+        """
+        merge_span = self.recorder.start('merge', str(d), chunk=self._chunk_id)
+        chunk = self._join(chunk, [(d, ndf)])
+        new_columns[id(d)] = self._returned_columns(chunk, d, ndf)
+        self.recorder.finish(merge_span, rows_out=len(chunk))
+        return chunk
+
+    def _returned_columns(self, chunk, d, ndf):
+        """
+        Returns the columns of the chunk returned by a source (besides its references), in the order returned. The columns returned by multiple sources (as the mapped variables of fused sources) are placed with the first source, independently of the order of the merges.
+
+        @param chunk: the chunk after the merge
+        @param d: the data source
+        @param ndf: the data obtained from the source
+        """
+        refs = d.reference if type(d.reference) is list else [d.reference]
+        present = set(chunk.columns.values)
+        return [i for i in ndf.columns.values if i in present and i not in refs]
@@ -0,0 +1,119 @@
+"""
+Compact data types for the collected data
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+
+
+class DtypePolicy:
+    """
+    Converts the columns of the data obtained to smaller types: the area codes to categoricals, the integers to the smallest integer type holding them and optionally the floats to float32.
+
+    The columns used to merge the data (the references) are never converted by the sources; the collector converts the collected chunks after all the merges.
+
+    @param categories (default ['oa', 'lsoa', 'msoa', 'lad']): the text columns stored as categoricals, matching the column name or the name after the source prefix ("Source.lsoa")
+    @param downcast_integers (default True): if the integer columns are stored in the smallest integer type holding their values
+    @param float32 (default False): if the float columns are stored as float32 (this loses precision)
+    @param exclude (default None): list of columns never converted
+    @param measure (default True): if the memory before and after the conversion is measured (see report)
+    """
+    AREA_CODES = ['oa', 'lsoa', 'msoa', 'lad']
+
+    def __init__(self, categories=None, downcast_integers=True, float32=False, exclude=None, measure=True):
+        self.categories = set(categories if categories is not None else self.AREA_CODES)
+        self.downcast_integers = downcast_integers
+        self.float32 = float32
+        self.exclude = set(exclude) if exclude else set()
+        self.measure = measure
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _is_category(self, column):
+        return column in self.categories or str(column).split('.')[-1] in self.categories
+
+    def _convert(self, series):
+        """
+        Returns the column converted or None if it is kept.
+        """
+        if self._is_category(series.name) and (series.dtype == object or pd.api.types.is_string_dtype(series.dtype)) and not isinstance(series.dtype, pd.CategoricalDtype):
+            return series.astype('category')
+        if self.downcast_integers and pd.api.types.is_integer_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype) and len(series) > 0:
+            return pd.to_numeric(series, downcast='unsigned' if series.min() >= 0 else 'integer')
+        if self.float32 and series.dtype == np.float64:
+            return series.astype(np.float32)
+        return None
+
+    def apply(self, df, exclude=None):
+        """
+        Converts the columns of a data frame. Returns the converted data frame.
+
+        @param df: the data frame
+        @param exclude (default None): list of columns not converted (for example the references)
+        """
+        exclude = self.exclude.union(exclude if exclude else [])
+        if self.measure:
+            before = int(df.memory_usage(index=False, deep=True).sum())
+        converted = dict()
+        for c in df.columns:
+            if c in exclude:
+                continue
+            new = self._convert(df[c])
+            if new is not None:
+                converted[c] = new
+        if len(converted) > 0:
+            df = df.copy(deep=False)
+            for c, s in converted.items():
+                df[c] = s
+        if self.measure:
+            with self._lock:
+                self.bytes_before += before
+                self.bytes_after += int(df.memory_usage(index=False, deep=True).sum())
+        return df
+
+    def concat(self, frames):
+        """
+        Concatenates the converted chunks keeping the categoricals: the columns stored as categoricals in some chunk get the categories of all the chunks (otherwise pandas.concat returns them as text). The memory measured for the chunks is corrected with the memory of the concatenated frame (see report).
+
+        @param frames: list of converted data frames
+        """
+        frames = list(frames)
+        before = sum([int(f.memory_usage(index=False, deep=True).sum()) for f in frames]) if self.measure else 0
+        columns = list(dict.fromkeys([c for f in frames for c in f.columns.values]))
+        categorical = [c for c in columns if any([isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames if c in f.columns])]
+        if len(categorical) > 0 and len(frames) > 1:
+            frames = [f.copy(deep=False) for f in frames]
+            for c in categorical:
+                categories = None
+                for f in frames:
+                    if c not in f.columns:
+                        continue
+                    values = f[c].cat.categories if isinstance(f[c].dtype, pd.CategoricalDtype) else pd.Index(f[c].dropna().unique())
+                    categories = values if categories is None else categories.union(values, sort=False)
+                dtype = pd.CategoricalDtype(categories)
+                for f in frames:
+                    if c in f.columns:
+                        f[c] = f[c].astype(dtype)
+        df = pd.concat(frames, sort=False)
+        if self.measure:
+            with self._lock:
+                self.bytes_after += int(df.memory_usage(index=False, deep=True).sum()) - before
+        return df
+
+    def report(self):
+        """
+        Text report of the memory saved.
+        """
+        saved = self.bytes_before - self.bytes_after
+        return 'Compact types: {:.1f}MB -> {:.1f}MB ({:.1f}MB saved, {:.0%})'.format(self.bytes_before / 2**20, self.bytes_after / 2**20, saved / 2**20, saved / self.bytes_before if self.bytes_before > 0 else 0)
@@ -0,0 +1,186 @@
+"""
+Declarative row filters applied during the collection
+"""
+
+import numbers
+import pandas as pd
+from integrator.util import ObtainDataError
+
+
+def _literal(value):
+    """
+    Formats a value as an SQL literal.
+    """
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, numbers.Number):
+        return repr(float(value)) if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) else str(int(value))
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class Predicate:
+    """
+    A condition on one column of the collected data (an input column, a column from a dependency mapping or a column of a source, with the name it has in the output).
+
+    The rows failing the condition are removed as soon as the column is available, so the following sources do not query them.
+
+    @param column: the column name
+    """
+    KEEPS_NULL = False # if the missing values pass the condition (these are not pushed into the queries)
+
+    def __init__(self, column):
+        self.column = column
+
+    def __str__(self):
+        return '{}({})'.format(self.__class__.__name__, self.column)
+
+    def mask(self, df):
+        """
+        Returns a boolean series with the rows of df passing the condition (defined by each filter).
+        """
+        raise ObtainDataError('The filter "{}" does not define the rows passing its condition (mask).'.format(self.__class__.__name__))
+
+    def to_sql(self, column):
+        """
+        Returns the SQL condition for the (quoted) column or None if it can not be written in SQL.
+        """
+        return None
+
+
+class Range(Predicate):
+    """
+    The values are between low and high.
+
+    @param column: the column name
+    @param low (default None): the lowest value (no limit if None)
+    @param high (default None): the highest value (no limit if None)
+    @param inclusive (default True): if the limits are part of the range
+    """
+    def __init__(self, column, low=None, high=None, inclusive=True):
+        if low is None and high is None:
+            raise ObtainDataError('Range for "{}" requires low and/or high.'.format(column))
+        super().__init__(column)
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+
+    def mask(self, df):
+        values = df[self.column]
+        ret = values.notna()
+        if self.low is not None:
+            ret &= (values >= self.low) if self.inclusive else (values > self.low)
+        if self.high is not None:
+            ret &= (values <= self.high) if self.inclusive else (values < self.high)
+        return ret.fillna(False).astype(bool)
+
+    def to_sql(self, column):
+        terms = list()
+        if self.low is not None:
+            terms.append('{} {} {}'.format(column, '>=' if self.inclusive else '>', _literal(self.low)))
+        if self.high is not None:
+            terms.append('{} {} {}'.format(column, '<=' if self.inclusive else '<', _literal(self.high)))
+        return ' and '.join(terms)
+
+
+class In(Predicate):
+    """
+    The values are one of a set.
+
+    @param column: the column name
+    @param values: the values accepted
+    """
+    def __init__(self, column, values):
+        super().__init__(column)
+        if isinstance(values, str):
+            values = [values]
+        self.values = list(values)
+        if len(self.values) == 0:
+            raise ObtainDataError('In for "{}" requires at least one value.'.format(column))
+
+    def mask(self, df):
+        return df[self.column].isin(self.values)
+
+    def to_sql(self, column):
+        return '{} in ({})'.format(column, ', '.join([_literal(i) for i in self.values]))
+
+
+class NotNull(Predicate):
+    """
+    The values are not missing.
+
+    @param column: the column name
+    """
+    def mask(self, df):
+        return df[self.column].notna()
+
+    def to_sql(self, column):
+        return '{} is not null'.format(column)
+
+
+class IsNull(Predicate):
+    """
+    The values are missing (including the rows without data in a source).
+
+    @param column: the column name
+    """
+    KEEPS_NULL = True
+
+    def mask(self, df):
+        return df[self.column].isna()
+
+
+class RowFilter:
+    """
+    Applies a list of predicates to the chunks during the collection. Each predicate is applied once per chunk, as soon as its column is in the chunk.
+
+    @param predicates: list of Predicate
+    """
+    def __init__(self, predicates):
+        if isinstance(predicates, Predicate):
+            predicates = [predicates]
+        for p in predicates:
+            if not isinstance(p, Predicate):
+                raise ObtainDataError('Invalid filter "{}", expected a Predicate.'.format(p))
+        self.predicates = list(predicates)
+
+    def columns(self):
+        """
+        The columns used by the predicates.
+        """
+        return set([p.column for p in self.predicates])
+
+    def apply(self, chunk, applied):
+        """
+        Applies the predicates not yet applied whose columns are in the chunk. Returns the rows passing them.
+
+        @param chunk: the current chunk
+        @param applied: set of the predicates already applied to the chunk (updated)
+        """
+        keep = None
+        for p in self.predicates:
+            if id(p) in applied or p.column not in chunk.columns:
+                continue
+            applied.add(id(p))
+            m = p.mask(chunk).values
+            keep = m if keep is None else keep & m
+        if keep is None or keep.all():
+            return chunk
+        return chunk.loc[keep]
+
+    def sql_conditions(self, d):
+        """
+        Returns the SQL conditions on the columns of a source (named as "<source name>.<column>" in the output) that can be pushed into its query.
+
+        @param d: the data source
+        """
+        if not getattr(d, 'rename', False):
+            return []
+        prefix = d.name + '.'
+        conditions = list()
+        for p in self.predicates:
+            if p.KEEPS_NULL or not p.column.startswith(prefix):
+                continue
+            sql = p.to_sql('"{}"'.format(p.column[len(prefix):]))
+            if sql:
+                conditions.append(sql)
+        return conditions
@@ -13,6 +13,8 @@ class DBMapping(DBTable):
 
     @cls AVAILABLE: contains the list of references mapped
     @cls REFERENCES_ORDERED: if the list of references should be checked in order not to give a more specific value from a generic one
+    @cls TABLE: the reference table (used when the mapping is fused with the source queries)
+    @cls FUSABLE: if the mapping can be fused with the source queries on the server
     @param from_variable: the source variable(s) used
     @param to_variable: the target variable(s) needed
     @param engine: an sqlalchemy engine
@@ -20,6 +22,8 @@ class DBMapping(DBTable):
     """
     AVAILABLE = []
     REFERENCES_ORDERED = True
+    TABLE = None
+    FUSABLE = True
     def matching_source(cls, what_we_have, what_is_needed):
         """
         This function checks if we can match the needed variables using only the variables we have.
@@ -62,6 +66,7 @@ class DBMapping(DBTable):
         self.check_variables_interaction(from_variable, to_variables)
         if type(to_variables) is str:
             to_variables = [to_variables]
+        self.to_variables = to_variables
         super().__init__(from_variable, query="""
                          with filtering_part as (
                             select *
@@ -73,6 +78,6 @@ class DBMapping(DBTable):
                          SELECT new_variables.* 
                          FROM filtering_part left join new_variables on filtering_part.{from_variable} = new_variables.{from_variable}
                          WHERE new_variables.{from_variable} IS NOT NULL
-                         """.replace('{table}', table).replace('{from_variable}', from_variable).replace('{to_variables}', '","'.join(to_variables)), engine=engine, rename=False)
+                         """.replace('{table}', table).replace('{from_variable}', from_variable).replace('{to_variables}', '","'.join(to_variables)), engine=engine, rename=False, table=table)
 
 
@@ -0,0 +1,155 @@
+"""
+Metrics and tracing of the data collection
+"""
+
+import time
+import threading
+import numpy as np
+
+
+class Span:
+    """
+    A timed step of the collection.
+
+    @param kind: the type of step: 'dependency', 'source', 'merge', 'chunk', 'collection' or 'write'
+    @param name: the name of the step (for example the source)
+    @param attributes: extra information about the step (for example rows in/out, chunk number, query timings)
+    """
+    def __init__(self, kind, name, **attributes):
+        self.kind = kind
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        """
+        The duration of the span in seconds (up to now if it did not finish).
+        """
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def __repr__(self):
+        return '<Span {} "{}" {:.4f}s {}>'.format(self.kind, self.name, self.duration, self.attributes)
+
+
+class Recorder:
+    """
+    Records the spans of a collection and calls the callbacks when each span finishes.
+
+    @param callbacks (default None): list of functions called with each finished span
+    @param keep_spans (default True): if the finished spans are kept for the summary
+    """
+    def __init__(self, callbacks=None, keep_spans=True):
+        self.callbacks = list(callbacks) if callbacks else list()
+        self.keep_spans = keep_spans
+        self.spans = list()
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """
+        Adds a function to be called with each finished span.
+        """
+        self.callbacks.append(callback)
+
+    def start(self, kind, name, **attributes):
+        """
+        Starts a span.
+        """
+        return Span(kind, name, **attributes)
+
+    def finish(self, span, **attributes):
+        """
+        Finishes a span, adding some attributes, and records it.
+        """
+        span.end = time.time()
+        span.attributes.update(attributes)
+        self.record(span)
+        return span
+
+    def record(self, span):
+        """
+        Records a finished span (for example from a worker process).
+        """
+        if self.keep_spans:
+            with self._lock:
+                self.spans.append(span)
+        self.on_span(span)
+        for callback in self.callbacks:
+            callback(span)
+
+    def on_span(self, span):
+        """
+        Hook called with each finished span.
+        """
+        pass
+
+    def drain(self):
+        """
+        Removes and returns the spans recorded.
+        """
+        with self._lock:
+            spans, self.spans = self.spans, list()
+        return spans
+
+    def summary(self):
+        """
+        Summary of the spans recorded: for each source the number of queries, the duration percentiles, the rows and rows per second; for the chunks the same values.
+        """
+        def _summarize(spans):
+            durations = np.array([i.duration for i in spans])
+            rows = sum([i.attributes.get('rows_in', 0) for i in spans])
+            return {'count': len(spans),
+                    'total': float(durations.sum()),
+                    'p50': float(np.percentile(durations, 50)),
+                    'p90': float(np.percentile(durations, 90)),
+                    'p99': float(np.percentile(durations, 99)),
+                    'rows_in': rows,
+                    'rows_out': sum([i.attributes.get('rows_out', 0) for i in spans]),
+                    'rows_per_second': rows / durations.sum() if durations.sum() > 0 else float('nan')}
+        with self._lock:
+            spans = list(self.spans)
+        sources = dict()
+        for i in spans:
+            if i.kind == 'source':
+                sources.setdefault(i.name, list()).append(i)
+        chunks = [i for i in spans if i.kind == 'chunk']
+        return {'sources': {name: _summarize(j) for name, j in sources.items()},
+                'chunks': _summarize(chunks) if len(chunks) > 0 else None,
+                'chunk_sizes': [i.attributes['rows_in'] for i in chunks if 'rows_in' in i.attributes]}
+
+    def report(self):
+        """
+        Text report from the summary.
+        """
+        summary = self.summary()
+        lines = ['|- {:<50} {:>6} {:>9} {:>9} {:>9} {:>12}'.format('Source', 'n', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'rows/s')]
+        items = list(summary['sources'].items())
+        if summary['chunks']:
+            items.append(('(chunks)', summary['chunks']))
+        for name, s in items:
+            lines.append('|- {:<50} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>12.1f}'.format(name[:50], s['count'], s['p50'], s['p90'], s['p99'], s['rows_per_second']))
+        sizes = summary['chunk_sizes']
+        if len(set(sizes[:-1])) > 1: # the last chunk is usually smaller
+            lines.append('|- Chunk sizes: {}'.format(', '.join([str(i) for i in sizes])))
+        return '\n'.join(lines)
+
+
+class VerboseRecorder(Recorder):
+    """
+    Recorder that prints the timing of each step and the report at the end of the collection.
+    """
+    def on_span(self, span):
+        if span.kind == 'dependency':
+            print('|- Dependency resolution in {:.2f}s'.format(span.duration))
+        elif span.kind == 'source':
+            print("|- Source '{}' took {:.2f}s ({} rows in, {} rows out)".format(span.name, span.duration, span.attributes.get('rows_in'), span.attributes.get('rows_out')))
+        elif span.kind == 'merge':
+            print("|- Merged '{}' in {:.2f}s".format(span.name, span.duration))
+        elif span.kind == 'chunk':
+            print('- Chunk took {:.2f}s'.format(span.duration))
+        elif span.kind == 'collection':
+            print('- Extraction took {:.2f}s'.format(span.duration))
+            print(self.report())
+        elif span.kind == 'write':
+            print("- Dataset saved to '{}'! Dataframe processing took {:.2f}s".format(span.name, span.duration))
@@ -0,0 +1,124 @@
+"""
+Normalization of the input values before the collection
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from integrator.util import ObtainDataError
+
+
+class PostcodeNormalizer:
+    """
+    Converts the postcodes of a column to the canonical key used by the postcode lookup ("pc": upper case, without spaces or punctuation, for example "B152TT"), so the inputs written as "b15 2tt", "B15  2TT" or in the pcd7/pcd8/pcds formats match.
+
+    The conversion uses vectorized string operations, once for each distinct value of a chunk. The results are cached per chunk only (the repeated values of a chunk are converted once), no cache is kept across chunks: looking up the raw values in a shared cache is slower than converting them. The values that are not postcodes after the conversion are counted (see report).
+
+    @param column (default 'pc'): the column with the postcodes
+    @param output (default None): the column with the canonical postcodes, by default the column itself
+    @param keep_invalid (default True): if the values that are not postcodes are kept (converted as the postcodes), otherwise they are missing
+    @param examples (default 10): number of values that are not postcodes kept for the report
+    """
+    PATTERN = r'(?:[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}|GIR0AA)'
+    FORMATS = ['pc', 'pcds', 'pcd7', 'pcd8']
+
+    def __init__(self, column='pc', output=None, keep_invalid=True, examples=10):
+        self.column = column
+        self.output = output if output is not None else column
+        self.keep_invalid = keep_invalid
+        self.examples = examples
+        self.values = 0 # values normalized
+        self.changed = 0 # values changed by the normalization
+        self.invalid = 0 # values that are not postcodes
+        self.invalid_examples = list()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _convert(self, values):
+        """
+        Returns the canonical values of some values (missing if nothing is left after the conversion) and if they are postcodes.
+        """
+        s = pd.Series(values).reset_index(drop=True)
+        if not pd.api.types.is_string_dtype(s.dtype) or s.dtype == object:
+            s = s.astype('str')
+        s = s.str.upper().str.replace(r'[^A-Z0-9]', '', regex=True)
+        s = s.where(s.str.len() > 0)
+        return s, s.str.fullmatch(self.PATTERN).fillna(False).to_numpy(dtype=bool)
+
+    def normalize(self, values):
+        """
+        Returns the canonical postcodes of the values (missing for the missing values and, if not keep_invalid, for the values that are not postcodes).
+
+        @param values: the postcodes
+        """
+        values = pd.Series(values)
+        codes, uniques = pd.factorize(values, use_na_sentinel=True) # each distinct value is converted once
+        canonical, valid = self._convert(uniques)
+        changed = (pd.Series(uniques).astype('str').reset_index(drop=True) != canonical).to_numpy(dtype=bool)
+        found = codes >= 0
+        row = np.maximum(codes, 0)
+        invalid = found & ~valid.take(row)
+        with self._lock:
+            self.values += int(found.sum())
+            self.changed += int((found & changed.take(row)).sum())
+            self.invalid += int(invalid.sum())
+            if len(self.invalid_examples) < self.examples and invalid.any():
+                for i in pd.unique(values[invalid].values):
+                    if len(self.invalid_examples) >= self.examples:
+                        break
+                    if i not in self.invalid_examples:
+                        self.invalid_examples.append(i)
+        if not self.keep_invalid:
+            canonical = canonical.where(valid)
+        ret = canonical.take(row).where(found)
+        ret.index = values.index
+        if pd.api.types.is_string_dtype(values.dtype) and values.dtype != object:
+            ret = ret.astype(values.dtype)
+        return ret
+
+    def apply(self, chunk):
+        """
+        Returns the chunk with the canonical postcodes.
+
+        @param chunk: the chunk of input data
+        """
+        if self.column not in chunk.columns:
+            raise ObtainDataError('The postcode column "{}" is not in the input.'.format(self.column))
+        chunk = chunk.copy(deep=False)
+        chunk[self.output] = self.normalize(chunk[self.column])
+        return chunk
+
+    @classmethod
+    def format(cls, values, style='pcds'):
+        """
+        Formats canonical postcodes: 'pc' (without spaces, "B152TT"), 'pcds' (one space, "B15 2TT"), 'pcd7' (7 characters, "B15 2TT", "B1  2TT", "AB122TT") or 'pcd8' (8 characters, "B15  2TT", "AB12 2TT").
+
+        @param values: the canonical postcodes
+        @param style (default 'pcds'): the format
+        """
+        if style not in cls.FORMATS:
+            raise ObtainDataError('Invalid postcode format "{}", please select one of: "{}"'.format(style, '", "'.join(cls.FORMATS)))
+        values = pd.Series(values)
+        if style == 'pc':
+            return values
+        outward, inward = values.str[:-3], values.str[-3:]
+        if style == 'pcds':
+            return outward + ' ' + inward
+        return outward.str.ljust(4 if style == 'pcd7' else 5) + inward
+
+    def report(self):
+        """
+        Text report of the values normalized.
+        """
+        ret = 'Postcodes: {} normalized, {} changed, {} not postcodes'.format(self.values, self.changed, self.invalid)
+        if self.invalid > 0:
+            ret += ' (for example "{}")'.format('", "'.join([str(i) for i in self.invalid_examples]))
+        return ret
@@ -0,0 +1,151 @@
+"""
+Fusion of the dependency mappings with the source queries
+"""
+
+import re
+import pandas as pd
+from integrator.tables import DBTable, DBTableTimed
+from integrator.mapping import DBMapping
+from integrator.util import ObtainDataError
+
+
+# the input values of the source queries: "(values {references}) tempT(variable)"
+VALUES_PATTERN = re.compile(r'\(\s*values\s+\{references\}\s*\)\s*tempT\(\s*(\w+)\s*\)', re.IGNORECASE)
+
+
+class FusedSource(DBTable):
+    """
+    A source whose query runs on the server together with the mappings from the input variable to its reference. Only the final rows are returned: the mapped variables and the columns of the source (named as the source would name them).
+
+    @param source: the DBTable source
+    @param hops: list of (from_variable, to_variables, mapping class, table) from the input variable to the source reference
+    @param engine: an sqlalchemy engine (the same for the mappings and the source)
+    """
+    def __init__(self, source, hops, engine):
+        self.source = source
+        self.hops = hops
+        self._selected = [(0, hops[0][0])] # (hop, variable) returned by the mapping query
+        for n, (from_variable, to_variables, method, table) in enumerate(hops):
+            self._selected += [(n, i) for i in to_variables if i not in [j[1] for j in self._selected]]
+        self.mapped_columns = [i[1] for i in self._selected[1:]] # the input variable is the reference
+        super().__init__(hops[0][0], query=self._fused_query(), engine=engine, rename=False, name=source.name, key_shipping=source.key_shipping)
+
+    def __str__(self):
+        return '{} (fused {} -> {})'.format(self.source, self.reference, self.source.reference)
+
+    def _mapping_query(self):
+        """
+        The query of the mappings: a join of the mapping tables, one for each hop, filtered by the input values.
+        """
+        joins = list()
+        for n, (from_variable, to_variables, method, table) in enumerate(self.hops):
+            if n == 0:
+                joins.append('{} h0'.format(table))
+            else:
+                joins.append('inner join {} h{} on h{}."{}" = h{}."{}"'.format(table, n, n - 1, from_variable, n, from_variable))
+        columns = ['h{}."{}"'.format(n, i) for n, i in self._selected]
+        return 'select distinct {} from {} where h0."{}" in (select * from (values {{references}}) tempT({}))'.format(', '.join(columns), ' '.join(joins), self.hops[0][0], self.hops[0][0])
+
+    def _fused_query(self):
+        """
+        The query of the source with its input values replaced by the mapped values.
+        """
+        reference = self.source.reference
+        source_query = VALUES_PATTERN.sub(lambda m: '(select distinct "{}" from mapped) tempT({})'.format(reference, m.group(1)), self.source.query).replace('{columns}', self.source._format_columns())
+        return """
+                         with mapped as (
+                            {mapping}
+                         ), source as (
+                            {source}
+                         )
+                         select mapped.*, source.*
+                         from mapped
+                         left join source on mapped."{reference}" = source."{reference}"
+                         """.replace('{mapping}', self._mapping_query()).replace('{source}', source_query).replace('{reference}', reference)
+
+    def obtain_data(self, mapping):
+        """
+        Obtain the mapped variables and the source data for the input values.
+        """
+        self._obtain_pre_checks(mapping)
+        sql_ret = self._obtain_data(mapping)
+        n = len(self.mapped_columns) + 1
+        mapped = sql_ret.iloc[:, :n]
+        mapped.columns = [self.reference] + self.mapped_columns
+        source = sql_ret.iloc[:, n:]
+        source.columns = [str(i) for i in source.columns.values]
+        self.source._obtain_post_checks(mapping, source)
+        source = source.drop(columns=[self.source.reference])
+        if self.source.rename:
+            source = source.rename(columns=lambda x: self.source.name + '.' + x)
+        return pd.concat([mapped, source], axis=1)
+
+    def explain(self):
+        """
+        Returns the fused query (without the input values).
+        """
+        return self.query
+
+
+class QueryPlanner:
+    """
+    Replaces the sources that need dependency mappings by FusedSource when the mappings and the source are in the same database and the source query uses the "(values {references}) tempT(variable)" input.
+
+    @param reference_engines: dictionary mapping class -> engine
+    """
+    def __init__(self, reference_engines):
+        self.reference_engines = reference_engines if reference_engines else dict()
+
+    def _chain(self, reference, compiled_targets, columns):
+        """
+        Returns the mappings (from_variable, method) from the input columns to a reference, in order.
+        """
+        producer = dict()
+        for (source_cols, method), target_cols in compiled_targets:
+            for t in target_cols:
+                producer.setdefault(t, (source_cols, method))
+        chain = list()
+        cur = reference
+        while cur not in columns:
+            if cur not in producer or len(chain) > len(compiled_targets):
+                raise ObtainDataError('Not possible to find the mapping for "{}".'.format(reference))
+            chain.insert(0, producer[cur])
+            cur = producer[cur][0]
+        return chain
+
+    def _fusable(self, d, chain):
+        if type(d.reference) is not str or not isinstance(d, DBTable) or isinstance(d, (DBTableTimed, DBMapping, FusedSource)):
+            return False
+        if d.engine is None or VALUES_PATTERN.search(d.query) is None:
+            return False
+        for source_cols, method in chain:
+            engine = self.reference_engines.get(method)
+            if not getattr(method, 'FUSABLE', False) or getattr(method, 'TABLE', None) is None or engine is None or str(engine.url) != str(d.engine.url):
+                return False
+        return True
+
+    def plan(self, sources, compiled_targets, columns):
+        """
+        Returns the new list of sources and the mappings still needed (from compiled_targets) by the sources that were not fused.
+
+        @param sources: the sources
+        @param compiled_targets: the mappings (as returned by DataCollector._minimum_mapping)
+        @param columns: the input columns
+        """
+        planned = list()
+        needed = set()
+        for d in sources:
+            refs = d.reference if type(d.reference) is list else [d.reference]
+            if all([r in columns for r in refs]):
+                planned.append(d)
+                continue
+            chains = [self._chain(r, compiled_targets, columns) for r in refs if r not in columns]
+            if len(chains) == 1 and self._fusable(d, chains[0]):
+                targets = dict(compiled_targets)
+                hops = [(source_cols, targets[(source_cols, method)], method, method.TABLE) for source_cols, method in chains[0]]
+                planned.append(FusedSource(d, hops, self.reference_engines[chains[0][0][1]]))
+            else:
+                planned.append(d)
+                for chain in chains:
+                    needed.update(chain)
+        return planned, [i for i in compiled_targets if i[0] in needed]
@@ -3,7 +3,13 @@
 Definition of class for postcode mapping
 """
 
+import threading
+import time
+import numpy as np
+import pandas as pd
+from integrator.tables import DataSource
 from integrator.mapping import DBMapping
+from integrator.util import ObtainDataError
 
 
 class PostcodeMapping(DBMapping): #XXX if mapping one bigger to smaller there might be issues!
@@ -15,6 +21,123 @@ class PostcodeMapping(DBMapping): #XXX if mapping one bigger to smaller there mi
     @param engine: an sqlalchemy engine
     """
     AVAILABLE = ['pc', 'oa', 'lsoa', 'msoa', 'lad']
+    TABLE = 'public.postcode_lookup11'
     def __init__(self, from_variable, to_variables, engine):
-        super().__init__(from_variable, to_variables, engine, table='public.postcode_lookup11')
+        super().__init__(from_variable, to_variables, engine, table=self.TABLE)
 
+
+
+class PostcodeHierarchy:
+    """
+    The postcode -> oa -> lsoa -> msoa -> lad hierarchy in compact arrays: the codes of each level are stored once (interned) and each level keeps the position of its parent in the next level, so a mapping is a hash lookup of the values followed by array gathers.
+
+    The hierarchy must be strict (each area has a single parent).
+
+    @param df: data frame with the columns pc, oa, lsoa, msoa and lad (for example the postcode lookup table)
+    """
+    LEVELS = ['pc', 'oa', 'lsoa', 'msoa', 'lad']
+
+    def __init__(self, df):
+        missing = [i for i in self.LEVELS if i not in df.columns]
+        if len(missing) > 0:
+            raise ObtainDataError('The postcode hierarchy requires the columns "{}".'.format('", "'.join(missing)))
+        df = df[self.LEVELS].drop_duplicates()
+        self.codes = {i: pd.Index(pd.unique(df[i].dropna().values)) for i in self.LEVELS} # level -> pandas.Index with the codes of the level
+        self.parents = dict() # level -> int32 array with the position of the parent of each code in the next level (-1 if missing)
+        for level, parent in zip(self.LEVELS[:-1], self.LEVELS[1:]):
+            pairs = df.loc[df[level].notna() & df[parent].notna(), [level, parent]].drop_duplicates()
+            if pairs[level].duplicated().any():
+                duplicated = pairs.loc[pairs[level].duplicated(), level].unique()
+                raise ObtainDataError('The postcode hierarchy is not strict, some "{}" have more than one "{}" (for example "{}").'.format(level, parent, '", "'.join([str(i) for i in duplicated[:5]])))
+            parents = np.full(len(self.codes[level]), -1, dtype=np.int32)
+            parents[self.codes[level].get_indexer(pairs[level].values)] = self.codes[parent].get_indexer(pairs[parent].values)
+            self.parents[level] = parents
+
+    @classmethod
+    def from_engine(cls, engine, table=None):
+        """
+        Loads the hierarchy from the postcode lookup table.
+
+        @param engine: an sqlalchemy engine
+        @param table (default PostcodeMapping.TABLE): the table
+        """
+        table = table if table is not None else PostcodeMapping.TABLE
+        return cls(pd.read_sql_query('select distinct {} from {}'.format(', '.join(['"{}"'.format(i) for i in cls.LEVELS]), table), con=engine))
+
+    def nbytes(self):
+        """
+        The approximate size of the arrays (in bytes).
+        """
+        return int(sum([i.memory_usage(deep=True) for i in self.codes.values()]) + sum([i.nbytes for i in self.parents.values()]))
+
+    def lookup(self, from_variable, to_variables, values):
+        """
+        Maps values of a level to upper levels. Returns a data frame with the distinct values found and their areas (missing if the hierarchy has no parent).
+
+        @param from_variable: the level of the values
+        @param to_variables: list of upper levels
+        @param values: the values
+        """
+        position = self.codes[from_variable].get_indexer(pd.Series(values).values)
+        found = np.zeros(len(self.codes[from_variable]), dtype=bool)
+        found[position[position >= 0]] = True
+        position = np.flatnonzero(found) # the distinct values found
+        ret = {from_variable: self.codes[from_variable].array.take(position)}
+        for level, parent in zip(self.LEVELS[self.LEVELS.index(from_variable):], self.LEVELS[self.LEVELS.index(from_variable) + 1:max([self.LEVELS.index(i) for i in to_variables]) + 1]):
+            position = np.where(position >= 0, self.parents[level].take(np.maximum(position, 0)), -1)
+            if parent in to_variables:
+                ret[parent] = self.codes[parent].array.take(position, allow_fill=True)
+        return pd.DataFrame({i: ret[i] for i in [from_variable] + to_variables})
+
+
+class LocalPostcodeMapping(DataSource):
+    """
+    Postcode mapping (as PostcodeMapping) answered in the process from a PostcodeHierarchy, without querying the database for each chunk. It is used as PostcodeMapping in the reference sources of the DataCollector.
+
+    The hierarchy is loaded once per process for each engine (from the postcode lookup table) and shared by all the mappings.
+
+    @param from_variable: the source variables
+    @param to_variables: the target variables
+    @param engine: an sqlalchemy engine with the postcode lookup table, a PostcodeHierarchy or a data frame with the hierarchy
+    """
+    AVAILABLE = PostcodeMapping.AVAILABLE
+    REFERENCES_ORDERED = True
+    TABLE = PostcodeMapping.TABLE
+    FUSABLE = False
+    check_variables_interaction = classmethod(DBMapping.check_variables_interaction.__func__)
+    _hierarchies = dict() # engine url -> PostcodeHierarchy
+    _lock = threading.Lock()
+
+    @classmethod
+    def hierarchy(cls, engine):
+        """
+        Returns the hierarchy of an engine (loaded once), a PostcodeHierarchy or a data frame.
+        """
+        if isinstance(engine, PostcodeHierarchy):
+            return engine
+        if isinstance(engine, pd.DataFrame):
+            return PostcodeHierarchy(engine)
+        key = (str(engine.url), cls.TABLE)
+        with cls._lock:
+            if key not in cls._hierarchies:
+                cls._hierarchies[key] = PostcodeHierarchy.from_engine(engine, cls.TABLE)
+            return cls._hierarchies[key]
+
+    def __init__(self, from_variable, to_variables, engine):
+        self.check_variables_interaction(from_variable, to_variables)
+        if type(to_variables) is str:
+            to_variables = [to_variables]
+        super().__init__(reference=from_variable, rename=False)
+        self.to_variables = to_variables
+        self.engine = engine
+        self._hierarchy = self.hierarchy(engine)
+        self.last_timings = dict()
+
+    def obtain_data(self, mapping):
+        """
+        Obtain the upper areas of the values searched.
+        """
+        start = time.time()
+        ret = self._hierarchy.lookup(self.reference, self.to_variables, mapping)
+        self.last_timings = {'sql_generation': 0.0, 'query_execution': time.time() - start, 'sql_length': 0}
+        return ret
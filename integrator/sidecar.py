@@ -0,0 +1,139 @@
+"""
+Columnar sidecars of the delimited files read by the sources
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+from integrator.util import ObtainDataError
+
+
+class CSVSidecar:
+    """
+    Columnar copy of a delimited file (an uncompressed Arrow IPC / Feather file, "<file>.arrow") written next to it. The columns are read by memory-mapping the sidecar, without parsing the file again.
+
+    The sidecar stores the size, the modification time and the hash of the file and the reading options. It is valid while the size and the modification time match (or, if only the modification time changed, the hash) and it is written again otherwise.
+
+    Requires pyarrow.
+
+    @param target_file: the delimited file
+    @param delimiter (default ','): the delimiter of the file
+    @param encoding (default None): the encoding of the file
+    @param path (default None): the sidecar file, by default "<target_file>.arrow"
+    @param low_memory (default True): see pandas.read_csv, the same as the parsing of the file without sidecar (the types inferred depend on it)
+    """
+    METADATA = b'integrator.source'
+
+    def __init__(self, target_file, delimiter=',', encoding=None, path=None, low_memory=True):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ObtainDataError('The sidecar of "{}" requires pyarrow. Please install it (pip install pyarrow).'.format(target_file))
+        self.target_file = target_file
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.path = path if path is not None else target_file + '.arrow'
+        self.low_memory = low_memory
+
+    def _hash(self):
+        """
+        The hash of the content of the file.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        with open(self.target_file, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _source(self, with_hash=True):
+        """
+        The description of the file stored in the sidecar.
+        """
+        stat = os.stat(self.target_file)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': self._hash() if with_hash else None, 'delimiter': self.delimiter, 'encoding': self.encoding, 'low_memory': self.low_memory}
+
+    def _stored(self):
+        """
+        The description of the file stored in the sidecar (None if there is no sidecar or it can not be read).
+        """
+        import pyarrow as pa
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with pa.memory_map(self.path) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata
+            return json.loads(metadata[self.METADATA]) if metadata and self.METADATA in metadata else None
+        except (pa.ArrowInvalid, OSError, ValueError):
+            return None
+
+    def is_valid(self):
+        """
+        Checks if the sidecar matches the file: the reading options and the size must match, and the modification time or the hash.
+        """
+        stored = self._stored()
+        if stored is None:
+            return False
+        current = self._source(with_hash=False)
+        if any([stored.get(i) != current[i] for i in ['size', 'delimiter', 'encoding', 'low_memory']]):
+            return False
+        return stored.get('mtime') == current['mtime'] or stored.get('hash') == self._hash()
+
+    def write(self):
+        """
+        Parses the file and writes the sidecar (to a temporary file replacing the previous sidecar at the end).
+        """
+        import pyarrow as pa
+        source = self._source()
+        df = pd.read_csv(self.target_file, delimiter=self.delimiter, index_col=False, encoding=self.encoding, low_memory=self.low_memory)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ObtainDataError('Not possible to convert "{}" to a columnar sidecar.'.format(self.target_file)) from e
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), self.METADATA: json.dumps(source).encode()})
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with pa.OSFile(temporary, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temporary, self.path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def prepare(self, verbose=True):
+        """
+        Writes the sidecar if it does not match the file. Returns True if the sidecar can be used, False if the file could not be converted (it should be parsed instead).
+
+        @param verbose (default True): if the conversion is reported
+        """
+        if self.is_valid():
+            return True
+        if verbose:
+            print('Converting "{}" to the columnar sidecar "{}", this might take some time.'.format(self.target_file, self.path))
+        try:
+            self.write()
+        except (ObtainDataError, OSError) as e:
+            if verbose:
+                print('Not possible to write the sidecar of "{}" ({}), the file will be parsed.'.format(self.target_file, e))
+            return False
+        return True
+
+    def columns(self):
+        """
+        The columns of the file.
+        """
+        import pyarrow as pa
+        with pa.memory_map(self.path) as source:
+            return list(pa.ipc.open_file(source).schema.names)
+
+    def read(self, columns):
+        """
+        Reads some columns from the memory-mapped sidecar.
+
+        @param columns: list of columns
+        """
+        import pyarrow as pa
+        with pa.memory_map(self.path) as source:
+            table = pa.ipc.open_file(source).read_all().select(list(columns))
+            return table.to_pandas()
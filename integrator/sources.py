@@ -12,21 +12,22 @@ class Income(DBTable):
     Income table from postcode information.
 
     @param engine: an sqlalchemy engine
+    @param columns (default None): list of columns to be returned, by default all of them
     """
-    def __init__(self, engine):
+    def __init__(self, engine, columns=None):
         super().__init__('msoa', query="""
                          with filtering_part as (
                             select *
                             from (values {references}) tempT(msoa)
                          ), condition as (
-                            select *
+                            select {columns}
                             from compiled.income
                          )
                          select condition.* 
                          from filtering_part
                          left join condition on filtering_part.msoa = condition.msoa
                          where condition.msoa is not null
-                         """, engine=engine)
+                         """, engine=engine, columns=columns, table='compiled.income')
 
 
 class IndexMultipleDeprivation(DBTable):
@@ -35,16 +36,19 @@ class IndexMultipleDeprivation(DBTable):
 
     @param engine: an sqlalchemy engine
     @param mode: 'everything' - all the scores; 'only_scores' - only the main IMD score
+    @param columns (default None): for the mode 'everything', list of columns to be returned, by default all of them
     """
-    def __init__(self, engine, mode='everything'):
+    def __init__(self, engine, mode='everything', columns=None):
         modes = ['everything', 'only_scores']
+        if columns is not None and mode != 'everything':
+            raise ObtainDataError('Selecting columns for "{}" is only possible with the mode "everything".'.format(self.__class__.__name__))
         if mode == 'everything':
             query = """
                          with filtering_part as (
                             select *
                             from (values {references}) tempT(lsoa)
                          ), condition as (
-                            select *
+                            select {columns}
                             from public.indexmultipledeprivation
                          )
                          select condition.*
@@ -68,7 +72,7 @@ class IndexMultipleDeprivation(DBTable):
                          """
         else:
             raise ObtainDataError('Invalid mode for "{}", please select one of: "{}"'.format(self.__class__.__name__, '", "'.join(modes)))
-        super().__init__('lsoa', query=query, engine=engine)
+        super().__init__('lsoa', query=query, engine=engine, columns=columns, table='public.indexmultipledeprivation')
 
 
 class CrimesOutcome(DBTable):
@@ -76,21 +80,22 @@ class CrimesOutcome(DBTable):
     Outcomes of crimes associated with lsoa.
 
     @param engine: and sqlalchemy engine
+    @param columns (default None): list of columns to be returned, by default all of them
     """
-    def __init__(self, engine):
+    def __init__(self, engine, columns=None):
         super().__init__('lsoa', query="""
                          with filtering_part as (
                             select *
                             from (values {references}) tempT(lsoa)
                          ), condition as (
-                            select *
+                            select {columns}
                             from compiled.crimes_outcomes_yearly
                          )
                          select condition.* 
                          from filtering_part
                          left join condition on filtering_part.lsoa = condition.lsoa
                          where condition.lsoa is not null
-                         """, engine=engine)
+                         """, engine=engine, columns=columns, table='compiled.crimes_outcomes_yearly')
 
 
 class CrimesStreet(DBTable):
@@ -98,21 +103,22 @@ class CrimesStreet(DBTable):
     Crimes in streets associated with lsoa.
 
     @param engine: and sqlalchemy engine
+    @param columns (default None): list of columns to be returned, by default all of them
     """
-    def __init__(self, engine):
+    def __init__(self, engine, columns=None):
         super().__init__('lsoa', query="""
                          with filtering_part as (
                             select *
                             from (values {references}) tempT(lsoa)
                          ), condition as (
-                            select *
+                            select {columns}
                             from compiled.crimes_street_type_yearly
                          )
                          select condition.*
                          from filtering_part
                          left join condition on filtering_part.lsoa = condition.lsoa
                          where condition.lsoa is not null
-                         """, engine=engine)
+                         """, engine=engine, columns=columns, table='compiled.crimes_street_type_yearly')
 
 
 
@@ -120,13 +126,21 @@ class Crime(DBCategory):
     """
     Grouped variables for crime.
     """
-    def get_tables(engine):
+    def get_tables(engine, columns=None):
         """
         get_tables yields CrimesOutcome and CrimesStreet
         @param engine: an sqlalchemy engine
+        @param columns (default None): dictionary mapping "outcome" and/or "street" -> list of columns to be returned; only the tables in the dictionary are returned
         """
-        yield CrimesOutcome(engine)
-        yield CrimesStreet(engine)
+        if columns is None:
+            columns = {'outcome': None, 'street': None}
+        invalid = [i for i in columns if i not in ['outcome', 'street']]
+        if len(invalid) > 0:
+            raise ObtainDataError('Invalid tables "{}", expected "outcome" and/or "street".'.format('", "'.join(invalid)))
+        if 'outcome' in columns:
+            yield CrimesOutcome(engine, columns=columns['outcome'])
+        if 'street' in columns:
+            yield CrimesStreet(engine, columns=columns['street'])
 
 
 class Census11(DBCategory):
@@ -137,7 +151,7 @@ class Census11(DBCategory):
                             select *
                             from (values {references}) tempT(oa)
                          ), condition as (
-                            select *
+                            select {columns}
                             from census2011.{table}
                          )
                          select condition.* 
@@ -145,12 +159,19 @@ class Census11(DBCategory):
                          left join condition on filtering_part.oa = condition.oa
                          where condition.oa is not null"""
     options = ['adults_not_employment_etc', 'age_structure', 'car_etc', 'census_industry', 'communal_etc', 'country_birth', 'dwellings_etc', 'economic_etc', 'ethnic_group', 'health_unpaid_care', 'hours_worked', 'household_composition', 'household_language', 'living_arrangements', 'lone_parents_household_etc', 'marital_and_civil_partnership_status', 'national_identity', 'nssec_etc', 'occupation_sex', 'passports_held', 'qualifications_students', 'religion', 'rooms_etc', 'tenure', 'usual_resident_population']
-    def get_tables(engine):
+    def get_tables(engine, columns=None):
         """
         get_tables yields quite a few options enumerated in Census11.options
 
         @param engine: an sqlalchemy engine
+        @param columns (default None): dictionary mapping table (one of Census11.options) -> list of columns to be returned (None for all of them); only the tables in the dictionary are returned
         """
+        if columns is None:
+            columns = {t: None for t in Census11.options}
+        invalid = [i for i in columns if i not in Census11.options]
+        if len(invalid) > 0:
+            raise ObtainDataError('Invalid census tables "{}".'.format('", "'.join(invalid)))
         for t in Census11.options:
-            yield DBTable('oa', Census11.query_format.replace('{table}', t), engine=engine, name='Census11_' + t)
+            if t in columns:
+                yield DBTable('oa', Census11.query_format.replace('{table}', t), engine=engine, name='Census11_' + t, columns=columns[t], table='census2011.' + t)
  
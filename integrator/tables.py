@@ -4,10 +4,27 @@ Definition of main types of extractors
 """
 
 
+import re
+import time
+import uuid
+import io
+import csv
+import json
+import contextlib
+import threading
+import zipfile
+import numpy as np
 import pandas as pd
 from integrator.util import ObtainDataError
+from integrator.cache import FileStore
+from integrator.sidecar import CSVSidecar
+from integrator.temporal import TemporalSearch
 import os
 
+
+# the input values of the queries: "(values {references})"
+KEYS_PATTERN = re.compile(r'\(\s*values\s+\{references\}\s*\)', re.IGNORECASE)
+
 class DataSource:
     """
     This class provides the abstraction for data extraction connectors
@@ -41,35 +58,59 @@ class DataSource:
 
     
 class CSVTable(DataSource):
-    loaded_files = dict() # file -> [([fields], pd)]
-    
+    """
+    Data from a delimited file, searched by the reference column.
+
+    The files are kept in a store shared by all the CSVTable (CSVTable.store, see cache.FileStore): the columns already loaded are reused and the memory kept is bounded by CSVTable.store.resize(max_bytes).
+
+    The values searched are found through an index of the reference column built once per file, which requires the reference to be unique in the file (checked when the source is created).
+
+    In the streaming mode the file is not loaded: each search scans the file once in blocks (also from a zip archive) keeping only the rows of the values searched, so the memory used depends on the values searched instead of the size of the file. The values of several chunks can be searched in a single scan with prefetch (see the DataCollector prefetch_chunks).
+
+    @param reference: reference variable
+    @param target_file: the file
+    @param target_columns (default None): list of columns returned (besides the reference), by default all of them
+    @param delimiter (default ','): the delimiter of the file
+    @param encoding (default None): the encoding of the file
+    @param name: name to show on the returned data
+    @param low_memory (default True): see pandas.read_csv
+    @param dtype_policy (default None): a dtypes.DtypePolicy converting the columns returned (except the reference) to compact types
+    @param sidecar (default False): if the file is converted once to a columnar sidecar next to it (see sidecar.CSVSidecar), from which the columns are memory-mapped instead of parsing the file (requires pyarrow)
+    @param streaming (default False): if the file is scanned for the values searched instead of being loaded
+    @param scan_rows (default 2**18): in the streaming mode, the number of rows of each block read
+    @param member (default None): in the streaming mode, the file read from a zip archive, by default its only file
+    """
+    store = FileStore()
+
+    @classmethod
+    def _file_key(cls, target_file, delimiter, encoding=None, sidecar=False):
+        """
+        The key of a file in the store: the path, the reading options, if it is read from the sidecar and the modification time (a modified file is loaded again).
+        """
+        return (os.path.abspath(target_file), delimiter, encoding, bool(sidecar), os.path.getmtime(target_file))
+
     @classmethod
-    def get_file(cls, target_file, delimiter, columns, encoding=None, low_memory=True):
+    def get_file(cls, target_file, delimiter, columns, encoding=None, low_memory=True, sidecar=None):
         if isinstance(columns, str):
             columns = [columns]
-        if target_file in cls.loaded_files:
-            for fields, df in cls.loaded_files[target_file]:
-                if len(set(columns).intersection(set(fields))) == len(columns):
-                    return df
-        else:
-            cls.loaded_files[target_file] = list()
-        print('Loading file "{}" with columns "{}", this might take some time.'.format(target_file, '", "'.join(columns)))
-        _df = pd.read_csv(target_file, delimiter=delimiter, index_col=False, usecols=columns, encoding=encoding, low_memory=low_memory)
-        cls.loaded_files[target_file].append((columns, _df))
-        return _df
-    
+        def _load(missing):
+            if sidecar is not None:
+                return sidecar.read(missing)
+            print('Loading file "{}" with columns "{}", this might take some time.'.format(target_file, '", "'.join(missing)))
+            return pd.read_csv(target_file, delimiter=delimiter, index_col=False, usecols=missing, encoding=encoding, low_memory=low_memory)
+        return cls.store.get(cls._file_key(target_file, delimiter, encoding, sidecar is not None), columns, _load)
+
     @classmethod
-    def is_loaded(cls, target_file, delimiter, columns, encoding=None):
+    def is_loaded(cls, target_file, delimiter, columns, encoding=None, sidecar=False):
         if isinstance(columns, str):
             columns = [columns]
-        if target_file in cls.loaded_files:
-            for fields, df in cls.loaded_files:
-                if len(set(columns).intersection(set(fields))) == len(columns):
-                    return True
-        return False
-    
-    def __init__(self, reference, target_file, target_columns=None, delimiter=',', encoding=None, name=None, low_memory=True):
+        if not os.path.exists(target_file):
+            return False
+        return cls.store.is_loaded(cls._file_key(target_file, delimiter, encoding, sidecar), columns)
+
+    def __init__(self, reference, target_file, target_columns=None, delimiter=',', encoding=None, name=None, low_memory=True, dtype_policy=None, sidecar=False, streaming=False, scan_rows=2**18, member=None):
         super().__init__(reference=reference, name=name)
+        self.dtype_policy = dtype_policy
 
         self.encoding = encoding
         self.delimiter = delimiter
@@ -79,24 +120,112 @@ class CSVTable(DataSource):
         self.target_columns = target_columns
         self.low_memory = low_memory
 
+        self.streaming = streaming
+        self.scan_rows = scan_rows
+        self.member = member
+
         if not os.path.exists(target_file):
             raise ObtainDataError('File "{}" does not exists.'.format(target_file))
+        if streaming and sidecar:
+            raise ObtainDataError('The streaming mode of "{}" does not use a sidecar.'.format(self.name))
+
+        self._sidecar = None
+        if sidecar:
+            self._sidecar = CSVSidecar(target_file, delimiter=delimiter, encoding=encoding, low_memory=low_memory)
+            if not self._sidecar.prepare():
+                self._sidecar = None
+        if self._sidecar is not None:
+            _file_columns = self._sidecar.columns()
+        else:
+            with self._open() as f:
+                _file_columns = pd.read_csv(f, delimiter=self.delimiter, nrows=0, encoding=self.encoding, low_memory=low_memory).columns.values
 
-        _testdf = pd.read_csv(self.target_file, delimiter=self.delimiter, nrows=0, encoding=self.encoding, low_memory=low_memory)
-
-        if reference not in _testdf.columns.values:
+        if reference not in _file_columns:
             raise ObtainDataError('Reference column "{}" not found.'.format(reference))
 
+        if self.target_columns is None:
+            self.target_columns = [i for i in _file_columns if i != reference]
         _invalid_columns = list()
         for i in self.target_columns:
-            if i not in _testdf.columns.values:
+            if i not in _file_columns:
                 _invalid_columns.append(i)
         if len(_invalid_columns) > 0:
             raise ObtainDataError('Not possible to find columns "{}".'.format('", "'.join(_invalid_columns)))
 
-        if self.target_columns is None:
-            self.target_columns = _testdf.columns.values
-        self._df = CSVTable.get_file(target_file, delimiter=delimiter, columns=[self.reference] + self.target_columns, encoding=self.encoding, low_memory=self.low_memory)
+        if streaming:
+            self._lock = threading.RLock()
+            self._prefetched = None # (keys scanned, index of the rows found, rows found)
+        else:
+            self._index(self._load())
+
+    @contextlib.contextmanager
+    def _open(self):
+        """
+        Opens the file for pandas.read_csv: the path or, for a zip archive in the streaming mode, the file in the archive.
+        """
+        if not self.streaming or not zipfile.is_zipfile(self.target_file):
+            yield self.target_file
+            return
+        with zipfile.ZipFile(self.target_file) as archive:
+            names = [i for i in archive.namelist() if not i.endswith('/')]
+            member = self.member if self.member is not None else (names[0] if len(names) == 1 else None)
+            if member not in names:
+                raise ObtainDataError('Select the file of "{}" with member: "{}".'.format(self.target_file, '", "'.join(names)))
+            with archive.open(member) as f:
+                yield f
+
+    def _columns_read(self):
+        """
+        The columns read from the file: the reference and the target columns.
+        """
+        return [self.reference] + [i for i in self.target_columns if i != self.reference]
+
+    def prefetch(self, values):
+        """
+        Streaming mode: scans the file once keeping the rows of the values (replacing the rows kept before).
+
+        @param values: the values searched (for example the reference values of several chunks)
+        """
+        keys = pd.Index(pd.unique(pd.Series(values).dropna().values))
+        columns = self._columns_read()
+        found = list()
+        with self._lock:
+            with self._open() as f:
+                for block in pd.read_csv(f, delimiter=self.delimiter, index_col=False, usecols=columns, encoding=self.encoding, low_memory=self.low_memory, chunksize=self.scan_rows):
+                    block = block.loc[block[self.reference].isin(keys)]
+                    if len(block) > 0 or len(found) == 0: # an empty block keeps the types if nothing is found
+                        found.append(block)
+            df = pd.concat(found, ignore_index=True) if len(found) > 0 else pd.DataFrame(columns=columns)
+            df = df[columns]
+            index = pd.Index(df[self.reference])
+            if not index.is_unique:
+                duplicated = index[index.duplicated()].unique()
+                raise ObtainDataError('The reference "{}" has {} duplicate values in "{}" (for example "{}").'.format(self.reference, len(duplicated), self.target_file, '", "'.join([str(i) for i in duplicated[:5]])))
+            self._prefetched = (keys, index, df)
+
+    def _search(self, values):
+        """
+        Streaming mode: the rows of the values, scanning the file if some of them were not scanned before.
+        """
+        keys = pd.unique(pd.Series(values).dropna().values)
+        with self._lock:
+            if self._prefetched is None or not pd.Index(keys).isin(self._prefetched[0]).all():
+                self.prefetch(keys)
+            _, index, df = self._prefetched
+        found = index.get_indexer(keys)
+        return df.iloc[np.sort(found[found >= 0])]
+
+    def _load(self):
+        """
+        The frame with the reference and the target columns (from the store).
+        """
+        return CSVTable.get_file(self.target_file, delimiter=self.delimiter, columns=self._columns_read(), encoding=self.encoding, low_memory=self.low_memory, sidecar=self._sidecar)
+
+    def _index(self, df=None):
+        """
+        The lookup index of the reference column (from the store, see cache.FileStore.index).
+        """
+        return CSVTable.store.index(CSVTable._file_key(self.target_file, self.delimiter, self.encoding, self._sidecar is not None), self.reference, df)
 
     def _post_op(self, df):
         return super()._post_op(df)
@@ -104,7 +233,16 @@ class CSVTable(DataSource):
     def obtain_data(self, mapping, warning=True):
         if warning:
             print("TODO: this call does not perform any check")
-        return self._post_op(self._df.loc[self._df[self.reference].isin(mapping)])
+        if self.streaming:
+            df = self._post_op(self._search(mapping))
+        else:
+            df = self._load()
+            index, positions = self._index(df)
+            found = index.get_indexer(pd.unique(pd.Series(mapping).values))
+            df = self._post_op(df.iloc[np.sort(positions[found[found >= 0]])])
+        if self.dtype_policy is not None:
+            df = self.dtype_policy.apply(df, exclude=[self.reference])
+        return df
 
 
 class DBTable(DataSource):
@@ -116,14 +254,76 @@ class DBTable(DataSource):
     @param engine: an sqlalchemy engine
     @param rename: if we should rename the returned table (instead of the class name) to name
     @param name: name to show on the returned data
+    @param columns (default None): list of columns of the table to be returned (besides the reference), the query must select "{columns}" from the table; by default all of them
+    @param table (default None): the table ("schema.table") queried, required to check the columns selected
+    @param key_shipping (default 'values'): how the values searched are sent to the database: 'values' - inlined in the query as "(values ...)"; 'temp_table' - loaded into a temporary table (with COPY for psycopg2) which the query selects from
+    @param cache (default None): a cache.PersistentCache keeping the data obtained between runs, only the values not cached are queried
+    @param batch_size (default None): if set, the results are read with a server-side cursor in batches of this number of rows instead of all at once
+    @param dtype_policy (default None): a dtypes.DtypePolicy converting the columns returned (except the references) to compact types
     """
-    def __init__(self, reference, query, engine=None, rename=True, name=None):
+    KEY_SHIPPING = ['values', 'temp_table']
+
+    def __init__(self, reference, query, engine=None, rename=True, name=None, columns=None, table=None, key_shipping='values', cache=None, batch_size=None, dtype_policy=None):
         super().__init__(reference=reference, name=name, rename=rename)
         self.engine = engine
         self.query = query
+        self.table = table
+        if isinstance(columns, str):
+            columns = [columns]
+        self.columns = columns
         self._number_cols = 0
         self._columns = []
         self._query_sql = None
+        self.last_timings = dict()
+        self.row_conditions = list() # SQL conditions on the returned columns (set by the DataCollector filters)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.dtype_policy = dtype_policy
+        self.set_key_shipping(key_shipping)
+        if self.columns is not None:
+            self._check_columns()
+
+    def set_key_shipping(self, key_shipping):
+        """
+        Sets how the values searched are sent to the database ('values' or 'temp_table').
+        """
+        if key_shipping not in self.KEY_SHIPPING:
+            raise ObtainDataError('Invalid key shipping "{}" for "{}", please select one of: "{}"'.format(key_shipping, self.name, '", "'.join(self.KEY_SHIPPING)))
+        if key_shipping == 'temp_table' and self.query is not None and len(KEYS_PATTERN.findall(self.query)) != self.query.count('{references}'):
+            raise ObtainDataError('The query of "{}" does not select the values searched as "(values {{references}})", the temporary table can not be used.'.format(self.name))
+        self.key_shipping = key_shipping
+
+    def _check_columns(self):
+        """
+        Checks that the columns selected exist in the table and that the query can select them.
+        """
+        if '{columns}' not in self.query:
+            raise ObtainDataError('The query of "{}" does not allow selecting columns.'.format(self.name))
+        if self.table is None or self.engine is None:
+            raise ObtainDataError('Selecting columns for "{}" requires the engine and the table.'.format(self.name))
+        try:
+            table_columns = pd.read_sql_query('select * from {} where 1 = 0'.format(self.table), con=self.engine).columns.values
+        except Exception as e:
+            raise ObtainDataError('Not possible to read the columns of "{}" for "{}".'.format(self.table, self.name)) from e
+        refs = self._table_references()
+        invalid_columns = [i for i in refs + self.columns if i not in table_columns]
+        if len(invalid_columns) > 0:
+            raise ObtainDataError('Not possible to find columns "{}" in "{}".'.format('", "'.join(invalid_columns), self.table))
+
+    def _table_references(self):
+        """
+        The columns of the table always selected (the references).
+        """
+        return self.reference if type(self.reference) is list else [self.reference]
+
+    def _format_columns(self):
+        """
+        The columns selected from the table for the query: the reference and the columns selected, or all of them.
+        """
+        if self.columns is None:
+            return '*'
+        refs = self._table_references()
+        return ', '.join(['"{}"'.format(i) for i in refs + [i for i in self.columns if i not in refs]])
 
        
     def _format_for_query(self, values):
@@ -134,14 +334,106 @@ class DBTable(DataSource):
 
     def _format_for_query_multiple(self, values):
         """
-        Formats the values to the multiple references required.
+        Formats the values to the multiple references required. The quotes in the values are escaped.
         """
         if isinstance(values, pd.core.frame.DataFrame):
-            return ', '.join([ "('" + "', '".join([str(i) if not isinstance(i, pd.Series.dt) else i.strftime("'%Y-%m-%d'") for i in els ]) + "')" for els in zip(*[values[r] for r in self.reference])])
+            values = values[self.reference].drop_duplicates()
+            rows = "('" + values[self.reference[0]].astype(str).str.replace("'", "''", regex=False)
+            for r in self.reference[1:]:
+                rows = rows + "', '" + values[r].astype(str).str.replace("'", "''", regex=False)
+            return ', '.join(rows + "')")
         elif isinstance(values, pd.core.series.Series):
-            values = [str(i) for i in set(values) if str(i) != ''] #XXX the if is a precaution against NULL values
+            values = pd.Series(pd.unique(values.astype(str)))
+            values = values[values != ''].str.replace("'", "''", regex=False) #XXX the if is a precaution against NULL values
             return  "('" + "'), ('".join(values) + "')"
 
+    def _key_rows(self, values):
+        """
+        Returns the distinct values searched as a data frame (one column for each reference), with the same conversions as _format_for_query_multiple.
+        """
+        if isinstance(values, pd.core.frame.DataFrame):
+            return values[self.reference].drop_duplicates()
+        values = pd.Series(pd.unique(values.astype(str)))
+        return pd.DataFrame({self.reference: values[values != '']})
+
+    def _load_keys(self, con, values):
+        """
+        Creates a temporary table with the values searched in the connection. Returns the name of the table.
+
+        With psycopg2 the values are loaded with COPY, otherwise with a bulk insert.
+        """
+        import sqlalchemy as sa
+        keys = self._key_rows(values)
+        columns = ['k{}'.format(i) for i in range(len(keys.columns))]
+        types = [sa.DateTime() if pd.api.types.is_datetime64_any_dtype(keys[c]) else sa.Text() for c in keys.columns]
+        name = 'integrator_keys_' + uuid.uuid4().hex[:12]
+        if con.dialect.name == 'mssql':
+            table = sa.Table('#' + name, sa.MetaData(), *[sa.Column(c, t) for c, t in zip(columns, types)])
+        else:
+            table = sa.Table(name, sa.MetaData(), *[sa.Column(c, t) for c, t in zip(columns, types)], prefixes=['TEMPORARY'])
+        table.create(con)
+        keys.columns = columns
+        for c, t in zip(columns, types):
+            if isinstance(t, sa.Text):
+                keys[c] = keys[c].astype(str)
+        if con.dialect.driver == 'psycopg2':
+            buffer = io.StringIO()
+            keys.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+            buffer.seek(0)
+            with con.connection.dbapi_connection.cursor() as cursor:
+                cursor.copy_expert('COPY {} FROM STDIN WITH (FORMAT csv)'.format(table.name), buffer)
+        else:
+            con.execute(table.insert(), keys.to_dict('records'))
+        return table.name
+
+    def _format_query(self, query, references, references_l):
+        """
+        Formats the query with the values searched.
+        """
+        return query.format(references=references, references_l=references_l, referencevars=', '.join(self.reference), columns=self._format_columns())
+
+    def _execute(self, mapping, parse_dates=None):
+        """
+        Formats the query for the values searched (sending them as set by key_shipping) and runs it.
+        """
+        start = time.time()
+        if self.key_shipping == 'values':
+            references = self._format_for_query(mapping)
+            self._query_sql = self._with_conditions(self._format_query(self.query, references, references))
+            return self._read_sql(start, con=self.engine, parse_dates=parse_dates)
+        with self.engine.begin() as con:
+            table = self._load_keys(con, mapping)
+            try:
+                query = KEYS_PATTERN.sub('(select * from {})'.format(table), self.query).replace('{references_l}', 'select * from {}'.format(table))
+                self._query_sql = self._with_conditions(self._format_query(query, None, None))
+                ret = self._read_sql(start, con=con, parse_dates=parse_dates)
+            except Exception:
+                self._discard_keys(con, table)
+                raise
+            con.exec_driver_sql('drop table {}'.format(table))
+            return ret
+
+    def _discard_keys(self, con, table):
+        """
+        Removes the temporary table of the values searched after a failed query, without hiding the error of the query: the failed transaction is rolled back first (which removes the table where it was created in the transaction, as in PostgreSQL) and the table is dropped if it is still there. If this fails too it is reported and the connection is discarded from the pool.
+        """
+        from sqlalchemy.exc import SQLAlchemyError
+        try:
+            con.rollback()
+            con.exec_driver_sql('drop table if exists {}'.format(table))
+            con.commit()
+        except SQLAlchemyError as e:
+            print('Not possible to remove the temporary table "{}" of "{}" after the failed query, the connection is discarded: {}'.format(table, self.name, e))
+            con.invalidate()
+
+    def _with_conditions(self, query_sql):
+        """
+        Adds the row conditions to a formatted query.
+        """
+        if len(self.row_conditions) > 0:
+            return 'select * from ({}) filtered where {}'.format(query_sql, ' and '.join(self.row_conditions))
+        return query_sql
+
     def _obtain_pre_checks(self, mapping):
         """
         Some pre-checks before execution.
@@ -167,10 +459,55 @@ class DBTable(DataSource):
         """
         Main iteraction loop, format the query and collects the data
         """
-        self._query_sql = self.query.format(references=self._format_for_query(mapping), references_l=self._format_for_query(mapping), referencevars=', '.join(self.reference))
-        return pd.read_sql_query(self._query_sql, con=self.engine)
+        return self._execute(mapping)
+
+    def _read_sql(self, start, con, parse_dates=None):
+        """
+        Runs the query formatted in self._query_sql and records the time taken formatting (since start) and running it in self.last_timings.
+        """
+        query_start = time.time()
+        if self.batch_size:
+            sql_ret, batches = self._read_sql_batches(con, parse_dates)
+        else:
+            sql_ret, batches = pd.read_sql_query(self._query_sql, con=con, parse_dates=parse_dates), 1
+        self.last_timings = {'sql_generation': query_start - start, 'query_execution': time.time() - query_start, 'sql_length': len(self._query_sql), 'batches': batches}
+        return sql_ret
+
+    def _read_sql_batches(self, con, parse_dates=None):
+        """
+        Runs the query formatted in self._query_sql with a server-side cursor, reading batch_size rows at a time. Each batch is converted to a data frame and checked to have the same columns. Returns the data frame and the number of batches.
+        """
+        frames = list()
+        with (self.engine.connect() if con is self.engine else contextlib.nullcontext(con)) as connection:
+            connection = connection.execution_options(stream_results=True, max_row_buffer=self.batch_size)
+            for batch in pd.read_sql_query(self._query_sql, con=connection, parse_dates=parse_dates, chunksize=self.batch_size):
+                expected = frames[0].columns.values if len(frames) > 0 else self._columns
+                if len(expected) > 0 and (len(expected) != len(batch.columns) or any([i != j for i, j in zip(expected, batch.columns.values)])):
+                    raise ObtainDataError('The columns returned differ between batches. Deactivate {}'.format(self.__class__.__name__))
+                frames.append(batch)
+        if len(frames) == 1:
+            return frames[0], 1
+        return pd.concat(frames, ignore_index=True), len(frames)
     
+    def cache_signature(self):
+        """
+        The text identifying the data returned for some values (used as key of the persistent cache): the class, the query, the columns selected, the row conditions and the renaming.
+        """
+        return json.dumps([self.__class__.__name__, self.query, self.columns, self.row_conditions, self.rename, self.name])
+
     def obtain_data(self, mapping):
+        """
+        Obtain data for a set of mapping values (using the persistent cache if set), converted by the dtype policy (if set).
+        """
+        if self.cache is not None:
+            sql_ret = self.cache.obtain_data(self, mapping, self._obtain_uncached)
+        else:
+            sql_ret = self._obtain_uncached(mapping)
+        if self.dtype_policy is not None:
+            sql_ret = self.dtype_policy.apply(sql_ret, exclude=self.reference if type(self.reference) is list else [self.reference])
+        return sql_ret
+
+    def _obtain_uncached(self, mapping):
         """
         Obtain data for a set of mapping values. Pre-checks, collection and post-checks are executed in order.
         """
@@ -189,7 +526,7 @@ class DBTableTimed(DBTable):
     The internal variable list (self.reference) expects the elements self.reference[1:] to be dates.
 
     @param reference: reference variable
-    @param query: the query to be adjusted
+    @param query: the query to be adjusted (None for the 'memory' engine)
     @param engine: an sqlalchemy engine
     @param rename: 
     @param name: 
@@ -200,7 +537,17 @@ class DBTableTimed(DBTable):
     @param delay: a negative or positive number to indicate the shift (in days) for the above dates
     @param first_presence: by default operates on the maximal date, otherwise the minimal
     @param table_date_variable: the table with the data
+    @param columns (default None): list of columns of the table to be returned (see DBTable)
+    @param table (default None): the table queried (see DBTable)
+    @param key_shipping (default 'values'): how the values searched are sent to the database (see DBTable)
+    @param batch_size (default None): if set, the results are read in batches of this number of rows (see DBTable)
+    @param temporal_engine (default 'sql'): 'sql' - the query resolves the modes in the database; 'memory' - the events of the table are loaded once and the modes are resolved in memory (see temporal.TemporalSearch)
+    @param events (default None): for the 'memory' engine, the list of event columns loaded from the table, by default all of them
+
+    THE ENGINES RETURN DIFFERENT COLUMNS: the 'sql' engine returns the columns of the query, the 'memory' engine returns the reference, the dates searched, CONDITION_DATE (the date of the event found), AMT_MEASURES (the events on that date) and the event columns (the numeric columns averaged over the events on that date, the others from the first one). The 'memory' engine is only available without query, unless the query of the class returns these columns (TEMPORAL_QUERY, see DBTableVariable), so a source can not change its columns by changing the engine.
     """
+    TEMPORAL_ENGINES = ['sql', 'memory']
+    TEMPORAL_QUERY = False # if the query returns the columns of the 'memory' engine
     # the modes contain the possible variables: begin_date, end_date, ref_date, delay
     _VALID_MODES = {None: [False, False, False],
                    'between': [True, True, False],
@@ -209,8 +556,8 @@ class DBTableTimed(DBTable):
                    'after': [False, False, True]
                    }
 
-    def __init__(self, reference, query, engine=None, rename=True, name=None, mode=None, begin_date=None, end_date=None, ref_date=None, delay=None, first_presence=None, table_date_variable=None):
-        super().__init__(reference, query, engine, rename, name)
+    def __init__(self, reference, query, engine=None, rename=True, name=None, mode=None, begin_date=None, end_date=None, ref_date=None, delay=None, first_presence=None, table_date_variable=None, columns=None, table=None, key_shipping='values', batch_size=None, temporal_engine='sql', events=None):
+        super().__init__(reference, query, engine, rename, name, table=table, key_shipping=key_shipping, batch_size=batch_size)
         self.mode = mode
         self.begin_date = begin_date
         self.end_date = end_date
@@ -221,6 +568,28 @@ class DBTableTimed(DBTable):
         self.first_presence = first_presence
         self.table_date_variable = table_date_variable
         self._check_settings()
+        if temporal_engine not in self.TEMPORAL_ENGINES:
+            raise ObtainDataError('Invalid temporal engine "{}" for "{}", please select one of: "{}"'.format(temporal_engine, self.name, '", "'.join(self.TEMPORAL_ENGINES)))
+        if temporal_engine == 'memory' and query is not None and not self.TEMPORAL_QUERY:
+            raise ObtainDataError('The in-memory temporal engine of "{}" returns the reference, the dates, CONDITION_DATE, AMT_MEASURES and the event columns instead of the columns of the query: create it without query.'.format(self.name))
+        if temporal_engine == 'sql' and query is None:
+            raise ObtainDataError('The temporal engine "sql" of "{}" requires a query.'.format(self.name))
+        if temporal_engine == 'memory' and columns is not None:
+            raise ObtainDataError('The in-memory temporal engine of "{}" selects the columns with "events".'.format(self.name))
+        self.temporal_engine = temporal_engine
+        self.events = events
+        self._temporal = TemporalSearch(self, events) if temporal_engine == 'memory' else None
+        if isinstance(columns, str):
+            columns = [columns]
+        self.columns = columns
+        if self.columns is not None:
+            self._check_columns()
+
+    def _table_references(self):
+        """
+        The reference and the date variable of the table (the other references are dates of the input).
+        """
+        return [self.reference[0]] + ([self.table_date_variable] if self.table_date_variable else [])
 
     def _check_settings(self):
         """
@@ -261,27 +630,145 @@ class DBTableTimed(DBTable):
         """
         When obtaining data using time reference we need to correct some terms in the query.
         """
-        references = self._format_for_query(mapping)
+        if self._temporal is not None:
+            start = time.time()
+            sql_ret = self._temporal.obtain_data(mapping)
+            self.last_timings = {'sql_generation': 0.0, 'query_execution': time.time() - start, 'sql_length': 0}
+            return sql_ret
+        return self._execute(mapping, parse_dates=self.reference[1:]) # XXX: the dates would be better in a specific column (avoiding the conversion of wrong columns)
+
+    def cache_signature(self):
+        """
+        The text identifying the data returned for some values, including the mode and the dates.
+        """
+        return json.dumps([super().cache_signature(), self.mode, self.inputvars, self.reference, self.delay, self.first_presence, self.table_date_variable, self.temporal_engine, self.events])
+
+    def _date_shift(self, column, delay=None):
+        """
+        The SQL expression of a date column shifted by some days (by default the delay) for the dialect of the engine.
+        """
+        if delay is None:
+            delay = int(self.delay) if self.delay else 0
+        dialect = self.engine.dialect.name if self.engine is not None else 'postgresql'
+        if dialect == 'mssql':
+            return 'DATEADD(DAY, {}, {})'.format(delay, column)
+        if dialect in ['mysql', 'mariadb']:
+            return 'DATE_ADD({}, INTERVAL {} DAY)'.format(column, delay)
+        if dialect == 'sqlite':
+            return "datetime({}, '{:+d} days')".format(column, delay)
+        return "(CAST({} AS TIMESTAMP) + INTERVAL '{} days')".format(column, delay) # the values searched are sent as text
+
+    def _format_query(self, query, references, references_l):
+        """
+        Formats the query with the values searched, the mode and the date terms.
+        """
         referencevars = ','.join(self.inputvars)
         ## the rules
         if self.mode is None:
             WHERE_CLAUSE = ''
         elif self.mode == 'after':
-            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} > DATEADD(DAY, {DELAY}, filtering_part.ref_date)'
+            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} > ' + self._date_shift('filtering_part.ref_date')
         elif self.mode == 'before':
-            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} < DATEADD(DAY, {DELAY}, filtering_part.ref_date)'
+            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} < ' + self._date_shift('filtering_part.ref_date')
         elif self.mode == 'between':
-            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} BETWEEN DATEADD(DAY, {DELAY}, filtering_part.begin_date) AND DATEADD(DAY, {DELAY}, filtering_part.end_date)'
+            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} BETWEEN ' + self._date_shift('filtering_part.begin_date') + ' AND ' + self._date_shift('filtering_part.end_date')
         elif self.mode == 'outside':
-            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} < filtering_part.begin_date or {DATEVARIABLE} > filtering_part.end_date'
+            WHERE_CLAUSE = 'WHERE {DATEVARIABLE} < ' + self._date_shift('filtering_part.begin_date', 0) + ' or {DATEVARIABLE} > ' + self._date_shift('filtering_part.end_date', 0)
         op = 'min' if self.first_presence is True else 'max'
         AS_TERM = ''
         GROUPBY_TERM = ''
         for we_have, in_dataset in zip(self.reference[1:], self.inputvars[1:]): #this is going to be added for the passage back
             AS_TERM += ', filtering_part.{GIVEN_NAME} AS {DATASET_NAME}'.format(GIVEN_NAME=in_dataset, DATASET_NAME=we_have)
             GROUPBY_TERM += ', filtering_part.{GIVEN_NAME}'.format(GIVEN_NAME=in_dataset)
-        self._query_sql = self.query.replace('{AS_TERM}', AS_TERM).replace('{GROUPBY_TERM}', GROUPBY_TERM).replace('{OPERATION}', op).format(references=references, referencevars=referencevars, WHERE=WHERE_CLAUSE.replace('{DELAY}', self.delay if self.delay else '0').replace('{DATEVARIABLE}', self.table_date_variable), DATEVARIABLE=self.table_date_variable)
-        return pd.read_sql_query(self._query_sql, con=self.engine, parse_dates=self.reference[1:]) # XXX: the dates would be better in a specific column (avoiding the conversion of wrong columns)
+        return query.replace('{AS_TERM}', AS_TERM).replace('{GROUPBY_TERM}', GROUPBY_TERM).replace('{OPERATION}', op).format(references=references, referencevars=referencevars, WHERE=WHERE_CLAUSE.replace('{DATEVARIABLE}', self.table_date_variable), DATEVARIABLE=self.table_date_variable, columns=self._format_columns())
+
+
+class DBTableVariable(DBTableTimed):
+    """
+    Generic extractor for the tables of time related events with format <identifier, variables, date>: for each identifier (and dates searched) it returns the latest measurement (the earliest with first_presence) inside the window of the mode, the number of rows with that date (AMT_MEASURES) and the average of each variable on that date ("avg_<variable>").
+
+    The measurement is selected in a single pass with a RANK() window over the rows of each identifier ordered by date, which the database can answer from an index on (identifier, date) (see index_advice).
+
+    @param table: the table ("schema.table") with the events
+    @param table_date_variable: the date column of the table
+    @param variables: list of the (numeric) columns averaged
+    @param engine: an sqlalchemy engine
+    @param rename: if we should rename the returned table (instead of the class name) to name
+    @param name: name to show on the returned data
+    @param mode: the mode of the search (see DBTableTimed)
+    @param begin_date: for modes 'between' and 'outside': the variable with the start of the range
+    @param end_date: for modes 'between' and 'outside': the variable with the end of the range
+    @param ref_date: for modes 'before' and 'after': the variable with the reference date
+    @param shift: a negative or positive number to indicate the shift (in days) for the above dates
+    @param first_presence: by default returns the latest measurement, otherwise the earliest
+    @param identifier (default 'identifier'): the identifier column of the table (also the reference variable)
+    @param key_shipping (default 'values'): how the values searched are sent to the database (see DBTable)
+    @param batch_size (default None): if set, the results are read in batches of this number of rows (see DBTable)
+    @param temporal_engine (default 'sql'): 'sql' - the ranking query; 'memory' - the identifier, the date and the variables of the table are loaded once and the modes are resolved in memory (see DBTableTimed), returning the same columns as the query
+    """
+    TEMPORAL_QUERY = True
+
+    def __init__(self, table, table_date_variable, variables, engine, rename=True, name=None, mode=None, begin_date=None, end_date=None, ref_date=None, shift=None, first_presence=None, identifier='identifier', key_shipping='values', batch_size=None, temporal_engine='sql'):
+        if isinstance(variables, str):
+            variables = [variables]
+        if variables is None or len(variables) == 0:
+            raise ObtainDataError('DBTableVariable for "{}" requires at least one variable.'.format(table))
+        self.variables = list(variables)
+        self.identifier = identifier
+        super().__init__(identifier, self._variable_query(table, table_date_variable), engine, rename, name, mode, begin_date, end_date, ref_date, shift, first_presence, table_date_variable, table=table, key_shipping=key_shipping, batch_size=batch_size, temporal_engine=temporal_engine, events=self.variables)
+        self.query = self.query.replace('{DATES}', ''.join([', ranked.{}'.format(i) for i in self.reference[1:]]))
+
+    def _obtain_data(self, mapping):
+        """
+        The in-memory engine returns the values searched (as text, the dates parsed) and the averages of the variables ("avg_<variable>") as the query.
+        """
+        sql_ret = super()._obtain_data(mapping)
+        if self._temporal is not None:
+            sql_ret[self.identifier] = sql_ret[self.identifier].astype(str)
+            for i in self.reference[1:]:
+                sql_ret[i] = pd.to_datetime(sql_ret[i], errors='coerce')
+            sql_ret = sql_ret.astype({i: 'float64' for i in self.variables}).rename(columns={i: 'avg_{}'.format(i) for i in self.variables})
+        return sql_ret
+
+    def _variable_query(self, table, table_date_variable):
+        """
+        The query ranking the rows of each identifier (and dates searched) inside the window by date. The rows ranked first are grouped into the count and the averages.
+        """
+        averages = ', '.join(['avg(CAST(ranked."{}" AS DOUBLE PRECISION)) AS "avg_{}"'.format(i, i) for i in self.variables])
+        variables = ', '.join(['ot."{}"'.format(i) for i in self.variables])
+        return """
+            WITH filtering_part AS (
+                SELECT *
+                FROM (values {references}) tempT({referencevars})
+            ), ranked AS (
+                SELECT filtering_part.{IDENTIFIER} AS {IDENTIFIER}, ot.{DATEVARIABLE} AS CONDITION_DATE, {VARIABLES} {AS_TERM},
+                       RANK() OVER (PARTITION BY filtering_part.{IDENTIFIER} {GROUPBY_TERM} ORDER BY ot.{DATEVARIABLE} {ORDER}) AS DATE_RANK
+                FROM filtering_part
+                INNER JOIN {TABLE} AS ot ON ot.{IDENTIFIER} = filtering_part.{IDENTIFIER}
+                {WHERE}
+            )
+            SELECT ranked.{IDENTIFIER} {DATES}, ranked.CONDITION_DATE, count(*) AS AMT_MEASURES, {AVERAGES}
+            FROM ranked
+            WHERE ranked.DATE_RANK = 1
+            GROUP BY ranked.{IDENTIFIER} {DATES}, ranked.CONDITION_DATE
+        """.replace('{TABLE}', table).replace('{IDENTIFIER}', self.identifier).replace('{VARIABLES}', variables).replace('{AVERAGES}', averages)
+
+    def _format_query(self, query, references, references_l):
+        """
+        Formats the query with the order of the ranking (latest or earliest date first).
+        """
+        return super()._format_query(query.replace('{ORDER}', 'ASC' if self.first_presence is True else 'DESC'), references, references_l)
+
+    def index_advice(self):
+        """
+        Returns the statement creating the index on (identifier, date) that answers the query of each chunk (covering the variables where the dialect allows it).
+        """
+        name = re.sub(r'\W', '_', 'ix_{}_{}_{}'.format(self.table.split('.')[-1], self.identifier, self.table_date_variable))
+        statement = 'CREATE INDEX {} ON {} ({}, {})'.format(name, self.table, self.identifier, self.table_date_variable)
+        dialect = self.engine.dialect.name if self.engine is not None else 'postgresql'
+        if dialect in ['postgresql', 'mssql']:
+            statement += ' INCLUDE ({})'.format(', '.join(['"{}"'.format(i) for i in self.variables]))
+        return statement
 
 
 class DBCategory:
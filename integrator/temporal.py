@@ -0,0 +1,168 @@
+"""
+In-memory resolution of the time related searches of DBTableTimed
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from integrator.util import ObtainDataError
+
+
+class TemporalIndex:
+    """
+    The events of a table sorted by identifier and date, for vectorized searches of the first or last event of each identifier inside an interval of dates.
+
+    The events with the same identifier and date are grouped: the numeric columns are averaged and the others take the first value; AMT_MEASURES is the number of events grouped.
+
+    Each (identifier, date) is a single integer key (identifier code << 34 | seconds since the first event), so the searches of a chunk are two numpy.searchsorted calls.
+
+    @param df: the events (a data frame with the identifier, the date and the event columns)
+    @param identifier: the identifier column
+    @param date_variable: the date column
+    """
+    SHIFT = 34 # bits for the seconds (about 540 years)
+
+    def __init__(self, df, identifier, date_variable):
+        self.identifier = identifier
+        self.date_variable = date_variable
+        df = df.copy()
+        df[date_variable] = pd.to_datetime(df[date_variable], errors='coerce')
+        df = df.loc[df[identifier].notna() & df[date_variable].notna()]
+        values = [c for c in df.columns if c not in [identifier, date_variable]]
+        numeric = [c for c in values if pd.api.types.is_numeric_dtype(df[c])]
+        aggregation = {c: 'mean' if c in numeric else 'first' for c in values}
+        groups = df.groupby([identifier, date_variable], sort=True)
+        grouped = groups.size().rename('AMT_MEASURES').to_frame()
+        if len(aggregation) > 0:
+            grouped = grouped.join(groups.agg(aggregation))
+        grouped = grouped.reset_index()
+        self.events = grouped
+        self.columns = ['AMT_MEASURES'] + values
+        self._origin = grouped[date_variable].min() if len(grouped) > 0 else pd.Timestamp(0)
+        self._codes = pd.Index(pd.unique(grouped[identifier]))
+        seconds = self._seconds(grouped[date_variable])
+        if len(grouped) > 0 and (seconds.max() >= 2**self.SHIFT or len(self._codes) >= 2**(62 - self.SHIFT)):
+            raise ObtainDataError('The events of "{}" span too many dates or identifiers for the temporal index.'.format(date_variable))
+        self._keys = (self._codes.get_indexer(grouped[identifier]).astype(np.int64) << self.SHIFT) | seconds
+        order = np.argsort(self._keys, kind='stable')
+        self._keys = self._keys[order]
+        self.events = self.events.iloc[order].reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.events)
+
+    def _seconds(self, dates):
+        """
+        Seconds since the first event (int64, NaT as -1).
+        """
+        dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+        seconds = ((dates - self._origin) / pd.Timedelta(seconds=1)).values
+        return np.where(np.isnan(seconds), -1, np.floor(seconds)).astype(np.int64)
+
+    def _bounds(self, dates, inclusive, upper):
+        """
+        The bound (in seconds) of an interval for each search, clipped to the range of the keys. Returns the seconds and if the bound is valid (NaT dates are not).
+        """
+        if dates is None:
+            return (2**self.SHIFT - 1 if upper else 0), True
+        dates = pd.to_datetime(pd.Series(dates).reset_index(drop=True), errors='coerce')
+        valid = dates.notna().values
+        seconds = ((dates - self._origin) / pd.Timedelta(seconds=1)).values
+        seconds = np.where(valid, seconds, 0)
+        if upper:
+            # the last second included
+            bound = np.where(inclusive | (seconds != np.floor(seconds)), np.floor(seconds), np.floor(seconds) - 1)
+        else:
+            bound = np.where(inclusive | (seconds != np.floor(seconds)), np.ceil(seconds), np.floor(seconds) + 1)
+        return np.clip(bound, -1, 2**self.SHIFT).astype(np.int64), valid
+
+    def search(self, identifiers, low=None, high=None, low_inclusive=True, high_inclusive=True, last=True):
+        """
+        Searches the event of each identifier with the date inside [low, high] (the limits are open if not inclusive, None for no limit). Returns the position of the last event found (the first if last is False) in self.events, -1 if there is no event.
+
+        @param identifiers: the identifiers searched
+        @param low (default None): the lowest dates (one per identifier)
+        @param high (default None): the highest dates (one per identifier)
+        @param low_inclusive (default True): if the lowest date is part of the interval
+        @param high_inclusive (default True): if the highest date is part of the interval
+        @param last (default True): if the last event is returned, otherwise the first
+        """
+        identifiers = pd.Index(identifiers)
+        if identifiers.dtype != self._codes.dtype and (pd.api.types.is_string_dtype(identifiers.dtype) or pd.api.types.is_string_dtype(self._codes.dtype)):
+            codes = self._codes.astype(str).get_indexer(identifiers.astype(str)).astype(np.int64) # compared as text, as the values searched in the database
+        else:
+            codes = self._codes.get_indexer(identifiers).astype(np.int64)
+        lo, lo_valid = self._bounds(low, low_inclusive, False)
+        hi, hi_valid = self._bounds(high, high_inclusive, True)
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, 2**self.SHIFT - 1)
+        start = np.searchsorted(self._keys, (codes << self.SHIFT) | lo, side='left')
+        end = np.searchsorted(self._keys, (codes << self.SHIFT) | hi, side='right')
+        found = (codes >= 0) & lo_valid & hi_valid & (lo <= hi) & (end > start)
+        return np.where(found, end - 1 if last else start, -1)
+
+
+class TemporalSearch:
+    """
+    Resolves the modes of DBTableTimed in memory: the event table is loaded once into a TemporalIndex and the searches of each chunk are vectorized.
+
+    @param source: the DBTableTimed source
+    @param events (default None): list of event columns loaded from the table, by default all of them
+    """
+    def __init__(self, source, events=None):
+        if source.table is None or source.table_date_variable is None:
+            raise ObtainDataError('The in-memory temporal engine of "{}" requires the table and the table date variable.'.format(source.name))
+        self.source = source
+        self.events = events
+        self.index = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the events of the table (only once).
+        """
+        with self._lock:
+            if self.index is None:
+                d = self.source
+                columns = '*' if self.events is None else ', '.join(['"{}"'.format(i) for i in [d.reference[0], d.table_date_variable] + [i for i in self.events if i not in [d.reference[0], d.table_date_variable]]])
+                df = pd.read_sql_query('select {} from {}'.format(columns, d.table), con=d.engine)
+                self.index = TemporalIndex(df, d.reference[0], d.table_date_variable)
+        return self.index
+
+    def obtain_data(self, mapping):
+        """
+        Returns, for each distinct (identifier, dates) searched with an event, the identifier, the dates, the date of the event found (CONDITION_DATE), the number of events on that date (AMT_MEASURES) and the event columns.
+
+        @param mapping: data frame with the references of the source (identifier and dates)
+        """
+        d = self.source
+        index = self.load()
+        if isinstance(mapping, pd.Series):
+            mapping = mapping.to_frame()
+        searched = mapping[d.reference].drop_duplicates().reset_index(drop=True)
+        dates = {i: pd.to_datetime(searched[j], errors='coerce') for i, j in zip(d.inputvars[1:], d.reference[1:])}
+        delay = pd.Timedelta(days=int(d.delay)) if d.delay else pd.Timedelta(0)
+        ids = searched[d.reference[0]].values
+        last = d.first_presence is not True
+        if d.mode is None:
+            position = index.search(ids, last=last)
+        elif d.mode == 'after':
+            position = index.search(ids, low=dates['ref_date'] + delay, low_inclusive=False, last=last)
+        elif d.mode == 'before':
+            position = index.search(ids, high=dates['ref_date'] + delay, high_inclusive=False, last=last)
+        elif d.mode == 'between':
+            position = index.search(ids, low=dates['begin_date'] + delay, high=dates['end_date'] + delay, last=last)
+        elif d.mode == 'outside':
+            before = index.search(ids, high=dates['begin_date'], high_inclusive=False, last=last)
+            after = index.search(ids, low=dates['end_date'], low_inclusive=False, last=last)
+            if last: # the latest event is after the range if there is any
+                position = np.where(after >= 0, after, before)
+            else:
+                position = np.where(before >= 0, before, after)
+        found = position >= 0
+        events = index.events.iloc[position[found]].reset_index(drop=True)
+        ret = searched.loc[found].reset_index(drop=True)
+        ret['CONDITION_DATE'] = events[index.date_variable].values
+        for c in index.columns:
+            ret[c] = events[c].values
+        return ret
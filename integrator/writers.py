@@ -0,0 +1,113 @@
+"""
+Writers for the collected data
+"""
+
+from integrator.util import ObtainDataError
+
+
+class ColumnarWriter:
+    """
+    Streaming writer of data frames to a columnar file. Each data frame written is a Parquet row group or an Arrow IPC record batch.
+
+    The schema is fixed by the first data frame with rows (empty data frames before it are not written). The following data frames are converted to it: integer columns with missing values and columns that were empty in the first data frame are accepted, other type changes raise an error. The integer columns are stored as 64 bit integers, so the chunks can hold them in the smallest type for their values (see dtypes.DtypePolicy).
+
+    Requires pyarrow.
+
+    @param output_file: output file
+    @param output_format: 'parquet' or 'arrow'
+    """
+    FORMATS = ['parquet', 'arrow']
+
+    def __init__(self, output_file, output_format='parquet'):
+        if output_format not in self.FORMATS:
+            raise ObtainDataError('Invalid output format "{}", please select one of: "{}"'.format(output_format, '", "'.join(self.FORMATS)))
+        try:
+            import pyarrow
+        except ImportError:
+            raise ObtainDataError('The "{}" output format requires pyarrow. Please install it (pip install pyarrow).'.format(output_format))
+        self.output_file = output_file
+        self.output_format = output_format
+        self.schema = None
+        self._writer = None
+        self._empty = None # the last empty data frame written before the schema was fixed
+
+    def write(self, df):
+        """
+        Writes a data frame.
+
+        @param df: the data frame
+        """
+        if self._writer is None:
+            if len(df) == 0: # an empty chunk (for example filtered out) might miss columns
+                self._empty = df
+                return
+            self._open(df)
+        self._writer.write_table(self._conform(df))
+
+    def _open(self, df):
+        """
+        Creates the file with the schema of a data frame.
+        """
+        import pyarrow as pa
+        self.schema = self._first_schema(df)
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.output_file, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(self.output_file, self.schema)
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        if self._writer is None and self._empty is not None: # only empty data frames were written
+            self._open(self._empty)
+            self._writer.write_table(self._conform(self._empty))
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _first_schema(self, df):
+        """
+        Creates the schema from the first data frame. Columns without any value are stored as strings, categorical columns as their values and integer columns as 64 bit integers.
+        """
+        import pyarrow as pa
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        for i, field in enumerate(schema):
+            if pa.types.is_integer(field.type) and field.type != pa.uint64():
+                schema = schema.set(i, field.with_type(pa.int64()))
+            elif pa.types.is_null(field.type):
+                schema = schema.set(i, field.with_type(pa.string()))
+            elif pa.types.is_dictionary(field.type): # the categories change between chunks
+                schema = schema.set(i, field.with_type(pa.string() if pa.types.is_null(field.type.value_type) else field.type.value_type))
+        return schema.remove_metadata()
+
+    def _conform(self, df):
+        """
+        Converts a data frame to the schema of the file.
+        """
+        import pyarrow as pa
+        extra = [str(i) for i in df.columns.values if i not in self.schema.names]
+        if len(extra) > 0:
+            raise ObtainDataError('Columns "{}" were not present in the first chunk written to "{}".'.format('", "'.join(extra), self.output_file))
+        arrays = list()
+        for field in self.schema:
+            if field.name not in df.columns:
+                arrays.append(pa.nulls(len(df), type=field.type))
+                continue
+            array = pa.array(df[field.name], from_pandas=True)
+            if pa.types.is_dictionary(array.type):
+                array = array.dictionary_decode()
+            if array.type != field.type:
+                try:
+                    array = array.cast(field.type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                    raise ObtainDataError('Column "{}" changed from {} to {} and can not be converted for "{}".'.format(field.name, field.type, array.type, self.output_file)) from e
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, schema=self.schema)
@@ -49,6 +49,7 @@ import re
 import pandas as pd
 from glob import glob
 from sqlalchemy import create_engine
+from integrator.normalization import PostcodeNormalizer
 engine = create_engine('postgresql://postgres@localhost:5432/postcode')
 
 def crimes():
@@ -154,11 +155,14 @@ def postcode_lookup():
     #cd: code
     #nm: name
     dfp.rename(columns={'oa11cd':'oa', 'lsoa11cd': 'lsoa', 'msoa11cd': 'msoa', 'ladcd': 'lad', 'pcd7': 'postcode'}, inplace=True)
+    normalizer = PostcodeNormalizer(column='postcode', output='pc') # the same canonical key used by the DataCollector normalize option
+    dfp = normalizer.apply(dfp)
+    print(normalizer.report())
     dfp.set_index('FID', inplace=True)
     dfp.to_sql(name="postcode_lookup11", con=engine, schema='public', method='multi', index_label='FID', chunksize=(2**5)*(2**10)) #this table is quite massive, it needs to be optimized or have a bit of patience (~5min with 8096 chunksize)
     
 def postcode_indexes():
-    # the indexes need to be created, also a small variation for postcode will be created! - this is heavy!
+    # the indexes need to be created (the canonical postcode "pc" is created by postcode_lookup)
     import psycopg2
     conn = psycopg2.connect("host=localhost port=5432 dbname=postcode user=postgres")
     cur = conn.cursor()
@@ -167,10 +171,6 @@ def postcode_indexes():
         CREATE INDEX postcode_lookup11_msoa_idx ON public.postcode_lookup11 USING btree (msoa);
         CREATE INDEX postcode_lookup11_oa_idx ON public.postcode_lookup11 USING btree (oa);
         CREATE INDEX postcode_lookup11_postcode_idx ON public.postcode_lookup11 USING btree (postcode);
-        
-        alter table public.postcode_lookup11 add column pc text;
-        update public.postcode_lookup11 set pc = REPLACE(postcode, ' ', '');
-        
         CREATE INDEX postcode_lookup11_pc_idx ON public.postcode_lookup11 USING btree (pc);
     """)
     conn.commit()
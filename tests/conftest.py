@@ -0,0 +1,87 @@
+"""
+Fixtures shared by the tests: an embedded DuckDB database (pip install duckdb duckdb-engine)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+
+
+@pytest.fixture
+def engine(tmp_path):
+    pytest.importorskip('duckdb_engine')
+    engine = sqlalchemy.create_engine('duckdb:///{}'.format(tmp_path / 'test.duckdb'))
+    yield engine
+    engine.dispose()
+
+
+class PostcodeDatabase:
+    """
+    A small postcode lookup (pc -> oa -> lsoa -> msoa -> lad) with the income, deprivation and census tables of the sources, in a DuckDB file opened read only (so worker processes can open it as well).
+
+    @param path: the database file
+    @param n_oa (default 120): number of output areas
+    @param seed (default 0): the random seed
+    """
+    CENSUS = ['age_structure', 'tenure']
+
+    def __init__(self, path, n_oa=120, seed=0):
+        rng = np.random.default_rng(seed)
+        self.url = 'duckdb:///{}'.format(path)
+        oa = ['E00{:06d}'.format(i) for i in range(n_oa)]
+        lsoa = ['E01{:06d}'.format(i // 4) for i in range(n_oa)]
+        msoa = ['E02{:06d}'.format(i // 20) for i in range(n_oa)]
+        lad = ['E08{:06d}'.format(i // 60) for i in range(n_oa)]
+        rows = [('B{}{}T'.format(i, j), oa[i], lsoa[i], msoa[i], lad[i]) for i in range(n_oa) for j in range(5)]
+        self.lookup = pd.DataFrame(rows, columns=['pc', 'oa', 'lsoa', 'msoa', 'lad'])
+        self.lookup.insert(0, 'postcode', self.lookup['pc'].str[:-2] + ' ' + self.lookup['pc'].str[-2:])
+        tables = {'public.postcode_lookup11': self.lookup}
+        tables['compiled.income'] = pd.DataFrame({'msoa': sorted(set(msoa)), 'net_annual_income': rng.normal(30000, 6000, len(set(msoa))).round(-1), 'households': rng.integers(100, 900, len(set(msoa)))})
+        tables['public.indexmultipledeprivation'] = pd.DataFrame({'lsoa': sorted(set(lsoa)), 'IOMDIS': rng.gamma(2, 10, len(set(lsoa))), 'IOMDID': rng.integers(1, 11, len(set(lsoa)))})
+        for t in self.CENSUS:
+            tables['census2011.' + t] = pd.DataFrame({'oa': oa, 'x': rng.integers(0, 50, n_oa), 'y': rng.random(n_oa)})
+        writer = sqlalchemy.create_engine(self.url)
+        with writer.begin() as con:
+            for schema in ['public', 'compiled', 'census2011']:
+                con.exec_driver_sql('create schema {}'.format(schema))
+        for name, df in tables.items():
+            schema, table = name.split('.')
+            df.to_sql(table, con=writer, schema=schema, index=False)
+        writer.dispose()
+        self.engine = sqlalchemy.create_engine(self.url, connect_args={'read_only': True})
+
+    def sources(self, engine=None):
+        """
+        The sources of the tests: income (msoa), deprivation (lsoa) and the census tables (oa).
+        """
+        from integrator.sources import Census11, Income, IndexMultipleDeprivation
+        from integrator.tables import DBTable
+        engine = engine if engine is not None else self.engine
+        return [Income(engine), IndexMultipleDeprivation(engine)] + [DBTable('oa', Census11.query_format.replace('{table}', t), engine=engine, name='Census11_' + t) for t in self.CENSUS]
+
+    def cohort(self, n_rows, seed=0):
+        """
+        An input with the columns "id" and "pc" (with repeated postcodes).
+        """
+        rng = np.random.default_rng(seed)
+        pc = self.lookup['pc'].values[rng.integers(0, len(self.lookup), n_rows)]
+        return pd.DataFrame({'id': np.arange(n_rows), 'pc': pc})
+
+    def collect(self, df, sources=None, **options):
+        """
+        Collects the sources for an input (chunks of 100 rows by default). Returns the data with a new index.
+        """
+        from integrator.collector import DataCollector
+        from integrator.postcode_mapping import PostcodeMapping
+        options.setdefault('chunksize', 100)
+        sources = sources if sources is not None else self.sources()
+        return DataCollector(df, sources=sources, reference_sources=[PostcodeMapping], reference_engines=[self.engine], verbose=False, **options).collect_all().reset_index(drop=True)
+
+
+@pytest.fixture(scope='session')
+def postcode_db(tmp_path_factory):
+    pytest.importorskip('duckdb_engine')
+    db = PostcodeDatabase(str(tmp_path_factory.mktemp('postcode') / 'postcode.duckdb'))
+    yield db
+    db.engine.dispose()
@@ -0,0 +1,31 @@
+"""
+Tests of the batched reads of the source results
+"""
+
+import pandas as pd
+import pytest
+from integrator.sources import Income
+
+
+@pytest.mark.filterwarnings('error::DeprecationWarning')
+@pytest.mark.parametrize('options', [{}, {'key_shipping': 'temp_table'}, {'fuse_queries': True}])
+def test_stream_batches(postcode_db, options):
+    df = postcode_db.cohort(1000, seed=21)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, stream_batch_size=5, **options), postcode_db.collect(df, **options))
+
+
+def test_source_batches(postcode_db):
+    search = pd.Series(postcode_db.lookup['msoa'].unique(), name='msoa')
+    d = Income(postcode_db.engine)
+    whole = d.obtain_data(search)
+    d.batch_size = 2
+    batched = d.obtain_data(search)
+    assert d.last_timings['batches'] == (len(whole) + 1) // 2
+    pd.testing.assert_frame_equal(batched, whole)
+
+
+def test_source_batches_without_rows(postcode_db):
+    d = Income(postcode_db.engine)
+    d.batch_size = 2
+    empty = d.obtain_data(pd.Series(['none'], name='msoa'))
+    assert len(empty) == 0 and 'Income.net_annual_income' in empty.columns
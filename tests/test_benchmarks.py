@@ -0,0 +1,42 @@
+"""
+Tests of the benchmark suite and its synthetic data
+"""
+
+import json
+import pytest
+from benchmarks import run, synthetic
+
+
+def test_hierarchy_is_nested_and_reproducible():
+    lookup = synthetic.hierarchy(n_lad=3, seed=1)
+    assert lookup['pc'].is_unique
+    assert (lookup['pc'] == lookup['postcode'].str.replace(' ', '', regex=False)).all()
+    for child, parent in [('oa', 'lsoa'), ('lsoa', 'msoa'), ('msoa', 'lad')]:
+        assert (lookup.groupby(child)[parent].nunique() == 1).all()
+    assert lookup.equals(synthetic.hierarchy(n_lad=3, seed=1))
+
+
+def test_source_tables_cover_the_hierarchy():
+    lookup = synthetic.hierarchy(n_lad=2)
+    tables = synthetic.source_tables(lookup, census_columns=3)
+    assert set(tables['compiled.income']['msoa']) == set(lookup['msoa'])
+    assert set(tables['public.indexmultipledeprivation']['lsoa']) == set(lookup['lsoa'])
+    assert all([set(tables['census2011.' + t]['oa']) == set(lookup['oa']) for t in synthetic.Census11.options])
+
+
+@pytest.mark.parametrize('duplicate_ratio', [0, 0.5, 0.9])
+def test_cohort_duplicates(duplicate_ratio):
+    lookup = synthetic.hierarchy(n_lad=2)
+    df = synthetic.cohort(lookup, 1000, duplicate_ratio=duplicate_ratio)
+    assert len(df) == 1000 and df['pc'].isin(lookup['pc']).all()
+    assert df['pc'].nunique() == round(1000 * (1 - duplicate_ratio))
+
+
+def test_run_writes_the_results(tmp_path):
+    pytest.importorskip('duckdb_engine')
+    output = tmp_path / 'bench.json'
+    run.main(['--output', str(output), '--database', str(tmp_path / 'bench.duckdb'), '--lads', '2', '--rows', '500', '--chunksizes', '200', '--sources', '1,4', '--duplicates', '0.5', '--repeat', '1'])
+    results = json.loads(output.read_text())['results']
+    assert [(i['sources'], i['chunksize'], i['rows']) for i in results] == [(1, 200, 500), (4, 200, 500)]
+    assert all([i['output_shape'][0] == 500 for i in results])
+    assert 'Income: msoa' in results[0]['per_source']
@@ -0,0 +1,68 @@
+"""
+Tests of the checkpointed collections
+"""
+
+import json
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income
+from integrator.util import ObtainDataError
+
+
+class Crashing(Income):
+    """
+    Income failing on a query (the process crashing in the middle of the collection) and counting the queries.
+    """
+    def __init__(self, engine, fail_at=None):
+        super().__init__(engine)
+        self.name = 'Income'
+        self.fail_at = fail_at
+        self.queries = 0
+
+    def obtain_data(self, mapping):
+        self.queries += 1
+        if self.queries == self.fail_at:
+            raise RuntimeError('crash')
+        return super().obtain_data(mapping)
+
+
+def collector(postcode_db, df, source):
+    return DataCollector(df, sources=[source], reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100)
+
+
+def test_resume_after_crash(postcode_db, tmp_path):
+    df = postcode_db.cohort(1000, seed=11)
+    output_file = str(tmp_path / 'out.csv')
+    with pytest.raises(RuntimeError):
+        collector(postcode_db, df, Crashing(postcode_db.engine, fail_at=4)).collect_to_file(output_file, return_dataset=False, checkpoint=True)
+    with open(output_file + '.checkpoint') as f:
+        manifest = json.load(f)
+    assert [i['input_rows'] for i in manifest['chunks']] == [100, 100, 100] and not manifest['complete']
+    with open(output_file, 'a') as f:
+        f.write('1,partial') # the tail of a chunk not recorded
+    source = Crashing(postcode_db.engine)
+    collector(postcode_db, df, source).collect_to_file(output_file, return_dataset=False, resume=True)
+    assert source.queries == 7 # the chunks written are not queried again
+    with open(output_file + '.checkpoint') as f:
+        assert json.load(f)['complete']
+    expected = postcode_db.collect(df, sources=[Income(postcode_db.engine)])
+    expected.to_csv(tmp_path / 'expected.csv', index=False)
+    pd.testing.assert_frame_equal(pd.read_csv(output_file), pd.read_csv(tmp_path / 'expected.csv'))
+
+
+def test_resume_completed_run(postcode_db, tmp_path):
+    df = postcode_db.cohort(300, seed=12)
+    output_file = str(tmp_path / 'out.csv')
+    collector(postcode_db, df, Income(postcode_db.engine)).collect_to_file(output_file, return_dataset=False, checkpoint=True)
+    written = pd.read_csv(output_file)
+    source = Crashing(postcode_db.engine)
+    collector(postcode_db, df, source).collect_to_file(output_file, return_dataset=False, resume=True)
+    assert source.queries == 0
+    pd.testing.assert_frame_equal(pd.read_csv(output_file), written)
+
+
+def test_checkpoint_requires_csv_output(postcode_db, tmp_path):
+    with pytest.raises(ObtainDataError):
+        collector(postcode_db, postcode_db.cohort(10), Income(postcode_db.engine)).collect_to_file(str(tmp_path / 'out.csv'), checkpoint=True)
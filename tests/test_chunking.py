@@ -0,0 +1,47 @@
+"""
+Tests of the adaptive chunk size
+"""
+
+import pandas as pd
+import pytest
+from integrator.chunking import AdaptiveChunkSize
+from integrator.util import ObtainDataError
+
+
+def test_adaptive_size_growth_and_limits():
+    sizer = AdaptiveChunkSize(1000, memory_limit_mb=1, min_size=100, max_size=10000)
+    assert sizer.update(1000, 0.1, 1000) == 2000 # grows at most 2x
+    assert sizer.update(2000, 0.1, 2**21) == int(0.8 * 2**20 / (2**21 / 2000)) # shrinks to the memory limit
+    assert sizer.update(800, 0.1, 2**30) == 100 # never below the minimum
+    assert sizer.sizes == [1000, 2000, 800]
+
+
+def test_adaptive_size_target_time():
+    sizer = AdaptiveChunkSize(1000, target_seconds=1)
+    assert sizer.update(1000, 4, 0) == 256 # 250 rows per second, clipped to the minimum
+    sizer = AdaptiveChunkSize(1000, target_seconds=1, max_growth=1.5)
+    assert sizer.update(1000, 0.01, 0) == 1500
+
+
+def test_adaptive_size_requires_a_target():
+    with pytest.raises(ObtainDataError):
+        AdaptiveChunkSize(1000)
+
+
+@pytest.mark.parametrize('file_input', [False, True])
+def test_adaptive_collection_equals_fixed(postcode_db, tmp_path, file_input):
+    from integrator.collector import DataCollector
+    from integrator.postcode_mapping import PostcodeMapping
+    df = postcode_db.cohort(3000, seed=10)
+    if file_input:
+        df.to_csv(tmp_path / 'input.csv', index=False)
+    collector = DataCollector(str(tmp_path / 'input.csv') if file_input else df, sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=300, memory_limit_mb=64)
+    pd.testing.assert_frame_equal(collector.collect_all().reset_index(drop=True), postcode_db.collect(df, chunksize=300))
+    sizes = collector.summary()['chunk_sizes']
+    assert sum(sizes) == 3000 and sizes[:2] == [300, 600]
+
+
+def test_adaptive_collection_requires_file_or_frame(postcode_db):
+    from integrator.collector import DataCollector
+    with pytest.raises(ObtainDataError):
+        DataCollector(lambda: iter([postcode_db.cohort(10)]), verbose=False, memory_limit_mb=64)
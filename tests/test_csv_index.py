@@ -0,0 +1,55 @@
+"""
+Tests of the lookup index of the reference column of CSVTable
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.cache import FileStore
+from integrator.tables import CSVTable
+from integrator.util import ObtainDataError
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = FileStore()
+    monkeypatch.setattr(CSVTable, 'store', store)
+    return store
+
+
+def write(tmp_path, df):
+    path = str(tmp_path / 'table.csv')
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_index_equals_scan(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'k': rng.permutation(5000), 'v': rng.random(5000)})
+    t = CSVTable('k', write(tmp_path, df), ['v'], name='T')
+    for _ in range(3):
+        keys = pd.Series(rng.integers(0, 6000, 800), name='k') # repeated and unknown keys
+        expected = df[df['k'].isin(keys)].rename(columns={'v': 'T.v'})
+        pd.testing.assert_frame_equal(t.obtain_data(keys, warning=False), expected) # in the order of the file
+
+
+def test_index_built_once(tmp_path, store):
+    path = write(tmp_path, pd.DataFrame({'k': ['a', 'b', 'c'], 'v': [1, 2, 3]}))
+    t = CSVTable('k', path, ['v'])
+    index = t._index()
+    assert CSVTable('k', path, ['v'])._index() is index
+    t.obtain_data(pd.Series(['b']), warning=False)
+    assert t._index() is index
+
+
+def test_duplicate_keys_rejected(tmp_path):
+    path = write(tmp_path, pd.DataFrame({'k': ['a', 'b', 'a', 'c', 'c'], 'v': range(5)}))
+    with pytest.raises(ObtainDataError, match='2 duplicate values'): # when the source is created
+        CSVTable('k', path, ['v'])
+
+
+def test_missing_keys_not_matched(tmp_path):
+    path = write(tmp_path, pd.DataFrame({'k': ['a', None, 'b', None], 'v': [1, 2, 3, 4]})) # the missing values are not duplicates
+    t = CSVTable('k', path, ['v'], name='T')
+    ret = t.obtain_data(pd.Series(['b', None, np.nan, 'z']), warning=False)
+    assert ret['k'].tolist() == ['b'] and ret['T.v'].tolist() == [3]
@@ -0,0 +1,96 @@
+"""
+Tests of the streaming mode of CSVTable
+"""
+
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.cache import FileStore
+from integrator.tables import CSVTable
+from integrator.util import ObtainDataError
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = FileStore()
+    monkeypatch.setattr(CSVTable, 'store', store)
+    return store
+
+
+@pytest.fixture
+def table(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'id': rng.permutation(3000), 'a': rng.integers(0, 100, 3000), 'b': rng.random(3000), 'c': rng.choice(['x', 'y', None], 3000)})
+    path = str(tmp_path / 'table.csv')
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    scans = list()
+    prefetch = CSVTable.prefetch
+    def counted(self, values):
+        scans.append(len(pd.unique(pd.Series(values))))
+        return prefetch(self, values)
+    monkeypatch.setattr(CSVTable, 'prefetch', counted)
+    return scans
+
+
+def test_streaming_equals_loaded(table, scans):
+    loaded = CSVTable('id', table, ['a', 'c'], name='T')
+    streaming = CSVTable('id', table, ['a', 'c'], name='T', streaming=True, scan_rows=256)
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        keys = pd.Series(rng.integers(0, 3500, 400), name='id')
+        pd.testing.assert_frame_equal(streaming.obtain_data(keys, warning=False).reset_index(drop=True), loaded.obtain_data(keys, warning=False).reset_index(drop=True))
+    assert len(scans) == 3
+    assert len(streaming.obtain_data(pd.Series([-1]), warning=False)) == 0
+
+
+def test_streaming_zip(table, tmp_path):
+    archive = str(tmp_path / 'table.zip')
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.write(table, 'table.csv')
+    keys = pd.Series([3, 30, 300], name='id')
+    expected = CSVTable('id', table, name='T').obtain_data(keys, warning=False).reset_index(drop=True)
+    pd.testing.assert_frame_equal(CSVTable('id', archive, name='T', streaming=True).obtain_data(keys, warning=False).reset_index(drop=True), expected)
+    with zipfile.ZipFile(archive, 'a') as z:
+        z.writestr('other.csv', 'id,a\n1,2\n')
+    with pytest.raises(ObtainDataError, match='member'):
+        CSVTable('id', archive, name='T', streaming=True)
+    pd.testing.assert_frame_equal(CSVTable('id', archive, name='T', streaming=True, member='table.csv').obtain_data(keys, warning=False).reset_index(drop=True), expected)
+
+
+def test_streaming_prefetch(table, scans):
+    t = CSVTable('id', table, ['a'], streaming=True)
+    t.prefetch(pd.Series(range(100)))
+    t.obtain_data(pd.Series(range(50)), warning=False)
+    t.obtain_data(pd.Series(range(50, 100)), warning=False)
+    assert len(scans) == 1
+    t.obtain_data(pd.Series(range(90, 110)), warning=False) # not all prefetched
+    assert len(scans) == 2
+
+
+def test_streaming_rejects(tmp_path, table):
+    path = str(tmp_path / 'duplicates.csv')
+    pd.DataFrame({'id': [1, 2, 1], 'a': [1, 2, 3]}).to_csv(path, index=False)
+    t = CSVTable('id', path, streaming=True) # the file is not read
+    with pytest.raises(ObtainDataError, match='duplicate'):
+        t.obtain_data(pd.Series([1]), warning=False)
+    with pytest.raises(ObtainDataError):
+        CSVTable('id', table, streaming=True, sidecar=True)
+
+
+def test_collector_prefetch_chunks(postcode_db, table, scans):
+    df = postcode_db.cohort(1000)
+    sources = lambda **options: postcode_db.sources()[:1] + [CSVTable('id', table, ['a', 'b'], name='T', **options)]
+    expected = postcode_db.collect(df, sources=sources())
+    assert postcode_db.collect(df, sources=sources(streaming=True)).equals(expected)
+    assert len(scans) == 10
+    del scans[:]
+    assert postcode_db.collect(df, sources=sources(streaming=True), prefetch_chunks=4).equals(expected)
+    assert scans == [400, 400, 200]
+    with pytest.raises(ObtainDataError):
+        postcode_db.collect(df, sources=sources(streaming=True), prefetch_chunks=0)
@@ -0,0 +1,67 @@
+"""
+Tests of the compact data types
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector, WorkerSpec
+from integrator.dtypes import DtypePolicy
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income, IndexMultipleDeprivation
+
+
+def test_policy_conversions():
+    policy = DtypePolicy(float32=True)
+    df = policy.apply(pd.DataFrame({'Source.lsoa': ['a', 'b'], 'n': [1, 300], 'm': [-1, 2], 'x': [0.5, 1.5], 'k': [1, 2]}), exclude=['k'])
+    assert isinstance(df['Source.lsoa'].dtype, pd.CategoricalDtype)
+    assert [str(df[c].dtype) for c in ['n', 'm', 'x', 'k']] == ['uint16', 'int8', 'float32', 'int64']
+    assert policy.bytes_after < policy.bytes_before
+    assert policy.report().startswith('Compact types:')
+
+
+def test_concat_keeps_categories():
+    policy = DtypePolicy()
+    chunks = [policy.apply(pd.DataFrame({'lsoa': ['a', 'b', 'a'], 'v': [1, 2, 3]})), policy.apply(pd.DataFrame({'lsoa': ['c', None], 'v': [4, 5]}))]
+    df = policy.concat(chunks)
+    assert isinstance(df['lsoa'].dtype, pd.CategoricalDtype)
+    assert df['lsoa'].tolist()[:4] == ['a', 'b', 'a', 'c']
+    assert df['lsoa'].isna().tolist() == [False, False, False, False, True]
+    assert policy.bytes_after == int(df.memory_usage(index=False, deep=True).sum())
+
+
+def test_collect_all_keeps_categories(postcode_db):
+    df = postcode_db.cohort(1000, seed=22)
+    policy = DtypePolicy()
+    collected = postcode_db.collect(df, dtype_policy=policy)
+    assert isinstance(collected['msoa'].dtype, pd.CategoricalDtype)
+    assert policy.bytes_after == int(collected.memory_usage(index=False, deep=True).sum())
+    pd.testing.assert_frame_equal(collected, postcode_db.collect(df), check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_columnar_output_with_policy(postcode_db, tmp_path, output_format):
+    pa = pytest.importorskip('pyarrow')
+    df = postcode_db.cohort(1000, seed=23) # the ids of the first chunks fit in uint8, the following ones need uint16
+    output_file = str(tmp_path / 'out')
+    DataCollector(df, sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100, dtype_policy=DtypePolicy()).collect_to_file(output_file, output_format=output_format, return_dataset=False)
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(output_file)
+    else:
+        with pa.memory_map(output_file) as source:
+            table = pa.ipc.open_file(source).read_all()
+    assert table.schema.field('id').type == pa.int64()
+    assert pa.types.is_string(table.schema.field('msoa').type) or pa.types.is_large_string(table.schema.field('msoa').type) # the categoricals are stored as their values
+    pd.testing.assert_frame_equal(table.to_pandas(), postcode_db.collect(df), check_dtype=False)
+
+
+def test_policy_measures_of_the_workers(postcode_db):
+    spec = WorkerSpec(postcode_db.url, [Income, IndexMultipleDeprivation], [PostcodeMapping], engine_kwargs={'connect_args': {'read_only': True}})
+    df = postcode_db.cohort(500, seed=24)
+    serial, parallel = DtypePolicy(), DtypePolicy()
+    postcode_db.collect(df, sources=[Income(postcode_db.engine), IndexMultipleDeprivation(postcode_db.engine)], dtype_policy=serial)
+    DataCollector(df, verbose=False, chunksize=100, processes=2, worker_spec=spec, dtype_policy=parallel).collect_all()
+    assert serial.bytes_before > 0
+    # the workers measure the chunks (the text of a chunk sent between processes can use some more or less memory)
+    assert parallel.bytes_before == pytest.approx(serial.bytes_before, rel=0.05)
+    assert parallel.bytes_after == pytest.approx(serial.bytes_after, rel=0.05)
@@ -0,0 +1,100 @@
+"""
+Tests of the store of the files loaded by CSVTable
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.cache import FileStore
+from integrator.tables import CSVTable
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FileStore()
+    monkeypatch.setattr(CSVTable, 'store', store)
+    return store
+
+
+@pytest.fixture
+def table(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'k': ['k{}'.format(i) for i in range(500)], 'a': rng.integers(0, 100, 500), 'b': rng.random(500), 'c': rng.choice(['x', 'y'], 500)})
+    path = str(tmp_path / 'table.csv')
+    df.to_csv(path, index=False)
+    return path, df
+
+
+class Loader:
+    """
+    Loads the columns of a frame, recording the columns requested.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.calls = list()
+
+    def __call__(self, columns):
+        self.calls.append(list(columns))
+        return self.df[columns].copy()
+
+
+def test_superset_reused(table):
+    _, df = table
+    store, load = FileStore(), Loader(df)
+    store.get('f', ['k', 'a', 'b'], load)
+    pd.testing.assert_frame_equal(store.get('f', ['b', 'k'], load), df[['b', 'k']])
+    assert load.calls == [['k', 'a', 'b']]
+    assert (store.hits, store.misses) == (1, 1)
+    assert store.is_loaded('f', ['a']) and not store.is_loaded('f', ['c']) and not store.is_loaded('g', ['a'])
+
+
+def test_missing_columns_joined(table):
+    _, df = table
+    store, load = FileStore(), Loader(df)
+    store.get('f', ['k', 'a'], load)
+    pd.testing.assert_frame_equal(store.get('f', ['k', 'c', 'a'], load), df[['k', 'c', 'a']])
+    assert load.calls == [['k', 'a'], ['c']] # only the column missing is loaded
+    assert len(store) == 1 # the frame is extended
+    store.get('f', ['a', 'c'], load)
+    assert len(load.calls) == 2
+
+
+def test_budget_evicts_least_recently_used(table):
+    _, df = table
+    store, load = FileStore(), Loader(df)
+    store.get('f1', ['k', 'a'], load)
+    size = store.size()
+    store.get('f2', ['k', 'a'], load)
+    store.get('f1', ['k'], load) # f1 is used last
+    store.resize(int(size * 1.5))
+    assert len(store) == 1 and store.is_loaded('f1', ['k', 'a']) and not store.is_loaded('f2', ['k'])
+    assert store.size() <= int(size * 1.5)
+    store.get('f3', ['k', 'a'], load)
+    assert store.is_loaded('f3', ['k']) and not store.is_loaded('f1', ['k'])
+    store.resize(0)
+    assert len(store) == 0 and store.size() == 0
+
+
+def test_csv_tables_share_the_file(store, table):
+    path, df = table
+    t1 = CSVTable('k', path, ['a'])
+    t2 = CSVTable('k', path, ['a', 'b'])
+    t3 = CSVTable('k', path)
+    assert len(store) == 1 and store.misses == 3 # each column read once
+    assert CSVTable.is_loaded(path, ',', ['k', 'a', 'b', 'c'])
+    keys = pd.Series(['k3', 'k7', 'k400'], name='k')
+    expected = df[df['k'].isin(keys)].reset_index(drop=True)
+    for t in [t1, t2, t3]:
+        ret = t.obtain_data(keys, warning=False).reset_index(drop=True)
+        assert list(ret.columns) == ['k'] + ['CSVTable.' + i for i in t.target_columns] # only the columns of the source
+        pd.testing.assert_frame_equal(ret, expected[['k'] + t.target_columns].add_prefix('CSVTable.').rename(columns={'CSVTable.k': 'k'}))
+
+
+def test_modified_file_loaded_again(store, table):
+    path, df = table
+    CSVTable('k', path, ['a'])
+    df.assign(a=-1).to_csv(path, index=False)
+    os.utime(path, (0, 1e9))
+    t = CSVTable('k', path, ['a'])
+    assert t.obtain_data(pd.Series(['k1'], name='k'), warning=False)['CSVTable.a'].tolist() == [-1]
@@ -0,0 +1,68 @@
+"""
+Tests of the declarative row filters
+"""
+
+import pandas as pd
+import pytest
+from integrator.filters import In, IsNull, NotNull, Predicate, Range, RowFilter
+from integrator.sources import Income, IndexMultipleDeprivation
+from integrator.util import ObtainDataError
+
+
+def test_predicate_masks():
+    df = pd.DataFrame({'v': [1.0, 5.0, None, 10.0], 'c': ['a', 'b', None, 'a']})
+    assert Range('v', low=5).mask(df).tolist() == [False, True, False, True]
+    assert Range('v', low=1, high=10, inclusive=False).mask(df).tolist() == [False, True, False, False]
+    assert In('c', 'a').mask(df).tolist() == [True, False, False, True]
+    assert NotNull('c').mask(df).tolist() == [True, True, False, True]
+    assert IsNull('v').mask(df).tolist() == [False, False, True, False]
+
+
+def test_predicate_sql():
+    assert Range('v', low=1, high=2.5).to_sql('"v"') == '"v" >= 1 and "v" <= 2.5'
+    assert In('c', ["a'b", 'c']).to_sql('"c"') == """"c" in ('a''b', 'c')"""
+    assert IsNull('v').to_sql('"v"') is None
+    assert RowFilter([Range('Income.v', low=1), IsNull('Income.w'), NotNull('Other.v')]).sql_conditions(Income(None)) == ['"v" >= 1'] # IsNull is not pushed
+
+
+def test_predicate_without_mask():
+    class Custom(Predicate):
+        pass
+    with pytest.raises(ObtainDataError, match='"Custom"'):
+        RowFilter([Custom('v')]).apply(pd.DataFrame({'v': [1]}), set())
+
+
+def test_invalid_filters():
+    with pytest.raises(ObtainDataError):
+        Range('v')
+    with pytest.raises(ObtainDataError):
+        In('v', [])
+    with pytest.raises(ObtainDataError):
+        RowFilter([lambda df: df])
+
+
+@pytest.mark.parametrize('fuse_queries', [False, True])
+def test_filters_keep_column_order(postcode_db, fuse_queries):
+    df = postcode_db.cohort(1000, seed=15)
+    everything = postcode_db.collect(df, fuse_queries=fuse_queries)
+    column = 'IndexMultipleDeprivation.IOMDIS'
+    low = everything[column].median()
+    filtered = postcode_db.collect(df, fuse_queries=fuse_queries, filters=[Range(column, low=low)])
+    expected = everything.loc[everything[column] >= low].reset_index(drop=True)
+    assert len(filtered) > 0
+    pd.testing.assert_frame_equal(filtered, expected, check_dtype=False) # the rows filtered out had missing values
+
+
+def test_filters_on_input_and_mapping_columns(postcode_db):
+    df = postcode_db.cohort(1000, seed=16)
+    everything = postcode_db.collect(df)
+    msoa = everything['msoa'].drop_duplicates().tolist()[:3]
+    filters = [Range('id', high=599), In('msoa', msoa), NotNull('Income.net_annual_income')]
+    expected = everything.loc[(everything['id'] <= 599) & everything['msoa'].isin(msoa)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, filters=filters), expected, check_dtype=False)
+
+
+def test_filters_remove_every_row(postcode_db):
+    df = postcode_db.cohort(300, seed=17)
+    filtered = postcode_db.collect(df, sources=[Income(postcode_db.engine), IndexMultipleDeprivation(postcode_db.engine)], filters=[In('pc', ['none'])])
+    assert len(filtered) == 0
@@ -0,0 +1,48 @@
+"""
+Tests of the single-step join of the source results
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector
+from integrator.util import ObtainDataError
+
+
+class Returned:
+    """
+    A source already queried (only the attributes used by the merges).
+    """
+    def __init__(self, name, reference):
+        self.name = name
+        self.reference = reference
+
+    def __str__(self):
+        return self.name
+
+
+@pytest.fixture
+def collector():
+    return DataCollector(pd.DataFrame({'pc': ['A', 'B']}), verbose=False)
+
+
+def test_join_equals_merges(collector):
+    chunk = pd.DataFrame({'pc': ['A', 'B', 'A', 'C'], 'lsoa': ['l1', 'l2', 'l1', 'l3']}, index=[10, 11, 12, 13])
+    first = pd.DataFrame({'pc': ['B', 'A'], 'x': [2, 1]})
+    second = pd.DataFrame({'lsoa': ['l1', 'l3'], 'y': [0.5, 1.5]})
+    results = [(Returned('first', 'pc'), first), (Returned('second', 'lsoa'), second)]
+    merged = chunk
+    for d, ndf in results:
+        merged = collector._merge(merged, d, ndf)
+    joined = collector._join(chunk, results)
+    pd.testing.assert_frame_equal(joined, merged)
+    assert isinstance(joined.index, pd.RangeIndex) # the index is reset, as the merge does
+
+
+def test_join_duplicate_references(collector):
+    with pytest.raises(ObtainDataError, match='duplicate elements'):
+        collector._join(pd.DataFrame({'pc': ['A', 'B']}), [(Returned('source', 'pc'), pd.DataFrame({'pc': ['A', 'A'], 'x': [1, 2]}))])
+
+
+def test_join_incompatible_key_types(collector):
+    with pytest.raises(ValueError):
+        collector._join(pd.DataFrame({'k': ['1', '2']}), [(Returned('source', 'k'), pd.DataFrame({'k': [1, 2], 'v': [10, 20]}))])
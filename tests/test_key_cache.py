@@ -0,0 +1,55 @@
+"""
+Tests of the cache of the source rows between chunks
+"""
+
+import pandas as pd
+import pytest
+from integrator.cache import KeyCache, reference_keys
+
+
+def test_key_cache_hits_and_missing_keys():
+    cache = KeyCache('k', max_entries=10)
+    cache.put(['a', 'b', 'c'], pd.DataFrame({'k': ['a', 'b'], 'v': [1, 2]})) # "c" has no data
+    rows, missing = cache.get(['a', 'c', 'd'])
+    assert cache.frame(rows).to_dict('list') == {'k': ['a'], 'v': [1]}
+    assert missing == ['d']
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_key_cache_evicts_least_recently_used():
+    cache = KeyCache('k', max_entries=2)
+    cache.put(['a', 'b'], pd.DataFrame({'k': ['a', 'b'], 'v': [1, 2]}))
+    cache.get(['a']) # "b" is now the least recently used
+    cache.put(['c'], pd.DataFrame({'k': ['c'], 'v': [3]}))
+    assert len(cache) == 2
+    assert cache.get(['a', 'b', 'c'])[1] == ['b']
+
+
+def test_key_cache_bytes_budget():
+    df = pd.DataFrame({'k': list('abcdefgh'), 'v': range(8)})
+    row = int(df.memory_usage(deep=True).sum() / len(df))
+    cache = KeyCache('k', max_bytes=3 * row)
+    cache.put(list(df['k']), df)
+    assert len(cache) == 3
+    assert cache.get(['f', 'g', 'h'])[1] == []
+
+
+def test_key_cache_multiple_references():
+    df = pd.DataFrame({'k': ['a', 'a'], 'd': [1, 2], 'v': [10, 20]})
+    cache = KeyCache(['k', 'd'], max_entries=10)
+    cache.put(reference_keys(df, ['k', 'd']), df)
+    rows, missing = cache.get([('a', 2), ('b', 1)])
+    assert cache.frame(rows).to_dict('list') == {'k': ['a'], 'd': [2], 'v': [20]}
+    assert missing == [('b', 1)]
+
+
+@pytest.mark.parametrize('options', [{'cache_entries': 50}, {'cache_bytes': 2**20}, {'cache_entries': 50, 'max_workers': 4}])
+def test_key_cache_collection_equals_uncached(postcode_db, options):
+    from integrator.collector import DataCollector
+    from integrator.postcode_mapping import PostcodeMapping
+    df = postcode_db.cohort(1000, seed=6)
+    collector = DataCollector(df, sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100, **options)
+    pd.testing.assert_frame_equal(collector.collect_all().reset_index(drop=True), postcode_db.collect(df))
+    stats = collector.cache_stats()
+    assert set(stats) == set([str(d) for d in collector.sources])
+    assert all([s['hits'] > 0 for s in stats.values()])
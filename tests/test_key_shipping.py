@@ -0,0 +1,72 @@
+"""
+Tests of the shipping of the values searched through temporary tables
+"""
+
+import pandas as pd
+import pytest
+import sqlalchemy
+from integrator.tables import DBTable
+from integrator.util import ObtainDataError
+
+
+def temporary_tables(engine):
+    with engine.connect() as con:
+        return [i for i in con.exec_driver_sql('show tables').scalars() if i.startswith('integrator_keys_')]
+
+
+@pytest.mark.parametrize('fuse_queries', [False, True])
+def test_temp_table_equals_values(postcode_db, fuse_queries):
+    df = postcode_db.cohort(500, seed=18)
+    shipped = postcode_db.collect(df, key_shipping='temp_table', fuse_queries=fuse_queries)
+    pd.testing.assert_frame_equal(shipped, postcode_db.collect(df, key_shipping='values', fuse_queries=fuse_queries))
+
+
+def test_temp_table_composite_keys_and_quotes(engine):
+    pd.DataFrame({'k': ["a'b", 'c', 'c'], 'd': pd.to_datetime(['2020-01-01', '2020-01-01', '2020-02-01']), 'v': [1, 2, 3]}).to_sql('value', con=engine, index=False)
+    query = 'select t.* from (values {references}) tempT(k, d) inner join value t on t.k = tempT.k and t.d = CAST(tempT.d AS TIMESTAMP)'
+    search = pd.DataFrame({'k': ["a'b", 'c', 'c', 'x'], 'd': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-02-01', '2020-01-01'])})
+    ret = dict()
+    for key_shipping in ['values', 'temp_table']:
+        d = DBTable(['k', 'd'], query=query, engine=engine, rename=False, key_shipping=key_shipping)
+        ret[key_shipping] = d.obtain_data(search).sort_values('k').reset_index(drop=True)
+    assert ret['temp_table']['v'].tolist() == [1, 3]
+    pd.testing.assert_frame_equal(ret['temp_table'], ret['values'])
+    assert temporary_tables(engine) == []
+
+
+def test_temp_table_query_error(engine):
+    pd.DataFrame({'k': ['a'], 'v': [1]}).to_sql('value', con=engine, index=False)
+    d = DBTable('k', query='select t.k, CAST(t.k AS INTEGER) AS v from (values {references}) tempT(k) inner join value t on t.k = tempT.k', engine=engine, key_shipping='temp_table')
+    with pytest.raises(Exception, match='Conversion Error'): # the error of the query (aborting the transaction), not of the cleanup
+        d.obtain_data(pd.Series(['a'], name='k'))
+    assert temporary_tables(engine) == []
+
+
+class BrokenConnection:
+    """
+    A connection failing to roll back the failed query.
+    """
+    def __init__(self, error):
+        self.error = error
+        self.invalidated = False
+
+    def rollback(self):
+        raise self.error
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+def test_temp_table_cleanup_failure(capsys):
+    d = DBTable('k', query='select * from (values {references}) tempT(k)', key_shipping='temp_table')
+    con = BrokenConnection(sqlalchemy.exc.OperationalError('rollback', {}, Exception('connection lost')))
+    d._discard_keys(con, 'integrator_keys_0')
+    assert con.invalidated # the connection is not returned to the pool
+    assert 'integrator_keys_0' in capsys.readouterr().out
+    with pytest.raises(TypeError): # only the database errors are handled
+        d._discard_keys(BrokenConnection(TypeError('bug')), 'integrator_keys_0')
+
+
+def test_invalid_key_shipping():
+    with pytest.raises(ObtainDataError):
+        DBTable('k', query='select * from (values {references}) tempT(k)', key_shipping='array')
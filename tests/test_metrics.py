@@ -0,0 +1,45 @@
+"""
+Tests of the spans recorded during the collection
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector, WorkerSpec
+from integrator.metrics import Recorder, VerboseRecorder
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income, IndexMultipleDeprivation
+
+
+def test_recorder_spans(postcode_db):
+    seen = list()
+    recorder = Recorder(callbacks=[seen.append])
+    sources = postcode_db.sources()
+    collected = DataCollector(postcode_db.cohort(450, seed=8), sources=sources, reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100, recorder=recorder).collect_all()
+    assert seen == recorder.spans
+    chunks = [i for i in recorder.spans if i.kind == 'chunk']
+    assert [i.attributes['chunk'] for i in chunks] == [1, 2, 3, 4, 5]
+    assert sum([i.attributes['rows_out'] for i in chunks]) == len(collected)
+    summary = recorder.summary()
+    assert set([str(d) for d in sources]).issubset(summary['sources']) # and the dependency mappings
+    assert all([s['count'] == 5 and s['rows_in'] > 0 for s in summary['sources'].values()])
+    assert summary['chunks']['rows_in'] == 450
+    assert [i.kind for i in recorder.spans][-1] == 'collection'
+
+
+def test_verbose_recorder_report(postcode_db, capsys):
+    recorder = VerboseRecorder()
+    DataCollector(postcode_db.cohort(200, seed=8), sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100, recorder=recorder).collect_all()
+    out = capsys.readouterr().out
+    assert "|- Source 'Income" in out
+    assert '- Extraction took' in out
+    assert recorder.report() in out
+
+
+def test_worker_spans_use_the_chunk_numbers(postcode_db):
+    spec = WorkerSpec(postcode_db.url, [Income, IndexMultipleDeprivation], [PostcodeMapping], engine_kwargs={'connect_args': {'read_only': True}})
+    recorder = Recorder()
+    DataCollector(postcode_db.cohort(1000, seed=9), verbose=False, chunksize=100, processes=2, worker_spec=spec, recorder=recorder).collect_all()
+    chunks = [i.attributes['chunk'] for i in recorder.spans if i.kind == 'chunk']
+    assert sorted(chunks) == list(range(1, 11)) # the workers number the chunks as the parent
+    sources = [i for i in recorder.spans if i.kind == 'source']
+    assert sorted([i.attributes['chunk'] for i in sources if i.name.startswith('Income')]) == list(range(1, 11))
@@ -0,0 +1,61 @@
+"""
+Tests of the normalization of the postcodes of the input
+"""
+
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.normalization import PostcodeNormalizer
+from integrator.util import ObtainDataError
+
+
+@pytest.mark.parametrize('value, expected', [('B15 2TT', 'B152TT'), ('b15 2tt', 'B152TT'), ('B15  2TT', 'B152TT'), (' b15-2tt.', 'B152TT'), ('B1  2TT', 'B12TT'), ('AB122TT', 'AB122TT'), ('SW1A 1AA', 'SW1A1AA'), ('gir 0aa', 'GIR0AA')])
+def test_normalize_postcodes(value, expected):
+    assert PostcodeNormalizer().normalize([value]).tolist() == [expected]
+
+
+def test_normalize_invalid_and_missing():
+    values = pd.Series(['b15 2tt', 'not a pc', None, np.nan, ' - ', 'b15 2tt', 12345], index=[5, 6, 7, 8, 9, 10, 11])
+    normalizer = PostcodeNormalizer()
+    ret = normalizer.normalize(values)
+    assert list(ret.index) == list(values.index)
+    assert ret.astype(object).where(ret.notna(), None).tolist() == ['B152TT', 'NOTAPC', None, None, None, 'B152TT', '12345']
+    assert (normalizer.values, normalizer.changed, normalizer.invalid) == (5, 4, 3)
+    assert normalizer.invalid_examples == ['not a pc', ' - ', 12345]
+    assert normalizer.report() == 'Postcodes: 5 normalized, 4 changed, 3 not postcodes (for example "not a pc", " - ", "12345")'
+    ret = PostcodeNormalizer(keep_invalid=False, examples=1).normalize(values)
+    assert ret.astype(object).where(ret.notna(), None).tolist() == ['B152TT', None, None, None, None, 'B152TT', None]
+
+
+def test_normalize_keeps_string_dtype():
+    values = pd.Series(['b15 2tt', None], dtype='string')
+    ret = PostcodeNormalizer().normalize(values)
+    assert ret.dtype == values.dtype and ret.iloc[0] == 'B152TT' and pd.isna(ret.iloc[1])
+
+
+def test_apply_and_format():
+    chunk = pd.DataFrame({'id': [1, 2], 'postcode': ['b15 2tt', 'AB12 2TT']})
+    ret = PostcodeNormalizer('postcode', output='pc').apply(chunk)
+    assert ret['pc'].tolist() == ['B152TT', 'AB122TT'] and ret['postcode'].tolist() == chunk['postcode'].tolist()
+    assert PostcodeNormalizer.format(ret['pc'], 'pcds').tolist() == ['B15 2TT', 'AB12 2TT']
+    assert PostcodeNormalizer.format(ret['pc'], 'pcd7').tolist() == ['B15 2TT', 'AB122TT']
+    assert PostcodeNormalizer.format(ret['pc'], 'pcd8').tolist() == ['B15  2TT', 'AB12 2TT']
+    assert PostcodeNormalizer.format(['B12TT'], 'pcd7').tolist() == ['B1  2TT']
+    with pytest.raises(ObtainDataError):
+        PostcodeNormalizer.format(ret['pc'], 'pcd9')
+    with pytest.raises(ObtainDataError, match='"pc"'):
+        PostcodeNormalizer().apply(chunk)
+    assert pickle.loads(pickle.dumps(PostcodeNormalizer())).normalize(['b1 2tt']).tolist() == ['B12TT']
+
+
+def test_collection_normalized(postcode_db):
+    df = postcode_db.cohort(600)
+    expected = postcode_db.collect(df)
+    styles = np.random.default_rng(0).choice(['pcds', 'pcd7', 'pcd8'], len(df))
+    raw = df.copy()
+    raw['pc'] = [PostcodeNormalizer.format([pc], style).iloc[0].lower() for pc, style in zip(df['pc'], styles)]
+    normalizer = PostcodeNormalizer()
+    ret = postcode_db.collect(raw, normalize=normalizer)
+    pd.testing.assert_frame_equal(ret, expected)
+    assert (normalizer.values, normalizer.changed) == (600, 600) # the postcodes of the test lookup are not real postcodes, they are kept
@@ -0,0 +1,93 @@
+"""
+Tests of the on-disk cache of the data obtained from the DBTable sources
+"""
+
+import pandas as pd
+import pytest
+from integrator.cache import PersistentCache
+from integrator.collector import DataCollector, WorkerSpec
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income, IndexMultipleDeprivation
+from integrator.tables import DBTable
+
+
+class Value(DBTable):
+    def __init__(self, engine):
+        super().__init__('k', query="""
+                         select t.*
+                         from (values {references}) tempT(k)
+                         inner join public.value t on t.k = tempT.k
+                         """, engine=engine)
+
+
+@pytest.fixture
+def value_engine(engine):
+    with engine.begin() as con:
+        con.exec_driver_sql('create schema public')
+    pd.DataFrame({'k': [1, 2, 3], 'v': [10, 20, 30]}).to_sql('value', con=engine, schema='public', index=False)
+    return engine
+
+
+def test_persistent_cache_integer_keys(value_engine, tmp_path):
+    df = pd.DataFrame({'k': [1, 2, 3, 2]})
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'))
+    cold = DataCollector(df, sources=[Value(value_engine)], verbose=False, persistent_cache=cache).collect_all()
+    warm = DataCollector(df, sources=[Value(value_engine)], verbose=False, persistent_cache=cache).collect_all()
+    assert cold['Value.v'].tolist() == [10, 20, 30, 20]
+    assert cache.hits == 3
+    pd.testing.assert_frame_equal(cold.reset_index(drop=True), warm.reset_index(drop=True))
+
+
+def test_persistent_cache_between_runs(postcode_db, tmp_path):
+    df = postcode_db.cohort(500, seed=19)
+    path = str(tmp_path / 'cache.sqlite')
+    cold = postcode_db.collect(df, persistent_cache=PersistentCache(path))
+    cache = PersistentCache(path) # a new run
+    warm = postcode_db.collect(df, persistent_cache=cache)
+    pd.testing.assert_frame_equal(warm, cold)
+    assert cache.misses == 0 and cache.hits > 0
+
+
+def test_persistent_cache_keys_without_data(value_engine, tmp_path):
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'))
+    d = Value(value_engine)
+    d.cache = cache
+    assert len(d.obtain_data(pd.Series([4, 5], name='k'))) == 0
+    assert len(d.obtain_data(pd.Series([1, 4], name='k'))) == 1
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_persistent_cache_invalidation(value_engine, tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = PersistentCache(path, version='2020')
+    d = Value(value_engine)
+    d.cache = cache
+    d.obtain_data(pd.Series([1, 2], name='k'))
+    assert cache.size()[0] == 2
+    assert PersistentCache(path, version='2020').size()[0] == 2
+    assert PersistentCache(path, version='2021').size()[0] == 0 # another version of the data
+    d.obtain_data(pd.Series([1, 2], name='k'))
+    cache.invalidate('Value')
+    assert cache.size()[0] == 0
+
+
+def test_persistent_cache_budget(value_engine, tmp_path):
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'), max_bytes=1)
+    d = Value(value_engine)
+    d.cache = cache
+    d.obtain_data(pd.Series([1, 2, 3], name='k'))
+    n, size = cache.size()
+    assert n < 3 and size <= 1
+
+
+def test_persistent_cache_statistics_of_the_workers(postcode_db, tmp_path):
+    spec = WorkerSpec(postcode_db.url, [Income, IndexMultipleDeprivation], [PostcodeMapping], engine_kwargs={'connect_args': {'read_only': True}})
+    df = postcode_db.cohort(500, seed=20)
+    path = str(tmp_path / 'cache.sqlite')
+    stats = list()
+    for run in range(2):
+        cache = PersistentCache(path)
+        DataCollector(df, verbose=False, chunksize=100, processes=2, worker_spec=spec, persistent_cache=cache).collect_all()
+        stats.append((cache.hits, cache.misses))
+    assert stats[0][1] > 0
+    assert stats[1] == (sum(stats[0]), 0) # the keys searched by the workers are counted by the parent
@@ -0,0 +1,32 @@
+"""
+Tests of the pipelined collection
+"""
+
+import pandas as pd
+import pytest
+from integrator.util import ObtainDataError
+
+
+@pytest.mark.parametrize('pipeline_depth, max_workers', [(1, None), (3, None), (2, 4)])
+def test_pipeline_equals_serial(postcode_db, pipeline_depth, max_workers):
+    df = postcode_db.cohort(1000, seed=2)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, pipeline_depth=pipeline_depth, max_workers=max_workers), postcode_db.collect(df))
+
+
+def test_pipeline_to_file(postcode_db, tmp_path):
+    from integrator.collector import DataCollector
+    from integrator.postcode_mapping import PostcodeMapping
+    df = postcode_db.cohort(500, seed=3)
+    for name, depth in [('serial.csv', None), ('pipelined.csv', 2)]:
+        DataCollector(df, sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100, pipeline_depth=depth).collect_to_file(str(tmp_path / name), return_dataset=False)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'pipelined.csv'), pd.read_csv(tmp_path / 'serial.csv'))
+
+
+def test_pipeline_stop_after_chunk(postcode_db):
+    df = postcode_db.cohort(1000, seed=2)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, pipeline_depth=2, stop_after_chunk=3), postcode_db.collect(df, stop_after_chunk=3))
+
+
+def test_pipeline_invalid_depth(postcode_db):
+    with pytest.raises(ObtainDataError):
+        postcode_db.collect(postcode_db.cohort(10), pipeline_depth=0)
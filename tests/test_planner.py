@@ -0,0 +1,55 @@
+"""
+Tests of the fused query plans
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.tables import DBTableTimed
+
+
+class Fused:
+    """
+    A fused source already queried (only the attributes used by the merges).
+    """
+    def __init__(self, name, reference, mapped_columns):
+        self.name = name
+        self.reference = reference
+        self.mapped_columns = mapped_columns
+
+    def __str__(self):
+        return self.name
+
+
+@pytest.mark.parametrize('options', [{}, {'max_workers': 4}, {'cache_entries': 100}])
+def test_fused_equals_unfused(postcode_db, options):
+    df = postcode_db.cohort(1000, seed=13)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, fuse_queries=True, **options), postcode_db.collect(df))
+
+
+def test_explain(postcode_db):
+    sources = postcode_db.sources()
+    collector = DataCollector(postcode_db.cohort(10), sources=sources, reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, fuse_queries=True)
+    plan = collector.explain(['id', 'pc'])
+    assert plan.count(': fused query') == len(sources)
+    assert 'public.postcode_lookup11' in plan
+
+
+def test_timed_sources_are_not_fused(postcode_db):
+    timed = DBTableTimed('msoa', 'select * from (values {references}) tempT(msoa)', postcode_db.engine, name='Timed')
+    collector = DataCollector(postcode_db.cohort(10), sources=[timed] + postcode_db.sources()[:1], reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, fuse_queries=True)
+    plan = collector.explain(['id', 'pc'])
+    assert '{}: separate query'.format(timed) in plan # with the mapping it needs
+    assert 'PostcodeMapping: pc: separate query' in plan
+    assert plan.count(': fused query') == 1
+
+
+def test_join_drops_mapped_columns():
+    collector = DataCollector(pd.DataFrame({'pc': ['A', 'B']}), verbose=False)
+    chunk = pd.DataFrame({'pc': ['A', 'B', 'A']})
+    first = pd.DataFrame({'pc': ['A', 'B'], 'msoa': ['m1', 'm2'], 'x': [1, 2]})
+    second = pd.DataFrame({'pc': ['A', 'B'], 'msoa': ['m1', 'm2'], 'x': [3, 4]})
+    joined = collector._join(chunk, [(Fused('first', 'pc', ['msoa']), first), (Fused('second', 'pc', ['msoa']), second)])
+    assert list(joined.columns) == ['pc', 'msoa', 'x_x', 'x_y'] # only the columns returned by both sources are suffixed
+    assert joined['msoa'].tolist() == ['m1', 'm2', 'm1']
@@ -0,0 +1,50 @@
+"""
+Tests of the in-process postcode mapping
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import DataCollector
+from integrator.postcode_mapping import LocalPostcodeMapping, PostcodeHierarchy, PostcodeMapping
+from integrator.util import ObtainDataError
+
+
+def mapped(d, values):
+    return d.obtain_data(values).sort_values(d.reference).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('from_variable, to_variables', [('pc', ['msoa']), ('pc', ['oa', 'lad']), ('oa', ['lsoa', 'msoa']), ('lsoa', ['lad'])])
+def test_local_equals_sql(postcode_db, from_variable, to_variables):
+    values = pd.Series(list(postcode_db.lookup[from_variable].iloc[::3]) + ['unknown'])
+    expected = mapped(PostcodeMapping(from_variable, to_variables, postcode_db.engine), values)
+    for hierarchy in [postcode_db.engine, postcode_db.lookup, PostcodeHierarchy(postcode_db.lookup)]:
+        pd.testing.assert_frame_equal(mapped(LocalPostcodeMapping(from_variable, to_variables, hierarchy), values), expected, check_dtype=False)
+
+
+def test_local_collection_equals_sql(postcode_db):
+    df = postcode_db.cohort(1000)
+    expected = postcode_db.collect(df)
+    ret = DataCollector(df, sources=postcode_db.sources(), reference_sources=[LocalPostcodeMapping], reference_engines=[postcode_db.engine], chunksize=100, verbose=False).collect_all().reset_index(drop=True)
+    pd.testing.assert_frame_equal(ret, expected, check_dtype=False)
+
+
+def test_hierarchy_loaded_once(postcode_db):
+    first = LocalPostcodeMapping('pc', ['msoa'], postcode_db.engine)
+    assert LocalPostcodeMapping('oa', ['lad'], postcode_db.engine)._hierarchy is first._hierarchy
+    assert first._hierarchy.nbytes() > 0
+
+
+def test_hierarchy_missing_parents():
+    hierarchy = PostcodeHierarchy(pd.DataFrame({'pc': ['A1', 'A2', 'A3'], 'oa': ['o1', 'o2', None], 'lsoa': ['l1', None, None], 'msoa': ['m1', None, None], 'lad': ['d1', None, None]}))
+    ret = hierarchy.lookup('pc', ['oa', 'lad'], ['A3', 'A1', 'A2', 'A1'])
+    assert ret.astype(object).where(ret.notna(), None).values.tolist() == [['A1', 'o1', 'd1'], ['A2', 'o2', None], ['A3', None, None]]
+
+
+def test_hierarchy_not_strict():
+    df = pd.DataFrame({'pc': ['A1', 'A2'], 'oa': ['o1', 'o1'], 'lsoa': ['l1', 'l2'], 'msoa': ['m1', 'm1'], 'lad': ['d1', 'd1']})
+    with pytest.raises(ObtainDataError, match='more than one "lsoa"'):
+        PostcodeHierarchy(df)
+    with pytest.raises(ObtainDataError, match='requires the columns'):
+        PostcodeHierarchy(df.drop(columns='lad'))
+    with pytest.raises(ObtainDataError):
+        LocalPostcodeMapping('msoa', ['pc'], df.iloc[:1])
@@ -0,0 +1,44 @@
+"""
+Tests of the collection with worker processes
+"""
+
+import pandas as pd
+import pytest
+from integrator.collector import WorkerSpec
+from integrator.postcode_mapping import PostcodeMapping
+from integrator.sources import Income, IndexMultipleDeprivation
+from integrator.util import ObtainDataError
+
+
+@pytest.fixture
+def spec(postcode_db):
+    return WorkerSpec(postcode_db.url, [Income, IndexMultipleDeprivation], [PostcodeMapping], engine_kwargs={'connect_args': {'read_only': True}})
+
+
+def serial(postcode_db, df, **options):
+    return postcode_db.collect(df, sources=[Income(postcode_db.engine), IndexMultipleDeprivation(postcode_db.engine)], **options)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_processes_equal_serial(postcode_db, spec, ordered):
+    from integrator.collector import DataCollector
+    df = postcode_db.cohort(1000, seed=4)
+    collected = DataCollector(df, verbose=False, chunksize=100, processes=2, worker_spec=spec, ordered=ordered).collect_all()
+    if not ordered:
+        collected = collected.sort_values('id')
+    pd.testing.assert_frame_equal(collected.reset_index(drop=True), serial(postcode_db, df))
+
+
+def test_processes_to_file(postcode_db, spec, tmp_path):
+    from integrator.collector import DataCollector
+    df = postcode_db.cohort(500, seed=5)
+    DataCollector(df, verbose=False, chunksize=100, processes=2, worker_spec=spec).collect_to_file(str(tmp_path / 'out.csv'), return_dataset=False)
+    expected = serial(postcode_db, df)
+    expected.to_csv(tmp_path / 'expected.csv', index=False)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'out.csv'), pd.read_csv(tmp_path / 'expected.csv'))
+
+
+def test_processes_require_worker_spec(postcode_db):
+    from integrator.collector import DataCollector
+    with pytest.raises(ObtainDataError):
+        DataCollector(postcode_db.cohort(10), verbose=False, processes=2)
@@ -0,0 +1,36 @@
+"""
+Tests of the column selections of the DBTable sources
+"""
+
+import pandas as pd
+import pytest
+from integrator.sources import Income, IndexMultipleDeprivation
+from integrator.tables import DBTable
+from integrator.util import ObtainDataError
+
+
+@pytest.mark.parametrize('fuse_queries', [False, True])
+def test_projection_equals_full_selection(postcode_db, fuse_queries):
+    df = postcode_db.cohort(500, seed=14)
+    everything = postcode_db.collect(df, sources=[Income(postcode_db.engine), IndexMultipleDeprivation(postcode_db.engine)])
+    projected = postcode_db.collect(df, sources=[Income(postcode_db.engine, columns=['net_annual_income']), IndexMultipleDeprivation(postcode_db.engine, columns='IOMDID')], fuse_queries=fuse_queries)
+    assert list(projected.columns) == ['id', 'pc', 'lsoa', 'msoa', 'Income.net_annual_income', 'IndexMultipleDeprivation.IOMDID']
+    pd.testing.assert_frame_equal(projected, everything[projected.columns])
+
+
+def test_projection_in_the_query(postcode_db):
+    d = Income(postcode_db.engine, columns=['net_annual_income'])
+    d.obtain_data(pd.Series(['E02000000'], name='msoa'))
+    assert 'net_annual_income' in d._query_sql and 'households' not in d._query_sql
+
+
+def test_projection_unknown_column(postcode_db):
+    with pytest.raises(ObtainDataError, match='income_net'):
+        Income(postcode_db.engine, columns=['income_net'])
+
+
+def test_projection_requires_columns_placeholder(postcode_db):
+    with pytest.raises(ObtainDataError, match='does not allow selecting columns'):
+        DBTable('msoa', 'select * from (values {references}) tempT(msoa)', postcode_db.engine, columns=['x'], table='compiled.income')
+    with pytest.raises(ObtainDataError):
+        IndexMultipleDeprivation(postcode_db.engine, mode='only_scores', columns=['IOMDIS'])
@@ -0,0 +1,85 @@
+"""
+Tests of the columnar sidecars of CSVTable
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.cache import FileStore
+from integrator.sidecar import CSVSidecar
+from integrator.tables import CSVTable
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = FileStore()
+    monkeypatch.setattr(CSVTable, 'store', store)
+    return store
+
+
+@pytest.fixture
+def table(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'k': ['k{}'.format(i) for i in range(1000)], 'a': rng.integers(0, 100, 1000), 'b': rng.random(1000), 'c': rng.choice(['x', 'y', None], 1000)})
+    path = str(tmp_path / 'table.csv')
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_sidecar_equals_parsing(table):
+    keys = pd.Series(['k{}'.format(i) for i in range(0, 1000, 7)], name='k')
+    parsed = CSVTable('k', table, name='T').obtain_data(keys, warning=False)
+    t = CSVTable('k', table, name='T', sidecar=True)
+    assert os.path.exists(table + '.arrow')
+    pd.testing.assert_frame_equal(t.obtain_data(keys, warning=False), parsed) # same frames and types
+
+
+def test_sidecar_frames_kept_apart(table, store):
+    CSVTable('k', table, ['a'])
+    CSVTable('k', table, ['a'], sidecar=True)
+    assert len(store) == 2 and store.misses == 2 # the frames of the sidecar are not the frames parsed
+
+
+def test_sidecar_reused(table, capsys):
+    CSVSidecar(table).prepare()
+    assert 'Converting' in capsys.readouterr().out
+    sidecar = CSVSidecar(table)
+    assert sidecar.is_valid()
+    mtime = os.path.getmtime(table + '.arrow')
+    assert sidecar.prepare()
+    assert os.path.getmtime(table + '.arrow') == mtime and capsys.readouterr().out == ''
+    os.utime(table, (0, os.path.getmtime(table) + 10)) # only the modification time changed: the hash matches
+    assert sidecar.is_valid()
+
+
+def test_sidecar_invalidated(table):
+    sidecar = CSVSidecar(table)
+    sidecar.prepare()
+    stat = os.stat(table)
+    df = pd.read_csv(table)
+    df.loc[0, 'a'] = 1000 # a different size
+    df.to_csv(table, index=False)
+    assert not sidecar.is_valid()
+    sidecar.prepare()
+    assert sidecar.read(['a'])['a'].iloc[0] == 1000
+    df.loc[0, 'a'] = 2000 # the same size
+    df.to_csv(table, index=False)
+    os.utime(table, (0, stat.st_mtime + 20))
+    assert not sidecar.is_valid()
+    assert CSVTable('k', table, ['a'], name='T', sidecar=True).obtain_data(pd.Series(['k0']), warning=False)['T.a'].tolist() == [2000]
+
+
+def test_sidecar_reading_options(table):
+    CSVSidecar(table).prepare()
+    assert not CSVSidecar(table, low_memory=False).is_valid()
+    assert not CSVSidecar(table, delimiter=';').is_valid()
+
+
+def test_sidecar_not_writable(table, monkeypatch):
+    monkeypatch.setattr(CSVSidecar, 'write', lambda self: (_ for _ in ()).throw(OSError('read only')))
+    t = CSVTable('k', table, ['a'], name='T', sidecar=True) # the file is parsed
+    assert t._sidecar is None and not os.path.exists(table + '.arrow')
+    assert t.obtain_data(pd.Series(['k1']), warning=False)['T.a'].notna().all()
@@ -0,0 +1,98 @@
+"""
+Tests of the in-memory temporal engine of DBTableTimed
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.tables import DBTableTimed
+from integrator.temporal import TemporalIndex
+from integrator.util import ObtainDataError
+
+
+MODES = [(None, {}),
+         ('after', {'ref_date': 'd1'}),
+         ('before', {'ref_date': 'd1'}),
+         ('between', {'begin_date': 'd1', 'end_date': 'd2'}),
+         ('outside', {'begin_date': 'd1', 'end_date': 'd2'})]
+
+
+class Events(DBTableTimed):
+    """
+    The events table: the query returns the columns of the in-memory engine (the event found, the events on its date and their average).
+    """
+    TEMPORAL_QUERY = True
+
+    def __init__(self, engine, temporal_engine='sql', **options):
+        query = """
+            WITH filtering_part AS (SELECT * FROM (values {references}) tempT({referencevars})),
+            preselect AS (
+                SELECT presence.identifier, {OPERATION}(presence.{DATEVARIABLE}) AS CONDITION_DATE {AS_TERM}
+                FROM filtering_part LEFT JOIN (SELECT identifier, {DATEVARIABLE} FROM events) AS presence ON filtering_part.identifier = presence.identifier
+                {WHERE}
+                GROUP BY presence.identifier {GROUPBY_TERM})
+            SELECT p.*, count(*) AS AMT_MEASURES, avg(e.val) AS val
+            FROM preselect p INNER JOIN events e ON p.identifier = e.identifier AND p.CONDITION_DATE = e.edate
+            WHERE p.identifier IS NOT NULL
+            GROUP BY ALL
+            """
+        super().__init__('identifier', query, engine, rename=False, name='Events', table_date_variable='edate', table='events', temporal_engine=temporal_engine, **options)
+
+
+@pytest.fixture
+def events(engine):
+    rng = np.random.default_rng(2)
+    n = 2000
+    ev = pd.DataFrame({'identifier': rng.integers(0, 80, n).astype(str), 'edate': pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 1500, n), unit='D'), 'val': rng.normal(size=n)})
+    ev.to_sql('events', con=engine, index=False)
+    inp = pd.DataFrame({'identifier': rng.integers(0, 90, 200).astype(str), 'd1': pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.integers(0, 900, 200), unit='D')})
+    inp['d2'] = inp['d1'] + pd.to_timedelta(rng.integers(0, 300, 200), unit='D')
+    return inp
+
+
+def obtain(d, inp):
+    ret = d.obtain_data(inp[d.reference])
+    for c in ['CONDITION_DATE'] + d.reference[1:]:
+        ret[c] = pd.to_datetime(ret[c]).astype('datetime64[ns]')
+    return ret.sort_values(d.reference).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('first_presence', [None, True])
+@pytest.mark.parametrize('delay', [None, -20, 15])
+@pytest.mark.parametrize('mode, dates', MODES)
+def test_memory_equals_sql(engine, events, mode, dates, delay, first_presence):
+    if mode == 'outside' and delay:
+        pytest.skip('the range of the mode "outside" is not shifted')
+    sql = obtain(Events(engine, mode=mode, delay=delay, first_presence=first_presence, **dates), events)
+    memory = obtain(DBTableTimed('identifier', None, engine, rename=False, name='Events', mode=mode, delay=delay, first_presence=first_presence, table_date_variable='edate', table='events', temporal_engine='memory', **dates), events)
+    assert len(sql) > 0
+    assert sorted(memory.columns) == sorted(sql.columns)
+    pd.testing.assert_frame_equal(memory, sql[memory.columns], check_dtype=False)
+
+
+def test_temporal_index_groups_the_dates():
+    df = pd.DataFrame({'id': [1, 1, 1, 2], 'date': pd.to_datetime(['2020-01-01', '2020-01-01', '2020-02-01', '2020-01-01']), 'v': [1.0, 3.0, 5.0, 7.0], 's': ['a', 'b', 'c', 'd']})
+    index = TemporalIndex(df, 'id', 'date')
+    assert index.columns == ['AMT_MEASURES', 'v', 's']
+    assert index.events[['AMT_MEASURES', 'v', 's']].values.tolist() == [[2, 2.0, 'a'], [1, 5.0, 'c'], [1, 7.0, 'd']]
+    position = index.search([1, 1, 2, 3], high=pd.to_datetime(['2020-01-15', '2019-01-01', '2020-01-01', '2020-01-01']), high_inclusive=False)
+    assert position.tolist() == [0, -1, -1, -1]
+
+
+def test_memory_compares_identifiers_as_text(engine):
+    pd.DataFrame({'identifier': [1, 2], 'edate': pd.to_datetime(['2020-01-01', '2020-02-01']), 'val': [1.0, 2.0]}).to_sql('events', con=engine, index=False)
+    d = DBTableTimed('identifier', None, engine, rename=False, table_date_variable='edate', table='events', temporal_engine='memory')
+    assert d.obtain_data(pd.DataFrame({'identifier': ['2', '3']}))['val'].tolist() == [2.0] # as the values searched in the database
+
+
+def test_memory_engine_rejects_queries(engine):
+    with pytest.raises(ObtainDataError, match='AMT_MEASURES'): # the columns of the engines differ
+        DBTableTimed('identifier', 'select * from (values {references}) tempT(identifier)', engine, table_date_variable='edate', table='events', temporal_engine='memory')
+    with pytest.raises(ObtainDataError, match='requires a query'):
+        DBTableTimed('identifier', None, engine, table_date_variable='edate', table='events')
+    with pytest.raises(ObtainDataError, match='events'):
+        DBTableTimed('identifier', None, engine, table_date_variable='edate', table='events', temporal_engine='memory', columns=['val'])
+    with pytest.raises(ObtainDataError):
+        DBTableTimed('identifier', None, engine, temporal_engine='memory') # without the table
+    with pytest.raises(ObtainDataError):
+        DBTableTimed('identifier', None, engine, table_date_variable='edate', table='events', temporal_engine='arrays')
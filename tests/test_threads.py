@@ -0,0 +1,18 @@
+"""
+Tests of the concurrent querying of the sources of a chunk
+"""
+
+import pandas as pd
+import pytest
+from integrator.util import ObtainDataError
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_thread_pool_equals_serial(postcode_db, max_workers):
+    df = postcode_db.cohort(1000, seed=1)
+    pd.testing.assert_frame_equal(postcode_db.collect(df, max_workers=max_workers), postcode_db.collect(df))
+
+
+def test_thread_pool_invalid_workers(postcode_db):
+    with pytest.raises(ObtainDataError):
+        postcode_db.collect(postcode_db.cohort(10), max_workers=0)
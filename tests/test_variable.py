@@ -0,0 +1,88 @@
+"""
+Tests of DBTableVariable (SQL and in-memory temporal engines)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from integrator.tables import DBTableVariable
+
+
+MODES = [(None, {}),
+         ('after', {'ref_date': 'd1'}),
+         ('before', {'ref_date': 'd1'}),
+         ('between', {'begin_date': 'd1', 'end_date': 'd2'}),
+         ('outside', {'begin_date': 'd1', 'end_date': 'd2'})]
+
+
+@pytest.fixture
+def events(engine):
+    rng = np.random.default_rng(1)
+    n = 2000
+    ev = pd.DataFrame({'identifier': rng.integers(0, 80, n).astype(str), 'edate': pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 1500, n), unit='D'), 'a': rng.normal(size=n), 'b': rng.integers(0, 10, n)})
+    ev.to_sql('events', con=engine, index=False)
+    inp = pd.DataFrame({'identifier': rng.integers(0, 90, 200).astype(str), 'd1': pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.integers(0, 900, 200), unit='D')})
+    inp['d2'] = inp['d1'] + pd.to_timedelta(rng.integers(0, 300, 200), unit='D')
+    return ev, inp
+
+
+def variable_reference(ev, inp, mode, dates, shift, first_presence):
+    """
+    The measurements expected by the README: the latest (or earliest) date of the identifier inside the window of the mode, the rows on that date and their averages.
+    """
+    shift = pd.Timedelta(days=shift or 0)
+    references = ['identifier'] + list(dates.values())
+    rows = list()
+    for _, r in inp[references].drop_duplicates().iterrows():
+        e = ev[ev['identifier'] == r['identifier']]
+        if mode == 'after':
+            e = e[e['edate'] > r['d1'] + shift]
+        elif mode == 'before':
+            e = e[e['edate'] < r['d1'] + shift]
+        elif mode == 'between':
+            e = e[(e['edate'] >= r['d1'] + shift) & (e['edate'] <= r['d2'] + shift)]
+        elif mode == 'outside': # the range is not shifted
+            e = e[(e['edate'] < r['d1']) | (e['edate'] > r['d2'])]
+        if len(e) == 0:
+            continue
+        date = e['edate'].min() if first_presence else e['edate'].max()
+        e = e[e['edate'] == date]
+        rows.append({**dict(r), 'CONDITION_DATE': date, 'AMT_MEASURES': len(e), 'avg_a': e['a'].mean(), 'avg_b': e['b'].mean()})
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize('temporal_engine, key_shipping', [('sql', 'values'), ('sql', 'temp_table'), ('memory', 'values')])
+@pytest.mark.parametrize('first_presence', [None, True])
+@pytest.mark.parametrize('shift', [None, -20, 15])
+@pytest.mark.parametrize('mode, dates', MODES)
+def test_variable_modes(engine, events, mode, dates, shift, first_presence, temporal_engine, key_shipping):
+    ev, inp = events
+    d = DBTableVariable('events', 'edate', ['a', 'b'], engine, rename=False, mode=mode, shift=shift, first_presence=first_presence, key_shipping=key_shipping, temporal_engine=temporal_engine, **dates)
+    ret = d.obtain_data(inp[d.reference])
+    for c in ['CONDITION_DATE'] + d.reference[1:]:
+        ret[c] = pd.to_datetime(ret[c]).astype('datetime64[ns]')
+    ret = ret.sort_values(d.reference).reset_index(drop=True)
+    expected = variable_reference(ev, inp, mode, dates, shift, first_presence).sort_values(d.reference).reset_index(drop=True)
+    assert len(ret) > 0
+    pd.testing.assert_frame_equal(ret, expected[list(ret.columns)], check_dtype=False)
+
+
+def test_variable_index_advice(engine):
+    d = DBTableVariable('public.events', 'edate', ['a', 'b'], engine, mode='before', ref_date='d1')
+    assert d.index_advice() == 'CREATE INDEX ix_events_identifier_edate ON public.events (identifier, edate)'
+
+
+@pytest.mark.parametrize('mode, dates', MODES)
+def test_variable_memory_equals_sql(engine, mode, dates):
+    rng = np.random.default_rng(3)
+    n = 3000
+    pd.DataFrame({'identifier': rng.integers(0, 200, n), 'edate': pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 2000, n), unit='D'), 'val': rng.integers(0, 9, n)}).to_sql('events', con=engine, index=False)
+    inp = pd.DataFrame({'identifier': rng.integers(0, 220, 400), 'd1': pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.integers(0, 900, 400), unit='D')})
+    inp['d2'] = inp['d1'] + pd.to_timedelta(rng.integers(0, 400, 400), unit='D')
+    ret = list()
+    for temporal_engine in ['sql', 'memory']:
+        d = DBTableVariable('events', 'edate', ['val'], engine, rename=False, mode=mode, shift=30 if mode != 'outside' else None, temporal_engine=temporal_engine, **dates)
+        ret.append(d.obtain_data(inp[d.reference]).sort_values(d.reference).reset_index(drop=True))
+    assert len(ret[0]) > 0
+    assert list(ret[1].columns) == list(ret[0].columns)
+    pd.testing.assert_frame_equal(ret[1], ret[0])
@@ -0,0 +1,58 @@
+"""
+Tests of the columnar output of collect_to_file
+"""
+
+import pandas as pd
+import pytest
+from integrator.util import ObtainDataError
+
+pa = pytest.importorskip('pyarrow')
+
+
+def read(output_file, output_format):
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(output_file).to_pandas()
+    with pa.memory_map(output_file) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_collect_to_file_round_trip(postcode_db, tmp_path, output_format):
+    from integrator.collector import DataCollector
+    from integrator.postcode_mapping import PostcodeMapping
+    df = postcode_db.cohort(500, seed=7)
+    output_file = str(tmp_path / 'out.{}'.format(output_format))
+    returned = DataCollector(df, sources=postcode_db.sources(), reference_sources=[PostcodeMapping], reference_engines=[postcode_db.engine], verbose=False, chunksize=100).collect_to_file(output_file, output_format=output_format)
+    expected = postcode_db.collect(df)
+    pd.testing.assert_frame_equal(returned.reset_index(drop=True), expected)
+    pd.testing.assert_frame_equal(read(output_file, output_format), expected, check_dtype=False)
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        assert pq.ParquetFile(output_file).num_row_groups == 5 # one per chunk
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_writer_conforms_chunks(tmp_path, output_format):
+    from integrator.writers import ColumnarWriter
+    output_file = str(tmp_path / 'out')
+    with ColumnarWriter(output_file, output_format) as writer:
+        writer.write(pd.DataFrame({'a': [1, 2], 'b': [None, None]}))
+        writer.write(pd.DataFrame({'a': [3, None], 'b': ['x', 'y']})) # integers with missing values, a column empty in the first chunk
+    written = read(output_file, output_format)
+    assert written['a'].tolist()[:3] == [1, 2, 3] and pd.isna(written['a'].iloc[3])
+    assert written['b'].tolist()[2:] == ['x', 'y'] and written['b'].iloc[:2].isna().all()
+
+
+def test_writer_incompatible_type(tmp_path):
+    from integrator.writers import ColumnarWriter
+    with ColumnarWriter(str(tmp_path / 'out.parquet')) as writer:
+        writer.write(pd.DataFrame({'a': [1, 2]}))
+        with pytest.raises(ObtainDataError, match='"a"'):
+            writer.write(pd.DataFrame({'a': ['x', 'y']}))
+
+
+def test_writer_invalid_format(tmp_path):
+    from integrator.writers import ColumnarWriter
+    with pytest.raises(ObtainDataError):
+        ColumnarWriter(str(tmp_path / 'out'), 'orc')